@@ -0,0 +1,100 @@
+# checklist_store.py
+# from checklist_store import ChecklistStore
+
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+"""
+Per checklist cache of eBird checklist details, so a new or late filed checklist only means
+fetching that one checklist. Each row is one checklist as returned by the API (as JSON),
+keyed by subId, with its lastEditedDt and the time we fetched it (fetchedDt), so a caller can
+refetch a checklist that has been edited since, or that was fetched before it was likely to
+be final (see missing_or_stale).
+"""
+
+# SQLite limits the number of parameters in one statement
+SQLITE_MAX_PARAMETERS = 900
+
+
+def chunked(items: List[str], size: int = SQLITE_MAX_PARAMETERS) -> Iterable[List[str]]:
+    for ix in range(0, len(items), size):
+        yield items[ix:ix + size]
+
+
+class ChecklistStore(object):
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(db_path.as_posix())
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS checklists ('
+                'subId TEXT PRIMARY KEY, lastEditedDt TEXT, fetchedDt TEXT, record TEXT)')
+
+    def _stored_dates(self, sub_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+        # {subId: (lastEditedDt, fetchedDt)} for the stored checklists among sub_ids
+        stored = {}
+        for chunk in chunked(list(sub_ids)):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._connection.execute(
+                f'SELECT subId, lastEditedDt, fetchedDt FROM checklists '
+                f'WHERE subId IN ({placeholders})', chunk)
+            stored.update({sub_id: (edited or '', fetched or '')
+                           for sub_id, edited, fetched in rows})
+
+        return stored
+
+    def last_edited(self, sub_ids: List[str]) -> Dict[str, str]:
+        # {subId: lastEditedDt} for the stored checklists among sub_ids
+        return {sub_id: edited for sub_id, (edited, _) in self._stored_dates(sub_ids).items()}
+
+    def missing_or_stale(self, sub_ids: List[str],
+                         known_last_edited: Dict[str, str] = None,
+                         fetched_before: Dict[str, str] = None,
+                         force_refresh: bool = False) -> List[str]:
+        """
+        sub_ids that need fetching: those that aren't stored, or whose stored copy is stale.
+        Dates are eBird's 'YYYY-MM-DD HH:MM' strings (or just 'YYYY-MM-DD'), so they compare
+        as strings.
+        :param sub_ids: checklist IDs
+        :param known_last_edited: {subId: lastEditedDt}, e.g. from a feed; a stored copy
+            older than this edit is stale
+        :param fetched_before: {subId: date}; a stored copy fetched before this date is stale
+        :param force_refresh: if True, every subId is refetched
+        :return: sub_ids to fetch, in order, without duplicates
+        """
+        sub_ids = list(dict.fromkeys(sub_ids))
+        if force_refresh:
+            return sub_ids
+
+        stored = self._stored_dates(sub_ids)
+        known_last_edited = known_last_edited or {}
+        fetched_before = fetched_before or {}
+
+        return [sub_id for sub_id in sub_ids
+                if sub_id not in stored or
+                known_last_edited.get(sub_id, '') > stored[sub_id][0] or
+                fetched_before.get(sub_id, '') > stored[sub_id][1]]
+
+    def put_many(self, checklists: Dict[str, dict]):
+        fetched_dt = datetime.now().strftime('%Y-%m-%d %H:%M')
+        rows = [(sub_id, checklist.get('lastEditedDt', ''), fetched_dt, json.dumps(checklist))
+                for sub_id, checklist in checklists.items()]
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO checklists (subId, lastEditedDt, fetchedDt, record) '
+                'VALUES (?, ?, ?, ?)', rows)
+
+    def get_many(self, sub_ids: List[str]) -> Dict[str, dict]:
+        # {subId: checklist} for the stored checklists among sub_ids
+        checklists = {}
+        for chunk in chunked(list(sub_ids)):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._connection.execute(
+                f'SELECT subId, record FROM checklists WHERE subId IN ({placeholders})', chunk)
+            checklists.update({sub_id: json.loads(record) for sub_id, record in rows})
+
+        return checklists
@@ -1,5 +1,5 @@
 import pandas as pd
-from text_transform import secondary_species_processing, pre_process_line
+from text_transform import normalize_many
 from parse_tally_sheets import strip_off_scientific_names
 from taxonomy_token_identify import TaxonomyTokenIdentify
 from spacy_extra import filter_to_possibles
@@ -90,28 +90,20 @@ def dataframe_to_checklist(df: pd.DataFrame, taxonomy: Taxonomy,
     tx_results = results.copy().reset_index(drop=True)
 
     tx_results.CommonNameOrig = tx_results.CommonNameOrig.fillna('')
-    t2 = strip_off_scientific_names([secondary_species_processing(pre_process_line(line)
-                                                                  ) for line in
-                                     tx_results.CommonNameOrig.values], taxonomy)
+    t2 = strip_off_scientific_names(normalize_many(tx_results.CommonNameOrig.values), taxonomy)
     tx_results['BasicTx'] = t2
     tx_results['TaxonomyLookup'] = [get_common_name(cn, taxonomy) for cn in t2]
     tx_results['LocalTx'] = ''
 
-    # See if we can fix the null common names with a translation
+    # See if we can fix the null common names with a translation. Translating to a fixpoint
+    # replaces the second translation round there used to be here
     null1 = tx_results[tx_results.TaxonomyLookup.isnull()]
     if len(null1.index):
-        t3 = [local_translation_context.apply_translations(line.lower(), True)[0] for line in
-              null1.BasicTx]
+        t3 = [txline for txline, _ in local_translation_context.translate_many(
+            [line.lower() for line in null1.BasicTx], to_fixpoint=True)]
         tx_results.at[null1.index, 'LocalTx'] = t3
         tx_results.at[null1.index, 'TaxonomyLookup'] = [get_common_name(cn, taxonomy) for cn in t3]
 
-    # Do one more translation round
-    null2 = tx_results[tx_results.TaxonomyLookup.isnull()]
-    if len(null2.index):
-        t4 = [local_translation_context.apply_translations(line.lower(), True)[0] for line in
-              null2.LocalTx]
-        tx_results.at[null2.index, 'TaxonomyLookup'] = [get_common_name(cn, taxonomy) for cn in t4]
-
     null3 = tx_results[tx_results.TaxonomyLookup.isnull()]
     if len(null3.index):
         common_names = []
@@ -155,15 +147,15 @@ def dataframe_to_checklist(df: pd.DataFrame, taxonomy: Taxonomy,
 
 
 def get_common_name(cn, taxonomy):
-    row = taxonomy.find_local_name_row(cn)
-    return row.comName if row is not None else None
+    record = taxonomy.find_local_name_record(cn)
+    return record.comName if record is not None else None
 
 
 def find_base_species(tx_results, unknown_idx, taxonomy):
     while unknown_idx > 0:
         tl = tx_results.iloc[unknown_idx].TaxonomyLookup
         if tl is not None:
-            row = taxonomy.find_local_name_row(tl)
-            return row.comName if row.Category == 'species' else taxonomy.report_as(tl)
+            record = taxonomy.find_local_name_record(tl)
+            return record.comName if record.Category == 'species' else taxonomy.report_as(tl)
         unknown_idx -= 1
     return None
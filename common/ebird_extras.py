@@ -1,5 +1,6 @@
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 from pathlib import Path
 from typing import Optional, List, Union
@@ -7,38 +8,52 @@ from typing import Optional, List, Union
 import geopandas as gpd
 import pandas as pd
 import requests
-# https://pypi.org/project/ebird-api/
-from ebird.api import Client
 from shapely.geometry import Point
 from singleton_decorator import singleton
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Dict
 
-from utilities_misc import get_credential, compute_hash
+from utilities_misc import get_credential
+from ebird_fetcher import EBirdFetcher
+from ebird_transport import EBirdTransport, api_date_path
+from checklist_store import ChecklistStore
 from common_paths import cache_path
 
 EBIRD_DEFAULT_LOCALE = 'en'
+# Most results the API returns for one request, e.g. checklists on a date
+EBIRD_API_MAX_RESULTS = 200
+# Concurrent (region, date) requests in get_visits_for_dates
+DEFAULT_VISITS_WORKERS = 8
+# Checklist fields that aren't carried into the flattened details ('obs' is expanded)
+CHECKLIST_FIELDS_TO_DROP = {'obs', 'subAux', 'subAuxAi'}
+# Observers often correct checklists in the days after a count, so a cached checklist that
+# was fetched less than this many days after its date is refetched, but not more often than
+# every DETAILS_REFETCH_HOURS
+DETAILS_SETTLE_DAYS = 14
+DETAILS_REFETCH_HOURS = 12
 
 """
-This class contains additional methods to access eBird not supported by the ebird.api
-package (https://pypi.org/project/ebird-api/).
+This class contains the methods we use to access eBird. All the REST calls, including the
+ones that used to go through the ebird.api package (https://pypi.org/project/ebird-api/),
+share one EBirdTransport, so they share its connection pool, retries and metrics.
 """
 
 
 @singleton
 class EBirdExtra(object):
     def __init__(self, ebird_credential_path: Path,
-                 xcache_path: Path = cache_path, country: str = 'US'):
+                 xcache_path: Path = cache_path, country: str = 'US',
+                 transport: EBirdTransport = None):
         """
 
         :param ebird_credential_path: Path to YAML files for eBird API Key credentials
         :param xcache_path: Where files like subnational2 codes and taxonomy are cached
         :param country: This is only important when retrieving and caching subnational2 codes
+        :param transport: for all eBird requests; by default one for api.ebird.org
         """
         self.ebird_credential_path = ebird_credential_path
         self.cache_path = xcache_path
         self.country = country
-        self.ebird_client = None
         self.__ebird_api_key = get_credential(self.ebird_credential_path)
         if not self.__ebird_api_key:
             print(f'No API key found for eBird')
@@ -48,8 +63,11 @@ class EBirdExtra(object):
         self._cached_historic_path = self._cache_path / 'historic'
         self._cached_details_path = self._cache_path / 'details'
 
-        if self.__ebird_api_key:
-            self.ebird_client = Client(self.__ebird_api_key, EBIRD_DEFAULT_LOCALE)
+        self.transport = transport or EBirdTransport(self.__ebird_api_key)
+
+        # Concurrent, rate limited checklist fetches for get_details, cached per checklist
+        self.fetcher = EBirdFetcher(self.transport)
+        self.checklist_store = ChecklistStore(self._cached_details_path / 'checklists.sqlite')
 
         # We do this as a side effect as a user convenience. The list of subnational2 codes
         # are saved in the cache for reference. subnational2 codes are the region codes
@@ -62,10 +80,16 @@ class EBirdExtra(object):
         except Exception as ee:
             print(f'Failed to get subnational2 codes: {ee}')
 
-    def get_taxonomy_from_ebird(self) -> Optional[pd.DataFrame]:
+    def get_taxonomy_from_ebird(self, version: str = None) -> Optional[pd.DataFrame]:
+        # https://api.ebird.org/v2/ref/taxonomy/ebird
+        # version: e.g. '2019' for that year's taxonomy; the current one if None
         taxonomy_from_ebird = None
-        if self.ebird_client:
-            taxonomy_from_ebird = pd.DataFrame(self.ebird_client.get_taxonomy()).fillna('')
+        if self.__ebird_api_key:
+            xparams = {'locale': EBIRD_DEFAULT_LOCALE, 'fmt': 'json'}
+            if version:
+                xparams['version'] = version
+            taxonomy = self.transport.get_json('ref/taxonomy/ebird', xparams)
+            taxonomy_from_ebird = pd.DataFrame(taxonomy).fillna('')
 
         return taxonomy_from_ebird
 
@@ -79,12 +103,10 @@ class EBirdExtra(object):
         # https://api.ebird.org/v2/product/stats/{{regionCode}}/{{y}}/{{m}}/{{d}}
         stats = pd.DataFrame()
         try:
-            api_url_base = 'https://api.ebird.org/v2/product/stats/'
-            url = f'{api_url_base}{region_code}/{year}/{month}/{day}'
-            api_auth_header = {'X-eBirdApiToken': self.__ebird_api_key}
+            path = f'product/stats/{region_code}/{year}/{month}/{day}'
 
-            print(url)
-            rr = requests.get(url, params=None, headers=api_auth_header, stream=True)
+            print(self.transport.url(path))
+            rr = self.transport.get(path)
             if rr.status_code == requests.codes.ok:
                 stats = rr.json()  # pd.DataFrame()
             rr.raise_for_status()
@@ -104,11 +126,7 @@ class EBirdExtra(object):
         # https://api.ebird.org/v2/data/obs/{{regionCode}}/historic/{{y}}/{{m}}/{{d}}
         stats = pd.DataFrame()
         try:
-            api_url_base = 'https://api.ebird.org/v2/data/obs/'
-            url = f'{api_url_base}{region_code}/historic/{year}/{month}/{day}'
-            api_auth_header = {'X-eBirdApiToken': self.__ebird_api_key}
-
-            rr = requests.get(url, params=None, headers=api_auth_header, stream=True)
+            rr = self.transport.get(f'data/obs/{region_code}/historic/{year}/{month}/{day}')
             if rr.status_code == requests.codes.ok:
                 stats = pd.DataFrame(rr.json())
             rr.raise_for_status()
@@ -125,14 +143,10 @@ class EBirdExtra(object):
         oxdate = datetime.strptime(xdate, '%Y-%m-%d')
         results = pd.DataFrame()
         try:
-            api_url_base = 'https://api.ebird.org/v2/product/lists'
-            api_auth_header = {'X-eBirdApiToken': self.__ebird_api_key}
-            url = f'{api_url_base}/{region_code}/{oxdate.year}/{oxdate.month}/{oxdate.day}'
-            xparams = {'maxResults': 200}
-
-            rr = requests.get(url, params=xparams,
-                              headers=api_auth_header,
-                              stream=True)  # params=params, headers=api_auth_header,
+            path = f'product/lists/{region_code}/{oxdate.year}/{oxdate.month}/{oxdate.day}'
+            xparams = {'maxResults': EBIRD_API_MAX_RESULTS}
+
+            rr = self.transport.get(path, params=xparams)
             if rr.status_code == requests.codes.ok:
                 results = pd.DataFrame(rr.json())
             rr.raise_for_status()
@@ -150,11 +164,7 @@ class EBirdExtra(object):
 
         results = pd.DataFrame()
         try:
-            api_url_base = 'https://api.ebird.org/v2/product/spplist'
-            api_auth_header = {'X-eBirdApiToken': self.__ebird_api_key}
-            url = f'{api_url_base}/{loc_id}'
-
-            rr = requests.get(url, params=None, headers=api_auth_header, stream=True)
+            rr = self.transport.get(f'product/spplist/{loc_id}')
             #         print(rr.request.headers)
             if rr.status_code == requests.codes.ok:
                 results = pd.DataFrame(rr.json())
@@ -174,9 +184,8 @@ class EBirdExtra(object):
         try:
             if not subnational1_path.exists():
                 print(f'Creating eBird subnational1 region cache...')
-                subnational1_df = pd.DataFrame(self.ebird_client.get_regions('subnational1',
-                                                                             self.country)).fillna(
-                    '')
+                subnational1_df = pd.DataFrame(self.get_regions('subnational1',
+                                                                self.country)).fillna('')
                 subnational1_df.to_csv(subnational1_path, index=False)
             else:
                 subnational1_df = pd.read_csv(subnational1_path, index_col=False)
@@ -207,8 +216,7 @@ class EBirdExtra(object):
                 subnational2_list = []
                 for row in subnational1_df.itertuples():
                     state, code = row.name, row.code
-                    subnational2s = pd.DataFrame(
-                        self.ebird_client.get_regions('subnational2', code))
+                    subnational2s = pd.DataFrame(self.get_regions('subnational2', code))
                     subnational2s['state'] = state
                     subnational2_list.append(subnational2s)
 
@@ -247,20 +255,17 @@ class EBirdExtra(object):
             if cached_visits_path.is_file():
                 visits_expanded = pd.read_csv(cached_visits_path, index_col=False)
             else:
-                visits = pd.DataFrame(self.ebird_client.get_visits(region_code, date_of_count))
-
-                # Make a dataframe out of the 'loc' column
-                locs = []
-                for idx, row in visits.iterrows():
-                    locs.append(row['loc'])
-
-                locs_df = pd.DataFrame(locs)
-                locs_cols = ['loc_' + col for col in locs_df.columns]
-                locs_df.columns = locs_cols
-
-                visits_expanded = pd.concat([visits, locs_df],
-                                            axis=1).drop(['loc'],
-                                                         axis=1).reset_index(drop=True)
+                visits = self.get_visits_on_date(region_code, date_of_count)
+                if not visits:
+                    # Not cached, checklists may still be submitted for the date
+                    print(f'No visits for {region_code} on {date_of_count}')
+                    return visits_expanded
+
+                # The 'loc' dictionaries become loc_ columns, after the other visit columns
+                visits_expanded = pd.json_normalize(visits, max_level=1, sep='_')
+                locs_cols = [col for col in visits_expanded.columns if col.startswith('loc_')]
+                visit_cols = [col for col in visits_expanded.columns if col not in locs_cols]
+                visits_expanded = visits_expanded.reindex(columns=visit_cols + locs_cols)
 
                 visits_expanded['RegionCode'] = region_code
 
@@ -271,9 +276,23 @@ class EBirdExtra(object):
 
         return visits_expanded
 
+    def get_regions(self, region_type: str, region_code: str) -> List[dict]:
+        # https://api.ebird.org/v2/ref/region/list/{{regionType}}/{{parentRegionCode}}
+        # region_type is e.g. 'subnational1'; returns [{'code': ..., 'name': ...}, ...]
+        return self.transport.get_json(f'ref/region/list/{region_type}/{region_code}')
+
+    def get_visits_on_date(self, region_code: str, date_of_count: str) -> List[dict]:
+        # https://api.ebird.org/v2/product/lists/{{regionCode}}/{{y}}/{{m}}/{{d}}
+        # Checklists submitted for a date, as ebird.api's get_visits returned them. Its
+        # maxVisits argument is sent to the API as maxResults; at most EBIRD_API_MAX_RESULTS
+        # checklists come back per region and date
+        path = f'product/lists/{region_code}/{api_date_path(date_of_count)}'
+        return self.transport.get_json(path, {'maxResults': EBIRD_API_MAX_RESULTS,
+                                              'sortKey': 'obs_dt'})
+
     def get_checklist(self, sub_id: str):
         try:
-            rx = self.ebird_client.get_checklist(sub_id)
+            rx = self.fetcher.get_checklist(sub_id)
         except Exception as ee:
             print(f'sub_id: {sub_id}')
             print(ee)
@@ -310,12 +329,9 @@ class EBirdExtra(object):
         headers = ['locid', 'r1', 'r2', 'r3', 'lat', 'lng', 'name', 'date', 'num']
         results = pd.DataFrame()
         try:
-            api_url_base = 'https://api.ebird.org/v2/ref/hotspot'
             # API token not currently required, but may be in future
-            # api_auth_header = {'X-eBirdApiToken': self.__ebird_api_key}
-            url = f'{api_url_base}/{region_code}'
             # params = None  # { 'maxResults' : 200}
-            rr = requests.get(url, stream=True)  # params=params, headers=api_auth_header,
+            rr = self.transport.get(f'ref/hotspot/{region_code}', auth=False)
             if rr.status_code == requests.codes.ok:
                 results = pd.read_csv(StringIO(rr.text), names=headers, index_col=False)
             rr.raise_for_status()
@@ -336,26 +352,20 @@ class EBirdExtra(object):
 
     # --------------------------- VISITS ---------------------------
 
-    def get_visits(self, region_codes: List[str], date_of_count: str):
+    def get_visits(self, region_codes: List[str], date_of_count: str,
+                   max_workers: int = DEFAULT_VISITS_WORKERS):
         # was: hotspot_data_for_regions
-        first_region, *remaining_regions = region_codes
-        combined = self.get_visits_expanded(first_region, date_of_count)
-
-        for rc in remaining_regions:
-            region_visits = self.get_visits_expanded(rc, date_of_count)
-            combined = pd.concat([combined, region_visits], ignore_index=True)
+        return self.get_visits_for_dates(region_codes, [date_of_count], max_workers)
 
-        return combined
+    def get_visits_for_dates(self, region_codes: List[str], dates: List[str],
+                             max_workers: int = DEFAULT_VISITS_WORKERS):
+        # Every (region, date) pair is fetched (or read from the cache) concurrently, within the
+        # transport's rate limit; the result is in date, then region, order as before
+        pairs = [(region_code, xdate) for xdate in dates for region_code in region_codes]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            visits = list(executor.map(lambda pair: self.get_visits_expanded(*pair), pairs))
 
-    def get_visits_for_dates(self, region_codes: List[str], dates: List[str]):
-        first_date, *remaining_dates = dates
-        combined = self.get_visits(region_codes, first_date)
-
-        for xdate in remaining_dates:
-            date_visits = self.get_visits(region_codes, xdate)
-            combined = pd.concat([combined, date_visits], ignore_index=True)
-
-        return combined
+        return pd.concat(visits, ignore_index=True)
 
     def get_recent_observations_for_region(self, region_code: str,
                                            back: int = 14,
@@ -369,13 +379,8 @@ class EBirdExtra(object):
         # 2020-06-06 10:03	113	POINT (-122.10234 37.43515)
         results = pd.DataFrame()
         try:
-            api_url_base = 'https://api.ebird.org/v2/data/obs'
-            api_auth_header = {'X-eBirdApiToken': self.__ebird_api_key}
-            url = f'{api_url_base}/{region_code}/recent'
             xparams = None  # { 'maxResults' : 200}
-            rr = requests.get(url, params=xparams,
-                              headers=api_auth_header,
-                              stream=True)  # params=params, headers=api_auth_header,
+            rr = self.transport.get(f'data/obs/{region_code}/recent', params=xparams)
             if rr.status_code == requests.codes.ok:
                 results = pd.DataFrame(rr.json())
             rr.raise_for_status()
@@ -391,79 +396,79 @@ class EBirdExtra(object):
     def convert_date_range_to_date_str(drange) -> List[str]:
         return [ds.strftime('%Y-%m-%d') for ds in drange]
 
-    def get_details_for_dates(self, subids_by_date: Dict[str, List[str]], dates: List[str]):
+    def get_details_for_dates(self, subids_by_date: Dict[str, List[str]], dates: List[str],
+                              force_refresh: bool = False):
         # Note that by construction, visits only contains data for dates we care about
         # so we don't need to filter for that
-        first_date, *remaining_dates = dates
-        subids = subids_by_date.get(first_date, None)
-        combined = self.get_details(subids, first_date)
+        # Fetch everything missing or stale for all the dates in one go, then assemble by date
+        # force_refresh: refetch every checklist, even if it is cached
+        all_subids = []
+        fetched_before = {}
+        for xdate in dates:
+            subids = subids_by_date.get(xdate) or []
+            all_subids.extend(subids)
+            fetched_before.update(dict.fromkeys(subids, self.refetch_if_fetched_before(xdate)))
 
-        for xdate in remaining_dates:
-            subids = subids_by_date.get(xdate, None)
-            details = self.get_details(subids, xdate)
-            combined = pd.concat([combined, details], ignore_index=True)
+        self.fetch_missing_checklists(all_subids, fetched_before=fetched_before,
+                                      force_refresh=force_refresh)
 
-        return combined
+        details_by_date = [self.get_details(subids_by_date.get(xdate, None), xdate, fetch=False)
+                           for xdate in dates]
 
-    def get_details(self, subids: List[str], date_of_count: str):
+        return pd.concat(details_by_date, ignore_index=True)
+
+    @staticmethod
+    def refetch_if_fetched_before(xdate: str) -> str:
+        # A cached checklist dated xdate is stale if it was fetched before this time
+        # (see DETAILS_SETTLE_DAYS)
+        settled = datetime.strptime(xdate, '%Y-%m-%d') + timedelta(days=DETAILS_SETTLE_DAYS)
+        last_refetch = datetime.now() - timedelta(hours=DETAILS_REFETCH_HOURS)
+
+        return min(settled, last_refetch).strftime('%Y-%m-%d %H:%M')
+
+    def fetch_missing_checklists(self, subids: List[str],
+                                 known_last_edited: Dict[str, str] = None,
+                                 fetched_before: Dict[str, str] = None,
+                                 force_refresh: bool = False):
+        # Fetch only the checklists that aren't in the store, or are stale
+        # (see ChecklistStore.missing_or_stale)
+        to_fetch = self.checklist_store.missing_or_stale(subids, known_last_edited,
+                                                         fetched_before, force_refresh)
+        if to_fetch:
+            print(f'Fetching {len(to_fetch)} of {len(set(subids))} checklists')
+            fetched = self.fetcher.fetch_checklists(to_fetch, raise_on_error=False)
+            self.checklist_store.put_many(fetched)
+
+    def get_details(self, subids: List[str], date_of_count: str, fetch: bool = True):
         """
-        Return a dataframe with the "obs" fields flattened. Will cache on disk
+        Return a dataframe with the "obs" fields flattened. Checklists are cached one by
+        one (see ChecklistStore), so only new or stale ones are fetched
         Leave enhancement and other expansions for elsewhere
-        Pass in all subids for date
         :param subids: list of checklist IDs
-        :param date_of_count: This is used for caching; assumes all subids are for same date
+        :param date_of_count: the date of the checklists, 'YYYY-MM-DD'
+        :param fetch: if False, only use cached checklists (get_details_for_dates has
+            already fetched them)
         :return: dataframe with the "obs" fields flattened
-
-        visits-US-CA-085-2019-12-15.csv
-        ebird_details_path
         """
-        subids_hash = compute_hash(''.join(subids), 12)
-        sdate = datetime.strptime(date_of_count, '%Y-%m-%d').strftime('%Y%m%d')
-
+        subids = subids or []
         details = pd.DataFrame()
 
-        # Look in cache first
-        # Name is S<date>-<hash>.csv
-        details_path = self._cached_details_path / f'S{sdate}-{subids_hash}.csv'
-
         try:
-            if not details_path.exists():
-                detailed_checklists = []
-                for subid in subids:
-                    # print(f'subid: {subid}')
-                    cdict = self.get_checklist(subid)
-                    # if cdict is None:
-                    #     continue
-                    # print(subid, cdict)
-                    # Birdathon iOS version 1.4.1 adds the subAux field, which breaks
-                    # turning this into a dataframe directly
-                    if 'subAux' in cdict.keys():
-                        del cdict['subAux']
-                    if 'subAuxAi' in cdict.keys():
-                        del cdict['subAuxAi']
-                    checklist = pd.DataFrame(cdict)
-                    # Not every checklist has groupId, so add if not there
-                    # We need it later for detecting duplicate checklists (e.g. shared)
-                    if 'groupId' not in checklist.columns:
-                        checklist['groupId'] = None
-                    if not checklist.empty:
-                        detailed_checklists.append(checklist)
-
-                if len(detailed_checklists) == 0:
-                    details = pd.DataFrame()
-                else:
-                    if len(detailed_checklists) > 1:
-                        details = pd.concat(detailed_checklists, axis=0, ignore_index=True)
-                    elif len(detailed_checklists) == 1:
-                        details = detailed_checklists[0]
-                    details = self.flatten_detail_observations(details)
-                details.to_csv(details_path, index=False)
-            else:
-                details = pd.read_csv(details_path, index_col=False)
+            if fetch:
+                refetch_before = self.refetch_if_fetched_before(date_of_count)
+                self.fetch_missing_checklists(
+                    subids, fetched_before=dict.fromkeys(subids, refetch_before))
+            checklists = self.checklist_store.get_many(subids)
+            missing = [subid for subid in subids if subid not in checklists]
+            if missing:
+                print(f'{date_of_count}: no details for {len(missing)} checklists: '
+                      f'{", ".join(missing)}')
+
+            details = self.flatten_checklists([checklists[subid] for subid in subids
+                                               if subid in checklists])
 
         except Exception as ee:
             print(ee)
-            print(cdict)
             traceback.print_exc(file=sys.stdout)
 
         return details
@@ -471,6 +476,10 @@ class EBirdExtra(object):
     def get_api_key(self):
         return self.__ebird_api_key
 
+    def transport_metrics(self) -> dict:
+        # Request count, errors, bytes and latency histogram for all eBird calls so far
+        return self.transport.metrics()
+
     """
     Sample observation entry
         {'speciesCode': 'rocpig1',
@@ -487,15 +496,20 @@ class EBirdExtra(object):
     """
 
     @staticmethod
-    def flatten_detail_observations(details: pd.DataFrame) -> pd.DataFrame:
-
-        details_list = []  # make a list of dictionaries, then dataframe
-        for ix, row in details.iterrows():
-            rowdict = row.to_dict().copy()
-            rowdict.update(row.obs)
-            del rowdict['obs']
-            details_list.append(rowdict)
-
-        flattened_details = pd.DataFrame(details_list)
-
-        return flattened_details
+    def flatten_checklists(checklists: List[dict]) -> pd.DataFrame:
+        """
+        One row per observation, built straight from the checklist JSON: the checklist
+        fields followed by the observation's fields (which win where both have one)
+        """
+        records = []
+        for checklist in checklists:
+            # Birdathon iOS version 1.4.1 adds the subAux field, which breaks
+            # turning this into a dataframe directly
+            base = {key: value for key, value in checklist.items()
+                    if key not in CHECKLIST_FIELDS_TO_DROP}
+            # Not every checklist has groupId, so add if not there
+            # We need it later for detecting duplicate checklists (e.g. shared)
+            base.setdefault('groupId', None)
+            records.extend({**base, **obs} for obs in checklist.get('obs') or [])
+
+        return pd.DataFrame.from_records(records) if records else pd.DataFrame()
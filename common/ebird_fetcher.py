@@ -0,0 +1,75 @@
+# ebird_fetcher.py
+# from ebird_fetcher import EBirdFetcher, FetchError
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+from ebird_transport import EBirdTransport
+
+"""
+Fetches many eBird checklists at once. Requests go out from a bounded thread pool through an
+EBirdTransport (pooled session, retries with backoff on 429 and 5xx), whose token bucket
+rate limits them along with every other eBird request.
+
+The transport can point at a local stub server for testing, e.g.
+    fetcher = EBirdFetcher(EBirdTransport('key', base_url='http://127.0.0.1:8000/v2'))
+    checklists = fetcher.fetch_checklists(['S62345617'])
+"""
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class FetchError(Exception):
+    pass
+
+
+class EBirdFetcher(object):
+    def __init__(self, transport: EBirdTransport,
+                 max_workers: int = DEFAULT_MAX_WORKERS):
+        self.transport = transport
+        self.max_workers = max_workers
+
+    def get_checklist(self, sub_id: str) -> dict:
+        # https://api.ebird.org/v2/product/checklist/view/{{subId}}
+        return self.transport.get_json(f'product/checklist/view/{sub_id}')
+
+    def fetch_checklists(self, sub_ids: List[str],
+                         progress_every: int = 100,
+                         raise_on_error: bool = True) -> Dict[str, dict]:
+        """
+        Fetch checklists concurrently
+        :param sub_ids: checklist IDs
+        :param progress_every: print progress every this many checklists (0 for none)
+        :param raise_on_error: if False, failures are just reported and left out of the result
+        :return: {subId: checklist}, for every subId
+        :raises FetchError: if any checklist could not be fetched, after all have been tried
+        """
+        checklists = {}
+        errors = {}
+        sub_ids = list(dict.fromkeys(sub_ids))
+        num_sub_ids = len(sub_ids)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.get_checklist, sub_id): sub_id for sub_id in sub_ids}
+            for future in as_completed(futures):
+                sub_id = futures[future]
+                try:
+                    checklists[sub_id] = future.result()
+                except Exception as ee:
+                    errors[sub_id] = str(ee)
+
+                done = len(checklists) + len(errors)
+                if progress_every and (done % progress_every == 0 or done == num_sub_ids):
+                    print(f'Fetched {done}/{num_sub_ids} checklists '
+                          f'({time.perf_counter() - t0:.1f}s)')
+
+        if errors:
+            for sub_id, error in errors.items():
+                print(f'sub_id: {sub_id}: {error}')
+            if not raise_on_error:
+                print(f'Failed to fetch {len(errors)} of {num_sub_ids} checklists')
+                return checklists
+            raise FetchError(f'Failed to fetch {len(errors)} of {num_sub_ids} checklists')
+
+        return checklists
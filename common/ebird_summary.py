@@ -45,8 +45,8 @@ def index_of_first_subtotal_column(summary: pd.DataFrame):
 def filter_additional_rare(taxonomy: Taxonomy, additional_rare: List[str]) -> List[str]:
     rare_species = []
     for cn in additional_rare:
-        row = taxonomy.find_local_name_row(cn)
-        if row is not None and row.Category == 'species':
+        record = taxonomy.find_local_name_record(cn)
+        if record is not None and record.Category == 'species':
             rare_species.append(cn)
 
     return rare_species
@@ -92,7 +92,7 @@ def create_row_for_missing_species(common_name: str,
     # can also be SPUH, ISSF etc., just something that wasn't on official list
     # The number of columns may vary based on the checklist, but we fill
     # in the ones that we know must be there
-    taxonomy_row = taxonomy.find_local_name_row(common_name)
+    taxonomy_row = taxonomy.find_local_name_record(common_name)
     if taxonomy_row is None:  # i.e. not found, drop it
         return None
 
@@ -116,8 +116,7 @@ def create_row_for_missing_species(common_name: str,
 
 def create_category_column(summary: pd.DataFrame, taxonomy: Taxonomy) -> list:
     categories = []
-    for common_name in summary.CommonName.values:
-        taxonomy_row = taxonomy.find_local_name_row(common_name)
+    for taxonomy_row in taxonomy.find_local_name_records(summary.CommonName.values):
         category = '' if taxonomy_row is None else taxonomy_row.Category
         categories.append(category)
 
@@ -0,0 +1,170 @@
+# ebird_transport.py
+# from ebird_transport import EBirdTransport, TokenBucket, EBIRD_API_BASE_URL
+
+import bisect
+import threading
+import time
+from typing import Dict, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+"""
+One keep-alive, connection pooled requests.Session for all the eBird REST calls, with the
+API key, gzip, timeouts and a retry policy (429 and 5xx, with backoff and Retry-After) set in
+one place. Every request waits on one token bucket, so concurrent callers (checklist fetches,
+visits for many regions and dates) together stay well inside the eBird API limits. Each
+request is counted in metrics(): requests, errors, bytes and a latency histogram.
+
+base_url can point at a local fake server for testing, e.g.
+    transport = EBirdTransport('key', base_url='http://127.0.0.1:8000/v2')
+"""
+
+EBIRD_API_BASE_URL = 'https://api.ebird.org/v2'
+EBIRD_API_KEY_HEADER = 'X-eBirdApiToken'
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT_SECONDS = (10.0, 60.0)  # connect, read
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 1.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+def default_retry(max_retries: int = DEFAULT_MAX_RETRIES,
+                  backoff_factor: float = DEFAULT_BACKOFF_FACTOR) -> Retry:
+    # raise_on_status=False hands back the last response, so callers see the real status
+    return Retry(total=max_retries, backoff_factor=backoff_factor,
+                 status_forcelist=RETRY_STATUS_CODES, respect_retry_after_header=True,
+                 raise_on_status=False)
+
+
+class TokenBucket(object):
+    """ Thread safe: acquire() blocks until a token is available """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class TransportMetrics(object):
+    """ Thread safe request counters """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.bytes = 0
+            self.seconds = 0.0
+            self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds: float, num_bytes: int, error: bool):
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.bytes += num_bytes
+            self.seconds += seconds
+            self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def snapshot(self) -> Dict[str, Union[int, float, Dict[str, int]]]:
+        with self._lock:
+            labels = [f'<={bound}s' for bound in LATENCY_BUCKETS] + \
+                     [f'>{LATENCY_BUCKETS[-1]}s']
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'bytes': self.bytes,
+                'mean_latency': self.seconds / self.requests if self.requests else 0.0,
+                'latency_histogram': dict(zip(labels, self.latency_counts)),
+            }
+
+
+class EBirdTransport(object):
+    def __init__(self, api_key: Optional[str],
+                 base_url: str = EBIRD_API_BASE_URL,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT_SECONDS,
+                 retry: Retry = None,
+                 requests_per_second: Optional[float] = DEFAULT_REQUESTS_PER_SECOND):
+        # requests_per_second: shared by all callers; None for no rate limit
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
+        self._metrics = TransportMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retry or default_retry())
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self._api_key_header = {EBIRD_API_KEY_HEADER: api_key} if api_key else {}
+
+    def url(self, path: str) -> str:
+        # path is relative to base_url, e.g. 'product/lists/US-CA-085/2019/12/15'
+        return f'{self.base_url}/{path.lstrip("/")}'
+
+    def get(self, path: str, params: dict = None, auth: bool = True) -> requests.Response:
+        """
+        GET path (relative to base_url), once the rate limiter allows; retries are done by the
+        session. Returns the final response whatever its status, so callers can check it or
+        raise_for_status()
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        headers = self._api_key_header if auth else None
+        t0 = time.perf_counter()
+        response = None
+        try:
+            response = self.session.get(self.url(path), params=params, headers=headers,
+                                        timeout=self.timeout)
+            return response
+        finally:
+            num_bytes = len(response.content) if response is not None else 0
+            error = response is None or not response.ok
+            self._metrics.record(time.perf_counter() - t0, num_bytes, error)
+
+    def get_json(self, path: str, params: dict = None, auth: bool = True):
+        # Raises requests.HTTPError for an error response
+        response = self.get(path, params, auth)
+        response.raise_for_status()
+
+        return response.json()
+
+    def metrics(self) -> Dict[str, Union[int, float, Dict[str, int]]]:
+        return self._metrics.snapshot()
+
+    def reset_metrics(self):
+        self._metrics.reset()
+
+    def close(self):
+        self.session.close()
+
+
+def api_date_path(xdate: str) -> str:
+    # '2020-12-26' => '2020/12/26', the form used in eBird API paths
+    return xdate.replace('-', '/')
+
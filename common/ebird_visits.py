@@ -129,8 +129,8 @@ def transform_checklist_details(details: pd.DataFrame, taxonomy: Taxonomy) -> pd
     # Data in 'obs' field returned from eBird has speciesCode but no CommonName
     if ('speciesCode' in personal_checklists.columns) and \
             ('CommonName' not in personal_checklists.columns):
-        personal_checklists['CommonName'] = personal_checklists.speciesCode.apply(
-            taxonomy.species6_to_common_name)
+        personal_checklists['CommonName'] = taxonomy.species6_to_common_names(
+            personal_checklists.speciesCode)
 
     # personal_checklists.sort_values(by=['locId', 'Name'], inplace=True)
 
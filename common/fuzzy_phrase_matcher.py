@@ -1,13 +1,173 @@
 import re
-from spacy.matcher import PhraseMatcher
+from bisect import bisect_right
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
 from spacy.tokens import Span
 import nltk
 from nltk.corpus import stopwords
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
+
+# A window of tokens stops at the first token containing one of these
+BREAK_TOKEN_PATTERN = re.compile(r'[,!?{}\[\]]')
+
+# Character n-grams used to index the features
+NGRAM_SIZE = 3
+
+# Words for PhuzzyMatcher windows: runs of anything but whitespace and the break characters,
+# which are words of their own. Names are bucketed by space separated words, so a word keeps
+# its hyphens, apostrophes, slashes etc. (e.g. "red-tailed") even where spaCy splits them
+WINDOW_WORD_PATTERN = re.compile(r'[^\s,!?{}\[\]]+|[,!?{}\[\]]')
+
+# Best names remembered per PhuzzyMatcher, by (phrase, word count)
+CANONICAL_NAME_CACHE_SIZE = 65536
+
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> Counter:
+    return Counter(text[ix:ix + n] for ix in range(len(text) - n + 1))
+
+
+class FuzzyPhraseIndex(object):
+    """
+    Features (e.g. lower case common names) bucketed by word count, and within a bucket
+    indexed by character trigrams. For a phrase, candidates() returns only the features
+    that could possibly have fuzz.ratio above the threshold:
+    - fuzz.ratio is 100 * (1 - d / (len1 + len2)), with d the insert/delete distance, so
+      it is at most 200 * min(len1, len2) / (len1 + len2)
+    - strings within edit distance d share at least max(len1, len2) - n + 1 - n * d
+      n-grams (the q-gram lemma), and d is bounded by the threshold
+    Both are bounds, so the matches are exactly those of scoring every feature.
+    """
+
+    def __init__(self, features: Iterable[str]):
+        self.features = set(features)
+        self._buckets = {}
+        bucketed: Dict[int, List[str]] = {}
+        for feature in self.features:
+            bucketed.setdefault(len(feature.split(" ")), []).append(feature)
+
+        for word_count, bucket_features in bucketed.items():
+            bucket_features = sorted(bucket_features)
+            lowered = [feature.lower() for feature in bucket_features]
+            postings: Dict[str, Tuple[List[int], List[int]]] = {}
+            for feature_id, feature_lower in enumerate(lowered):
+                for ngram, count in char_ngrams(feature_lower).items():
+                    ids, counts = postings.setdefault(ngram, ([], []))
+                    ids.append(feature_id)
+                    counts.append(count)
+            postings = {ngram: (np.array(ids), np.array(counts))
+                        for ngram, (ids, counts) in postings.items()}
+            lengths = np.array([len(feature_lower) for feature_lower in lowered])
+            self._buckets[word_count] = (bucket_features, lowered, lengths, postings)
+
+    def word_counts(self) -> List[int]:
+        return sorted(self._buckets.keys())
+
+    def candidates(self, phrase: str, word_count: int, match: float) -> List[int]:
+        # Ids (within the word_count bucket) of features worth scoring against phrase
+        _, _, lengths, postings = self._buckets[word_count]
+        phrase_length = len(phrase)
+        total_lengths = lengths + phrase_length
+        eps = 1e-9
+
+        possible = 200 * np.minimum(lengths, phrase_length) > (match - eps) * total_lengths
+        max_distance = np.ceil(total_lengths * (1 - match / 100) + eps) - 1
+        min_shared = np.maximum(lengths, phrase_length) - NGRAM_SIZE + 1 - \
+            NGRAM_SIZE * max_distance
+
+        # Only count shared n-grams if that can rule anything out
+        if np.any(possible & (min_shared > 0)):
+            shared = np.zeros(len(lengths), dtype=int)
+            for ngram, count in char_ngrams(phrase).items():
+                posting = postings.get(ngram)
+                if posting is not None:
+                    ids, counts = posting
+                    shared[ids] += np.minimum(counts, count)
+            possible &= shared >= min_shared
+
+        return list(np.flatnonzero(possible))
+
+    def matches(self, phrase: str, word_count: int, match: float) -> List[Tuple[str, float]]:
+        # (feature, score) for features in the bucket with fuzz.ratio(phrase, feature) > match
+        if word_count not in self._buckets:
+            return []
+        features, lowered, _, _ = self._buckets[word_count]
+        candidate_ids = self.candidates(phrase, word_count, match)
+        if not candidate_ids:
+            return []
+
+        choices = [lowered[ix] for ix in candidate_ids]
+        scored = process.extract(phrase, choices, scorer=fuzz.ratio, processor=None,
+                                 score_cutoff=match, limit=None)
+
+        return [(features[candidate_ids[choice_ix]], score)
+                for _, score, choice_ix in scored if score > match]
+
+
+def token_windows(tokens: List[str], word_counts: Iterable[int]) -> \
+        Iterator[Tuple[str, int, int, int, int]]:
+    """
+    Each window of word_count tokens, cut short at a token containing punctuation. As
+    before, the phrase keeps its leading space and j is the last token looked at.
+    :return: (phrase, word_count, i, j, end) with tokens[i:end] making up the phrase
+    """
+    lower_tokens = [token.lower() for token in tokens]
+    breaks = [bool(BREAK_TOKEN_PATTERN.search(token)) for token in tokens]
+    for word_count in word_counts:
+        for i in range(len(tokens) - word_count + 1):
+            matched_phrase = ""
+            j = 0
+            end = i + word_count
+            for j in range(i, i + word_count):
+                if breaks[j]:
+                    end = j
+                    break
+                matched_phrase = matched_phrase + " " + lower_tokens[j]
+            if not matched_phrase == "":
+                yield matched_phrase, word_count, i, j, end
+
+
+def fuzzy_match_tokens(index: FuzzyPhraseIndex, tokens: List[str], match) -> List[list]:
+    """
+    Each token window is compared with the features that have as many words as the window.
+    :return: [matched_phrase, feature, i, j] for each match
+    """
+    matches = []
+    for matched_phrase, word_count, i, j, _ in token_windows(tokens, index.word_counts()):
+        for feature, _ in index.matches(matched_phrase, word_count, match):
+            matches.append([matched_phrase, feature, i, j])
+    return matches
+
+
+def window_words(text: str) -> List[Tuple[int, int, str]]:
+    # (start char, end char, word) for each word of text, see WINDOW_WORD_PATTERN
+    return [(match.start(), match.end(), match.group())
+            for match in WINDOW_WORD_PATTERN.finditer(text)]
+
+
+def char_range_to_tokens(token_starts: List[int], start_char: int, end_char: int) -> \
+        Tuple[int, int]:
+    # Token range [start, end) covering text[start_char:end_char]; token_starts are the
+    # tokens' character offsets (token.idx), in order
+    return bisect_right(token_starts, start_char) - 1, bisect_right(token_starts, end_char - 1)
+
+
+def as_fuzzy_phrase_index(features: Union[FuzzyPhraseIndex, Iterable[str]]) -> FuzzyPhraseIndex:
+    # Building the index is the expensive part, so callers should build it once and reuse it
+    return features if isinstance(features, FuzzyPhraseIndex) else FuzzyPhraseIndex(features)
 
 
 # @singleton
 class PhuzzyMatcher(object):
+    """
+    Pipeline component that adds entities for fuzzy matches of a set of names (xset).
+    Windows run over the words of the text (see window_words), split the same way as the
+    names are, and each hit is mapped back to the doc tokens it covers. The best matching
+    name for a window phrase is cached and set as the span's kb_id. fuzzy_matcher is kept
+    for callers that match plain text.
+    """
     # name = "phuzzy_matcher"
 
     def __init__(self, nlp, xset, fuzzy_matcher, match, label, name="phuzzy_matcher",
@@ -15,75 +175,105 @@ class PhuzzyMatcher(object):
         self.name = name
         self.nlp = nlp
         self.xset = xset
+        self.index = as_fuzzy_phrase_index(xset)
         # print(f'xset: {len(xset)}')
         self.fuzzy_matcher = fuzzy_matcher
         self.fuzzy_matcher_stopwords = fuzzy_matcher_stopwords if stop_words else fuzzy_matcher
         self.match = match
         self.label = label
         self.stop_words = stop_words
+        self.canonical_name = lru_cache(maxsize=CANONICAL_NAME_CACHE_SIZE)(
+            self._canonical_name)
+
+    def _canonical_name(self, phrase: str, word_count: int) -> Optional[str]:
+        # Best scoring name for a window phrase, or None
+        matches = self.index.matches(phrase, word_count, self.match)
+
+        return max(matches, key=lambda match: match[1])[0] if matches else None
 
     def __call__(self, doc):
-        match_list = []
-        if self.stop_words:
-            results = self.fuzzy_matcher_stopwords(self.xset, doc.text.lower(), self.match,
-                                                   self.stop_words)
-        else:
-            results = self.fuzzy_matcher(self.xset, doc.text.lower(), self.match)
-        for i in results:
-            match_list.append(str(i[0].lstrip()))
-        patterns = [self.nlp.make_doc(text) for text in match_list]  # noqa: F821
-        matcher = PhraseMatcher(self.nlp.vocab, attr='LOWER')
-        matcher.add(self.label, None, *patterns)
-        matches = matcher(doc)
-        seen_tokens = set()
+        # Words of the text, and their positions in it, that take part in matching
+        words = window_words(doc.text)
+        positions = [ix for ix, (_, _, word) in enumerate(words)
+                     if not (self.stop_words and word.lower() in self.stop_words)]
+        texts = [words[ix][2].lower() for ix in positions]
+        token_starts = [token.idx for token in doc]
+
+        candidates = []
+        for phrase, word_count, i, _, end in token_windows(texts, self.index.word_counts()):
+            first_ix, last_ix = positions[i], positions[end - 1]
+            # With stop words removed, a window may not be contiguous in the text
+            if last_ix - first_ix != end - 1 - i:
+                continue
+            name = self.canonical_name(phrase, word_count)
+            if name is not None:
+                start, end_token = char_range_to_tokens(token_starts, words[first_ix][0],
+                                                        words[last_ix][1])
+                candidates.append((start, end_token, name))
+
+        # Longest match wins at each start; later matches can't overlap earlier ones
+        candidates.sort(key=lambda candidate: (candidate[0], candidate[0] - candidate[1]))
         new_entities = []
-        entities = doc.ents
-        for match_id, start, end in matches:
-            if start not in seen_tokens and end - 1 not in seen_tokens:
-                new_entities.append(Span(doc, start, end, label=match_id))
-                entities = [
-                    e for e in entities if not (e.start < end and e.end > start)
-                ]
-                seen_tokens.update(range(start, end))
-
-        doc.ents = tuple(entities) + tuple(new_entities)
+        last_end = -1
+        for start, end, name in candidates:
+            if start >= last_end:
+                new_entities.append(Span(doc, start, end, label=self.label, kb_id=name))
+                last_end = end
+
+        doc.ents = merge_entities(doc.ents, new_entities)
         return doc
 
 
+def merge_entities(entities, new_entities) -> tuple:
+    """
+    Existing entities that overlap a new one are dropped. Both lists are sorted and don't
+    overlap among themselves, so one sweep does it.
+    """
+    kept = []
+    new_ix = 0
+    for ent in sorted(entities, key=lambda span: span.start):
+        while new_ix < len(new_entities) and new_entities[new_ix].end <= ent.start:
+            new_ix += 1
+        if new_ix < len(new_entities) and new_entities[new_ix].start < ent.end:
+            continue
+        kept.append(ent)
+
+    return tuple(kept) + tuple(new_entities)
+
+
+def debug_check_hyphenated_names(nlp, match: float = 85) -> List[Tuple[str, list, list]]:
+    """
+    Misspelled hyphenated names (as OCR produces them) should still be tagged as a whole.
+    nlp is e.g. a blank spacy Language, which splits on the hyphens.
+    :return: (text, expected, found) for each case that fails; should be empty
+    """
+    names = ['red-tailed hawk', 'red-shouldered hawk', 'black-capped chickadee', 'hawk sp.']
+    cases = {
+        'red-talled hawk': [('red-talled hawk', 'red-tailed hawk')],
+        '2 Red-tailed Hawk, 1 blak-capped chickadee': [
+            ('Red-tailed Hawk', 'red-tailed hawk'),
+            ('blak-capped chickadee', 'black-capped chickadee')],
+        'red-shoulderd hawk x3': [('red-shoulderd hawk', 'red-shouldered hawk')],
+    }
+    phuzzy_matcher = PhuzzyMatcher(nlp, names, fuzzy_matcher, match, 'COMMONNAME')
+
+    failures = []
+    for text, expected in cases.items():
+        doc = phuzzy_matcher(nlp.make_doc(text))
+        found = [(ent.text, ent.kb_id_) for ent in doc.ents]
+        if found != expected:
+            failures.append((text, expected, found))
+
+    return failures
+
+
 def fuzzy_matcher(features, document, match=None):
-    matches = []
+    # features: a FuzzyPhraseIndex, or the feature strings themselves
     tokens = nltk.word_tokenize(document)
-    for feature in features:
-        feature_length = len(feature.split(" "))
-        for i in range(len(tokens) - feature_length + 1):
-            matched_phrase = ""
-            j = 0
-            for j in range(i, i + feature_length):
-                if re.search(r'[,!?{}\[\]]', tokens[j]):
-                    break
-                matched_phrase = matched_phrase + " " + tokens[j].lower()
-            matched_phrase.strip()
-            if not matched_phrase == "":
-                if fuzz.ratio(matched_phrase, feature.lower()) > match:
-                    matches.append([matched_phrase, feature, i, j])
-    return matches
+    return fuzzy_match_tokens(as_fuzzy_phrase_index(features), tokens, match)
 
 
 def fuzzy_matcher_stopwords(features, document, match=None, stop_words=None):
-    matches = []
     tokens = nltk.word_tokenize(document)
     tokens_no_stop = [w for w in tokens if w not in stop_words]
-    for feature in features:
-        feature_length = len(feature.split(" "))
-        for i in range(len(tokens_no_stop) - feature_length + 1):
-            matched_phrase = ""
-            j = 0
-            for j in range(i, i + feature_length):
-                if re.search(r'[,!?{}\[\]]', tokens_no_stop[j]):
-                    break
-                matched_phrase = matched_phrase + " " + tokens_no_stop[j].lower()
-            matched_phrase.strip()
-            if not matched_phrase == "":
-                if fuzz.ratio(matched_phrase, feature.lower()) > match:
-                    matches.append([matched_phrase, feature, i, j])
-    return matches
+    return fuzzy_match_tokens(as_fuzzy_phrase_index(features), tokens_no_stop, match)
@@ -0,0 +1,80 @@
+# line_pipeline.py
+# from line_pipeline import LinePipeline, StageTimer, dedupe_stage
+
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+"""
+Lines of text flow through a LinePipeline one at a time, so only the lines that survive all
+the stages are ever held together. A stage is a function of one line that returns the new
+line, or None to drop it. Stages that need all the lines at once (e.g. translation, which
+works on a batch) are timed with StageTimer.stage() instead.
+
+    timer = StageTimer()
+    pipeline = LinePipeline([('normalize', pre_process_line), ('dedupe', dedupe_stage())],
+                            timer)
+    lines = sorted(pipeline.run(text.split('\\n')))
+    timer.report()
+"""
+
+LineStage = Callable[[str], Optional[str]]
+
+
+class StageTimer(object):
+    """ Seconds and item counts per stage, in the order the stages were first seen """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: float, count: int = 1):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    @contextmanager
+    def stage(self, name: str, count: int = 1):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0, count)
+
+    def report(self, title: str = 'Stage timings'):
+        total = sum(self.seconds.values())
+        print(title)
+        for name, seconds in self.seconds.items():
+            print(f'  {name:<18} {self.counts[name]:>7} {seconds:8.3f}s')
+        print(f'  {"total":<18} {"":>7} {total:8.3f}s')
+
+
+class LinePipeline(object):
+    def __init__(self, stages: List[Tuple[str, LineStage]], timer: StageTimer = None):
+        self.stages = stages
+        self.timer = timer or StageTimer()
+
+    def run(self, lines: Iterable[str]) -> Iterator[str]:
+        perf_counter = time.perf_counter
+        add = self.timer.add
+        for line in lines:
+            for name, stage in self.stages:
+                t0 = perf_counter()
+                line = stage(line)
+                add(name, perf_counter() - t0)
+                if line is None:
+                    break
+            else:
+                yield line
+
+
+def dedupe_stage() -> LineStage:
+    # Drops lines already seen by this stage
+    seen = set()
+
+    def dedupe(line: str) -> Optional[str]:
+        if line in seen:
+            return None
+        seen.add(line)
+        return line
+
+    return dedupe
@@ -2,7 +2,9 @@
 # from local_translation_context import LocalTranslationContext
 
 import re
-from typing import List
+from collections import deque
+from functools import lru_cache
+from typing import List, Dict, Set, Iterable
 from typing import Tuple
 
 import pandas as pd
@@ -11,6 +13,68 @@ from singleton_decorator import singleton
 import utilities_cbc as autil
 
 
+# Results of apply_translations are cached per input line, up to this many lines
+TRANSLATION_CACHE_SIZE = 65536
+
+# translate_to_fixpoint gives up after this many passes
+MAX_TRANSLATION_PASSES = 8
+
+# Kinds of rule in the compiled translation steps
+STEP_PLAIN = 'plain'
+STEP_REGEX = 'regex'
+
+
+class SubstringIndex(object):
+    """
+    Aho-Corasick automaton over a fixed set of (non-empty) strings: one pass over a line
+    finds every key that occurs in it, rather than testing each key in turn.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for key_id, key in enumerate(keys):
+            node = 0
+            for ch in key:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][ch] = next_node
+                node = next_node
+            self._out[node].append(key_id)
+
+        # Failure links, breadth first; children of the root fail to the root
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail_node = self._fail[node]
+                while fail_node and ch not in self._goto[fail_node]:
+                    fail_node = self._fail[fail_node]
+                self._fail[next_node] = self._goto[fail_node].get(ch, 0)
+                self._out[next_node] = self._out[next_node] + self._out[self._fail[next_node]]
+
+    def find(self, text: str) -> Set[int]:
+        # ids of the keys that occur in text
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+
+        return found
+
+
 @singleton
 class LocalTranslationContext(object):
     """Create a dataframe for system and local translations
@@ -34,11 +98,13 @@ class LocalTranslationContext(object):
         self._system_translations = None
         self._local_translations = None
         self._all_translations = self._initialize_all_translations()
+        self._compile_translations()
 
     def reload(self):
         # for debugging
         # Initialize properties that could fail
         self._all_translations = self._initialize_all_translations()
+        self._compile_translations()
 
         for idx, row in self._all_translations.iterrows():
             lsn = row.LocalSpeciesName.lower()
@@ -106,71 +172,212 @@ class LocalTranslationContext(object):
 
         return self._all_translations
 
-    def apply_translations(self, line, quiet: bool = True) -> Tuple[str, bool]:
-        found_exact_match = False
-
-        for idx, row in self._all_translations.iterrows():
+    def _compile_translations(self):
+        """
+        Turn self._all_translations into structures that are cheap to apply per line. The
+        result of apply_translations is the same as walking the rules in order (see
+        debug_apply_translations_X, which does exactly that):
+        - whole-line rules come first, and the first one that matches ends translation, so
+          they become a dict from the line they match to (order, pattern, replacement)
+        - the remaining plain and regex rules are applied in order. A plain rule only does
+          anything if its text is in the line, so a SubstringIndex over the plain texts
+          picks out the ones to apply; it is rerun whenever a rule changes the line
+        - a rule whose replacement still contains what it matches (e.g. 'sage sparrow' =>
+          "sagebrush/bell's sparrow (sage sparrow)") would fire again on every pass of
+          translate_to_fixpoint, so it is only applied on the first pass
+        """
+        self._whole_line_rules: Dict[str, Tuple[int, re.Pattern, str, str]] = {}
+        self._steps = []  # (kind, lsn, esn, compiled pattern or None)
+        self._always_active_steps = []  # regex rules, and plain rules with empty text
+        self._first_pass_steps = set()  # rules that would match their own replacement
+        plain_step_ids: Dict[str, List[int]] = {}
+
+        for order, row in enumerate(self._all_translations.itertuples(index=False)):
             lsn = row.LocalSpeciesName.lower()
             esn = row.eBirdSpeciesName.lower()
-            line = line.lower()
-            prev_line = line
+            if row.match_whole_line:
+                if row.compiled_pattern is not None:
+                    self._whole_line_rules.setdefault(
+                        lsn, (order, row.compiled_pattern, lsn, esn))
+            elif row.regex:
+                if row.compiled_pattern is None:
+                    # Already reported when compiling; the rule can never apply
+                    continue
+                if row.compiled_pattern.search(esn):
+                    self._first_pass_steps.add(len(self._steps))
+                self._always_active_steps.append(len(self._steps))
+                self._steps.append((STEP_REGEX, lsn, esn, row.compiled_pattern))
+            else:
+                if lsn:
+                    if lsn in esn:
+                        self._first_pass_steps.add(len(self._steps))
+                    plain_step_ids.setdefault(lsn, []).append(len(self._steps))
+                else:
+                    self._always_active_steps.append(len(self._steps))
+                self._steps.append((STEP_PLAIN, lsn, esn, None))
+
+        self._plain_texts = list(plain_step_ids.keys())
+        self._plain_step_ids = [plain_step_ids[lsn] for lsn in self._plain_texts]
+        self._substring_index = SubstringIndex(self._plain_texts)
+
+        # Rules may have changed, so start new caches
+        self._translate_cached = lru_cache(maxsize=TRANSLATION_CACHE_SIZE)(
+            self._translate_compiled)
+        self._translate_later_pass_cached = lru_cache(maxsize=TRANSLATION_CACHE_SIZE)(
+            self._translate_later_pass)
+        self._fixpoint_cached = lru_cache(maxsize=TRANSLATION_CACHE_SIZE)(
+            self._translate_to_fixpoint)
+
+    def _match_whole_line(self, line: str):
+        # Same as re.match(f'^{re.escape(lsn)}$', line): note $ also matches before a
+        # trailing newline
+        candidates = [self._whole_line_rules.get(line)]
+        if line.endswith('\n'):
+            candidates.append(self._whole_line_rules.get(line[:-1]))
+        candidates = [rule for rule in candidates if rule is not None]
+
+        return min(candidates, key=lambda rule: rule[0]) if candidates else None
+
+    @staticmethod
+    def _apply_whole_line_rule(whole_line_rule, line: str, quiet: bool) -> str:
+        _, pattern, lsn, esn = whole_line_rule
+        prev_line = line
+        try:
+            line = pattern.sub(esn, line)
+        except Exception as ee:
+            print(f'Local translation regex fail: "{lsn}" => "{esn}"')
 
-            # Straight replacement
-            if not (row.match_whole_line or row.regex):
+        # Helps debug which regex caused a replacement
+        if (not quiet) and (line != prev_line):
+            print(f'{prev_line} => {line} WITH {lsn}')
+
+        return line
+
+    def _active_steps(self, line: str, after: int = -1, first_pass: bool = True) -> List[int]:
+        # Steps that might change line, in order
+        active = [step_id for key_id in self._substring_index.find(line)
+                  for step_id in self._plain_step_ids[key_id]]
+        active.extend(self._always_active_steps)
+
+        return sorted(step_id for step_id in active if step_id > after and
+                      (first_pass or step_id not in self._first_pass_steps))
+
+    def _translate_compiled(self, line, quiet: bool = True,
+                            fired: List[Tuple[str, str, str]] = None,
+                            first_pass: bool = True) -> Tuple[str, bool]:
+        # fired: if given, (rule, line before, line after) is appended for each rule that
+        # changed the line
+        # first_pass: False for later passes of translate_to_fixpoint (see
+        # _compile_translations)
+        if self._all_translations.empty:
+            return line.strip(), False
+
+        line = line.lower()
+        whole_line_rule = self._match_whole_line(line)
+        if whole_line_rule is not None:
+            prev_line = line
+            line = self._apply_whole_line_rule(whole_line_rule, line, quiet)
+            if fired is not None:
+                fired.append((whole_line_rule[2], prev_line, line))
+            return line.strip(), True
+
+        active = self._active_steps(line, first_pass=first_pass)
+        ix = 0
+        while ix < len(active):
+            step_id = active[ix]
+            kind, lsn, esn, pattern = self._steps[step_id]
+            prev_line = line
+            if kind == STEP_PLAIN:
                 line = line.replace(lsn, esn)  # orig => repl
             else:
                 try:
-                    pattern = row.compiled_pattern
-                    if row.match_whole_line:
-                        if re.match(pattern, line):
-                            found_exact_match = True
+                    line = pattern.sub(esn, line)
+                except Exception as ee:
+                    print(f'Local translation regex fail: "{lsn}" => "{esn}"')
 
-                    line = re.sub(pattern, esn, line)
+            if line != prev_line:
+                # Helps debug which regex caused a replacement
+                if not quiet:
+                    print(f'{prev_line} => {line} WITH {lsn}')
+                if fired is not None:
+                    fired.append((lsn, prev_line, line))
+                active = self._active_steps(line, step_id, first_pass)
+                ix = 0
+            else:
+                ix += 1
 
+        return line.strip(), False
 
-                except Exception as ee:
-                    print(f'Local translation regex fail: "{lsn}" => "{esn}"')
+    def _translate_later_pass(self, line) -> Tuple[str, bool]:
+        return self._translate_compiled(line, first_pass=False)
 
-            # Helps debug which regex caused a replacement
-            if (not quiet) and (line != prev_line):
-                print(f'{prev_line} => {line} WITH {lsn}')
-                prev_line = line
+    def apply_translations(self, line, quiet: bool = True) -> Tuple[str, bool]:
+        if not quiet:
+            return self._translate_compiled(line, quiet)
 
-            if found_exact_match:
-                break
+        return self._translate_cached(line)
 
-        return line.strip(), found_exact_match
+    def translate_many(self, lines: Iterable[str],
+                       to_fixpoint: bool = False) -> List[Tuple[str, bool]]:
+        # apply_translations (or translate_to_fixpoint) for each line; repeated lines are
+        # answered from the cache
+        translate = self._fixpoint_cached if to_fixpoint else self._translate_cached
+        return [translate(line) for line in lines]
 
-    def apply_whole_line_translations(self, line, quiet: bool = True) -> str:
+    def _translation_passes(self, line, fired: List[Tuple[str, str, str]] = None) -> \
+            Tuple[str, bool]:
         found_exact_match = False
+        seen = {line}
+        for pass_ix in range(MAX_TRANSLATION_PASSES):
+            first_pass = pass_ix == 0
+            if fired is not None:
+                txline, exact_match = self._translate_compiled(line.lower(), fired=fired,
+                                                               first_pass=first_pass)
+            elif first_pass:
+                txline, exact_match = self._translate_cached(line.lower())
+            else:
+                txline, exact_match = self._translate_later_pass_cached(line.lower())
+            found_exact_match = found_exact_match or exact_match
+            if txline == line:
+                break
+            if txline in seen:
+                print(f'Local translation cycle: "{line}" => "{txline}"')
+                line = txline
+                break
+            seen.add(txline)
+            line = txline
+        else:
+            print(f'Local translation not stable after {MAX_TRANSLATION_PASSES} passes: '
+                  f'"{line}"')
 
-        for idx, row in self._all_translations.iterrows():
-            lsn = row.LocalSpeciesName.lower()
-            esn = row.eBirdSpeciesName.lower()
-            line = line.lower()
-            prev_line = line
+        return line, found_exact_match
 
-            if not row.match_whole_line:
-                continue
+    def _translate_to_fixpoint(self, line) -> Tuple[str, bool]:
+        return self._translation_passes(line)
 
-            # Straight replacement
-            try:
-                pattern = row.compiled_pattern
-                if re.match(pattern, line):
-                    found_exact_match = True
+    def translate_to_fixpoint(self, line) -> Tuple[str, bool]:
+        """
+        Apply the translations until the line stops changing, instead of a fixed two passes.
+        Stops at a cycle or after MAX_TRANSLATION_PASSES. Results are cached per input line
+        until the next reload. found_exact_match is True if any pass matched a whole line.
+        """
+        return self._fixpoint_cached(line)
 
-                line = re.sub(pattern, esn, line)
+    def explain_translation(self, line) -> List[Tuple[str, str, str]]:
+        # Which rules fired, in order, on the way to the fixpoint: (rule, before, after)
+        fired = []
+        self._translation_passes(line, fired)
 
-                # Helps debug which regex caused a replacement
-                if (not quiet) and (line != prev_line):
-                    print(f'{prev_line} => {line} WITH {lsn}')
-                    prev_line = line
+        return fired
 
-                if found_exact_match:
-                    break
+    def apply_whole_line_translations(self, line, quiet: bool = True) -> str:
+        if self._all_translations.empty:
+            return line.strip()
 
-            except Exception as ee:
-                print(f'Local translation regex fail: "{lsn}" => "{esn}" {ee}')
+        line = line.lower()
+        whole_line_rule = self._match_whole_line(line)
+        if whole_line_rule is not None:
+            line = self._apply_whole_line_rule(whole_line_rule, line, quiet)
 
         return line.strip()
 
@@ -194,7 +401,8 @@ class LocalTranslationContext(object):
 
 
 # Since debugging a singleton is a pain in Jupyter notebooks (have to restart kernel each time),
-# provide simple test code for translations
+# provide simple test code for translations. This is also the reference implementation for
+# the compiled rules in LocalTranslationContext, see debug_compare_translations
 
 
 def debug_apply_translations_X(local_translation_context: LocalTranslationContext,
@@ -232,7 +440,43 @@ def debug_apply_translations_X(local_translation_context: LocalTranslationContex
 
     return line.strip(), found_exact_match
 
+
+def debug_compare_translations(local_translation_context: LocalTranslationContext,
+                               lines: List[str]) -> List[Tuple[str, Tuple[str, bool],
+                                                               Tuple[str, bool]]]:
+    # Lines where the compiled translations differ from the rule-by-rule reference
+    differences = []
+    for line in lines:
+        expected = debug_apply_translations_X(local_translation_context, line)
+        actual = local_translation_context.apply_translations(line)
+        if actual != expected:
+            differences.append((line, expected, actual))
+
+    return differences
+
+
+def debug_check_translations_stable(local_translation_context: LocalTranslationContext,
+                                    lines: List[str] = None) -> List[Tuple[str, str, str]]:
+    """
+    Lines (by default, every LocalSpeciesName in the loaded translations) whose fixpoint
+    translation would still change on another pass, as (line, translation, next pass).
+    Should be empty; e.g. run it after editing SystemTranslations.xlsx
+    """
+    if lines is None:
+        lines = list(local_translation_context.all_translations.LocalSpeciesName)
+
+    unstable = []
+    translated = local_translation_context.translate_many(lines, to_fixpoint=True)
+    for line, (txline, _) in zip(lines, translated):
+        next_line, _ = local_translation_context._translate_compiled(txline, first_pass=False)
+        if next_line != txline:
+            unstable.append((line, txline, next_line))
+
+    return unstable
+
+
 # taxonomy.find_local_name(local_name, match_scientific_name=False)
 # agwt = '“American” Green-winged Teal'
 # line = secondary_species_processing(pre_process_line(agwt)).lower()
 # debug_apply_translations_X(line, False)
+
@@ -1,7 +1,7 @@
 # NLPContext
 # from nlp_context import NLPContext
 
-from typing import Tuple, Set
+from typing import Tuple, Set, Dict, Iterable, List, FrozenSet
 
 import inflect
 from more_itertools import flatten
@@ -25,7 +25,10 @@ class NLPContext(object):
     # cn_tokens => _tokens_common_name
     #
 
-    def __init__(self, taxonomy=None, reports_path=None):
+    def __init__(self, taxonomy=None, reports_path=None,
+                 token_sets: Dict[str, Iterable[str]] = None):
+        # token_sets: as returned by token_sets(), e.g. from the cached taxonomy pipeline,
+        # to skip tokenizing every name in the taxonomy
         self.reports_path = reports_path
         self._taxonomy = taxonomy
         self.nlp = English()
@@ -35,7 +38,10 @@ class NLPContext(object):
         # For singular/plural determinations
         self._inflect_engine = inflect.engine()
 
-        self._create_all_taxonomy_tokens()
+        if token_sets:
+            self._load_token_sets(token_sets)
+        else:
+            self._create_all_taxonomy_tokens()
 
     def _create_all_taxonomy_tokens(self):
         # tk_all, tk_common, tk_scientific = self._create_tokens_for_taxonomy(self._taxonomy.taxonomy_restricted)
@@ -43,36 +49,99 @@ class NLPContext(object):
         # self._tokens_restricted_common_name = tk_common
         # self._tokens_restricted_scientific_name = tk_scientific
 
-        tk_all, tk_common, tk_scientific = self._create_tokens_for_taxonomy(self._taxonomy.taxonomy)
+        tk_all, tk_common, tk_scientific = self._create_tokens_for_taxonomy(self._taxonomy)
         self._tokens_common_scientific = tk_all
         self._tokens_common_name = tk_common
         self._tokens_scientific_name = tk_scientific
 
-        tk_all, tk_common, tk_scientific = self._create_tokens_for_family(self._taxonomy.taxonomy)
+        tk_all, tk_common, tk_scientific = self._create_tokens_for_family(self._taxonomy)
         self._tokens_family_all = tk_all
         self._tokens_family_common_name = tk_common
         self._tokens_family_scientific_name = tk_scientific
 
+        self._set_token_rows(self._create_token_rows())
+
+    def _create_token_rows(self) -> Dict[str, List[int]]:
+        # Token text => taxonomy rows (positions) whose common or scientific name contains it,
+        # for the tokens in _tokens_common_scientific
+        taxonomy = self._taxonomy.taxonomy
+        token_rows = {}
+        for col in ['comNameLower', 'sciNameLower']:
+            for row, doc in enumerate(self.nlp.tokenizer.pipe(taxonomy[col].astype(str))):
+                for tok in doc:
+                    if tok.text in self._tokens_common_scientific:
+                        token_rows.setdefault(tok.text, set()).add(row)
+
+        return {text: sorted(rows) for text, rows in token_rows.items()}
+
+    def _set_token_rows(self, token_rows: Dict[str, List[int]]):
+        """
+        Integer versions of the taxonomy tokens, so that filtering lines is a set
+        intersection with token.orth values: the orth of a token is the hash of its text
+        """
+        strings = self.nlp.vocab.strings
+        self._token_rows = token_rows
+        self._token_ids = frozenset(strings.add(tok) for tok in self._tokens_common_scientific)
+        self._token_id_rows = {strings.add(tok): rows for tok, rows in token_rows.items()}
+
+    def token_ids(self) -> FrozenSet[int]:
+        # Orths of the tokens in taxonomy_tokens()[0]
+        return self._token_ids
+
+    def candidate_rows(self, token_ids: Iterable[int]) -> Set[int]:
+        # Taxonomy rows (positions) with a name containing any of the tokens
+        rows = set()
+        for token_id in token_ids:
+            rows.update(self._token_id_rows.get(token_id, []))
+
+        return rows
+
+    def token_sets(self) -> Dict[str, List[str]]:
+        # The token sets as plain lists, for serializing
+        return {
+            'common_scientific': sorted(self._tokens_common_scientific),
+            'common_name': sorted(self._tokens_common_name),
+            'scientific_name': sorted(self._tokens_scientific_name),
+            'family_all': sorted(self._tokens_family_all),
+            'family_common_name': sorted(self._tokens_family_common_name),
+            'family_scientific_name': sorted(self._tokens_family_scientific_name),
+            'token_rows': self._token_rows,
+        }
+
+    def _load_token_sets(self, token_sets: Dict[str, Iterable[str]]):
+        self._tokens_common_scientific = set(token_sets['common_scientific'])
+        self._tokens_common_name = set(token_sets['common_name'])
+        self._tokens_scientific_name = set(token_sets['scientific_name'])
+        self._tokens_family_all = set(token_sets['family_all'])
+        self._tokens_family_common_name = set(token_sets['family_common_name'])
+        self._tokens_family_scientific_name = set(token_sets['family_scientific_name'])
+        self._set_token_rows(token_sets['token_rows'])
+
+    def _name_tokens(self, names: Iterable[str]) -> Set[str]:
+        # Token texts, so the sets can be compared with other docs and serialized
+        return set(tok.text for tok in flatten([self.nlp.tokenizer(wd) for wd in names]))
+
     def _create_tokens_for_taxonomy(self, xtaxonomy) -> Tuple[Set, Set, Set]:
         # All, Common, Scientific
-        common_names = set(xtaxonomy.comNameLower)
-        scientific_names = set(xtaxonomy.sciNameLower)
+        # xtaxonomy is a Taxonomy; its name sets are shared
+        common_names = xtaxonomy.name_set('comNameLower')
+        scientific_names = xtaxonomy.name_set('sciNameLower')
         common_scientific = (common_names | scientific_names)
 
-        tokens_common_scientific = self.filter_tokens(set(flatten([self.nlp.tokenizer(wd) for wd in common_scientific])))
-        tokens_common_name = self.filter_tokens(set(flatten([self.nlp.tokenizer(wd) for wd in common_names])))
+        tokens_common_scientific = self.filter_tokens(self._name_tokens(common_scientific))
+        tokens_common_name = self.filter_tokens(self._name_tokens(common_names))
         tokens_scientific_name = tokens_common_name | tokens_common_scientific
 
         return tokens_common_scientific, tokens_common_name, tokens_scientific_name
 
     def _create_tokens_for_family(self, xtaxonomy) -> Tuple[Set, Set, Set]:
         # All, Common, Scientific
-        common_names = set([cn.lower() for cn in xtaxonomy.familyComName])
-        scientific_names = set([sn.lower() for sn in xtaxonomy.familySciName])
+        common_names = xtaxonomy.name_set('familyComName')
+        scientific_names = xtaxonomy.name_set('familySciName')
         common_scientific = (common_names | scientific_names)
 
-        tokens_common_scientific = self.filter_tokens(set(flatten([self.nlp.tokenizer(wd) for wd in common_names])))
-        tokens_common_name = self.filter_tokens(set(flatten([self.nlp.tokenizer(wd) for wd in common_names])))
+        tokens_common_scientific = self.filter_tokens(self._name_tokens(common_names))
+        tokens_common_name = self.filter_tokens(self._name_tokens(common_names))
         tokens_scientific_name = tokens_common_name | tokens_common_scientific
 
         return tokens_common_scientific, tokens_common_name, tokens_scientific_name
@@ -44,6 +44,7 @@ class Parameters(object):
                  quiet: bool = True):
         self.local_parameters_path = local_parameters_path
         self.system_parameters_path = system_parameters_path
+        self.name_prefix = name_prefix
 
         # Local Parameters
         self.translations_path = self.local_parameters_path / 'LocalTranslations.xlsx'
@@ -1,6 +1,9 @@
 import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from typing import List
+from typing import List, Dict, Any, Tuple
 
 import pandas as pd
 
@@ -13,7 +16,8 @@ from utilities_cbc import read_excel_or_csv_path, debug_write_raw_text, circle_a
 from text_extractor import TextExtractorFactory
 from input_files_context import InputFilesContext
 
-from text_transform import pre_process_line, secondary_species_processing
+from text_transform import normalize_line
+from line_pipeline import LinePipeline, StageTimer, dedupe_stage
 
 from local_translation_context import LocalTranslationContext
 from taxonomy import Taxonomy
@@ -205,9 +209,8 @@ def build_full_tally_sheet(double_translated,
             local_names.append(base_species)
 
     entries = []
-    for local_name in local_names:
+    for record in taxonomy.find_local_name_records(local_names):
         # common_name, taxon_order, species_group, NACC_SORT_ORDER
-        record = taxonomy.find_local_name_row(local_name)
         if record is not None:
             # e.g. ('White-throated Sparrow', 31943, 'New World Sparrows', 1848.0)
             entry = (record.comName, record.TAXON_ORDER, record.SPECIES_GROUP,
@@ -245,22 +248,63 @@ def build_full_tally_sheet(double_translated,
     return local_checklist
 
 
-def strip_off_scientific_names(text_list: List[str], taxonomy: Taxonomy) -> List[str]:
+def strip_scientific_name(line: str, taxonomy: Taxonomy) -> str:
     # The CAMP-2020 checklist has <Common Name> <Scientific Name>
     # Assume all scientific names are two words and drop
-    stripped_text_list = []
-    for line in text_list:
-        line = line.strip()
-        # e.g. line = 'California Quail Callipepla californica'
-        words = line.split(' ')
-        if len(words) > 2:
-            sci_name = ' '.join(words[-2:]).lower()
-            row = taxonomy.find_scientific_name_row(sci_name)
-            if row is not None:
-                line = ' '.join(words[:-2]) #.lower()
-        stripped_text_list.append(line)
+    line = line.strip()
+    # e.g. line = 'California Quail Callipepla californica'
+    words = line.split(' ')
+    if len(words) > 2:
+        sci_name = ' '.join(words[-2:]).lower()
+        record = taxonomy.find_scientific_name_record(sci_name)
+        if record is not None:
+            line = ' '.join(words[:-2]) #.lower()
+
+    return line
 
-    return stripped_text_list
+
+def strip_off_scientific_names(text_list: List[str], taxonomy: Taxonomy) -> List[str]:
+    return [strip_scientific_name(line, taxonomy) for line in text_list]
+
+
+def tally_line_pipeline(taxonomy: Taxonomy, timer: StageTimer = None) -> LinePipeline:
+    # skip tertiary_transformation() for now
+    return LinePipeline([
+        ('normalize', normalize_line),
+        ('strip_sci_names', lambda line: strip_scientific_name(line, taxonomy)),
+        # Stripping can make lines equal, so this is the one place duplicates are removed
+        ('dedupe', dedupe_stage()),
+    ], timer)
+
+
+def write_input_templates(local_checklist: pd.DataFrame, parameters: Parameters,
+                          circle_prefix: str):
+    # Call from one process only; process_checklists_parallel does this in the parent
+    # Write out an empty annotations file if none exists
+    annotations_path = inputs_parse_path / f'{circle_prefix}Annotations.xlsx'
+    if not annotations_path.exists():
+        print(f'Creating empty annotations file: {annotations_path.as_posix()}')
+        annotations = local_checklist.copy()
+        for col in ['Rare', 'Adult', 'Immature', 'Easy', 'Marginal', 'Difficult']:
+            annotations[col] = ''
+        write_final_checklist_spreadsheet(annotations,
+                                          annotations_path,
+                                          parameters.parameters,
+                                          additional_sheets=None,
+                                          cols_to_hide=None,
+                                          cols_to_highlight=None)
+
+    exceptions_path = inputs_parse_path / f'{circle_prefix}Exceptions.xlsx'
+    if not exceptions_path.exists():
+        print(f'Creating empty exceptions file: {exceptions_path.as_posix()}')
+        empty_exceptions = pd.DataFrame(
+            {'CommonName': '', 'Add': '', 'Subtract': '', 'Comments': ''},
+            index=range(20))  # Adding rows to a table is a pain in Excel, give some room
+
+        write_basic_spreadsheet(empty_exceptions, exceptions_path,
+                                column_widths={'CommonName': 30, 'Add': 11,
+                                               'Subtract': 11, 'Comments': 50},
+                                columns_to_center=['Add', 'Subtract'])
 
 
 def process_checklist(checklist_path: Path,
@@ -269,52 +313,41 @@ def process_checklist(checklist_path: Path,
                       local_translation_context: LocalTranslationContext,
                       parameters: Parameters,
                       circle_prefix: str,
-                      single_path: str = None
+                      single_path: str = None,
+                      write_templates: bool = True,
+                      extract_workers: int = None
                       ):
     """
     - Extract text
+    write_templates: write the empty annotations and exceptions inputs if missing
+    extract_workers: for PDF extraction; 1 when already running in a worker process
     """
 
     # Use circle_abbrev as a prefix to distinguish output for multiple checklists
 
     # Extract text from file and do basic text preprocessing
 
-    text_extractor = TextExtractorFactory().create(checklist_path)
+    text_extractor = TextExtractorFactory().create(checklist_path, cache_path,
+                                                   max_workers=extract_workers)
     text = text_extractor.extract()
     debug_write_raw_text(text, checklist_path, debug_path)
 
-    text_list = sorted(list(set(text.split('\n'))))
-    # skip tertiary_transformation() for now
-    text_list = [secondary_species_processing(pre_process_line(line)) for line in text_list]
-
-    #  text_list = [tertiary_transformation(secondary_species_processing(pre_process_line(line))) \
-    #                for line in text_list]
-
-    text_list = strip_off_scientific_names(text_list, taxonomy)
-
-    # print(text_list)
-
-    text_list = sorted(list(set(text_list)))
+    timer = StageTimer()
+    text_list = sorted(tally_line_pipeline(taxonomy, timer).run(text.split('\n')))
 
     # Processing 1 checklist here
     tti = TaxonomyTokenIdentify(taxonomy, cache_path)
+    tti.clear_line_cache()
 
-    # use text_list from above
     text_list_lower = [x.lower() for x in text_list]
-    possibles = filter_to_possibles(tti, text_list_lower)
+    with timer.stage('possibles', len(text_list_lower)):
+        possibles = filter_to_possibles(tti, text_list_lower)
     print(f'Possible species lines: {len(possibles)} (based on word intersections)')
 
-    # Double translate
-    # print('Doing double translation')  # Can take a while
-    translated = []
-    for line in text_list_lower:  # was: possibles
-        txline = local_translation_context.apply_translations(line.lower(), True)
-        translated.append(txline)
-
-    double_translated = []
-    for line, _ in translated:
-        txline2 = local_translation_context.apply_translations(line.lower(), True)
-        double_translated.append(txline2)
+    # Translate until stable (this used to be exactly two passes, hence the name)
+    with timer.stage('translate', len(text_list_lower)):
+        double_translated = local_translation_context.translate_many(
+            text_list_lower, to_fixpoint=True)  # was: possibles
 
     # Write Spacy visualization
     write_visualization(list(set([x[0] for x in double_translated])), checklist_path, debug_path,
@@ -343,31 +376,8 @@ def process_checklist(checklist_path: Path,
                                       cols_to_highlight=['Total'])
 
     if not skip_additional_processing:
-        # Write out an empty annotations file if none exists
-        annotations_path = inputs_parse_path / f'{circle_prefix}Annotations.xlsx'
-        if not annotations_path.exists():
-            print(f'Creating empty annotations file: {annotations_path.as_posix()}')
-            annotations = local_checklist.copy()
-            for col in ['Rare', 'Adult', 'Immature', 'Easy', 'Marginal', 'Difficult']:
-                annotations[col] = ''
-            write_final_checklist_spreadsheet(annotations,
-                                              annotations_path,
-                                              parameters.parameters,
-                                              additional_sheets=None,
-                                              cols_to_hide=None,
-                                              cols_to_highlight=None)
-
-        exceptions_path = inputs_parse_path / f'{circle_prefix}Exceptions.xlsx'
-        if not exceptions_path.exists():
-            print(f'Creating empty exceptions file: {exceptions_path.as_posix()}')
-            empty_exceptions = pd.DataFrame(
-                {'CommonName': '', 'Add': '', 'Subtract': '', 'Comments': ''},
-                index=range(20))  # Adding rows to a table is a pain in Excel, give some room
-
-            write_basic_spreadsheet(empty_exceptions, exceptions_path,
-                                    column_widths={'CommonName': 30, 'Add': 11,
-                                                   'Subtract': 11, 'Comments': 50},
-                                    columns_to_center=['Add', 'Subtract'])
+        if write_templates:
+            write_input_templates(local_checklist, parameters, circle_prefix)
 
         double_path = output_dir / f'{circle_abbrev}-Double.xlsx'
         write_local_checklist_with_group(local_checklist, double_path, parameters.parameters)
@@ -375,8 +385,10 @@ def process_checklist(checklist_path: Path,
         if not ground_truths_df.empty:
             _ = check_against_ground_truth(local_checklist, ground_truths_df)
 
-        categorized_lines = categorize_lines(circle_abbrev, text_list,
-                                             local_translation_context, tti)
+        with timer.stage('classify', len(text_list)):
+            categorized_lines = categorize_lines(circle_abbrev, text_list,
+                                                 local_translation_context, tti,
+                                                 double_translated)
 
         write_categorized_lines_spreadsheet(categorized_lines,
                                             debug_path / f'{circle_abbrev}-categorized_lines.xlsx',
@@ -385,6 +397,8 @@ def process_checklist(checklist_path: Path,
                                             sheet_name='Categorized Lines',
                                             )
 
+    timer.report(f'{circle_abbrev} parse timings')
+
     return text_list, double_translated, local_checklist
 
 
@@ -395,9 +409,11 @@ def process_checklists(checklists_path: Path,
                        taxonomy: Taxonomy,
                        local_translation_context: LocalTranslationContext,
                        parameters: Parameters,
-                       circle_prefix: str  # e.g. 'CACR-2020-'
+                       circle_prefix: str,  # e.g. 'CACR-2020-'
+                       max_workers: int = 1
                        ):
     # Return parameters useful when debugging single list
+    # max_workers > 1 processes the checklists in parallel, see process_checklists_parallel
 
     # parsable_filetypes = TextExtractorFactory().formats()
     ifc = InputFilesContext(checklists_path, ['.xlsx', '.csv', '.pdf'])
@@ -407,7 +423,7 @@ def process_checklists(checklists_path: Path,
 
     #     - Extract text from tally sheet (checklist)
     #     - Make LocalTranslationContext and TaxonomyTokenIdentify objects
-    #     - Do a double translation (should be idempotent)
+    #     - Translate each line until it is stable
 
     text_list = []
     double_translated = []
@@ -417,6 +433,16 @@ def process_checklists(checklists_path: Path,
         print(f'No valid checklists found in: {checklists_path}')
         return None, None, None
 
+    if max_workers > 1 and len(checklist_paths) > 1:
+        results = process_checklists_parallel(checklist_paths, output_dir, taxonomy,
+                                              local_translation_context, parameters,
+                                              circle_prefix, max_workers)
+        # As with the serial version, return the results for the last checklist
+        last_result = results[checklist_paths[-1]]
+        if last_result['error'] is None:
+            text_list, double_translated, local_checklist = last_result['result']
+        return text_list, double_translated, local_checklist
+
     for fpath in checklist_paths:
         print(f'Name: {fpath.stem}')
         text_list, double_translated, local_checklist = \
@@ -429,6 +455,105 @@ def process_checklists(checklists_path: Path,
     return text_list, double_translated, local_checklist
 
 
+# Per worker process state for process_checklists_parallel, set by init_parse_worker
+_parse_worker_context = {}
+
+
+def init_parse_worker(shared_taxonomy_path: Path,
+                      taxonomy_version: str,
+                      local_parameters_path: Path,
+                      system_parameters_path: Path,
+                      translations_base_path: Path,
+                      system_translations_path: Path,
+                      name_prefix: str):
+    # The singletons can't be pickled, so each worker makes its own from the same files.
+    # The taxonomy is attached to the file exported by the parent, not rebuilt
+    taxonomy = Taxonomy(cache_path, shared_path=shared_taxonomy_path, version=taxonomy_version)
+    _parse_worker_context['taxonomy'] = taxonomy
+    _parse_worker_context['local_translation_context'] = \
+        LocalTranslationContext(translations_base_path, system_translations_path)
+    _parse_worker_context['parameters'] = \
+        Parameters(local_parameters_path, system_parameters_path, name_prefix, True)
+    # Loads the pipeline saved by the parent
+    _ = TaxonomyTokenIdentify(taxonomy, cache_path)
+
+
+def process_checklist_in_worker(checklist_path: Path, output_dir: Path,
+                                circle_prefix: str) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    try:
+        result = process_checklist(checklist_path, output_dir,
+                                   _parse_worker_context['taxonomy'],
+                                   _parse_worker_context['local_translation_context'],
+                                   _parse_worker_context['parameters'],
+                                   circle_prefix,
+                                   # The parent writes these, and the worker is already
+                                   # one of a pool
+                                   write_templates=False, extract_workers=1)
+        error = None
+    except Exception as ee:
+        result = None
+        error = f'{ee}\n{traceback.format_exc()}'
+
+    return {'result': result, 'error': error, 'seconds': time.perf_counter() - t0}
+
+
+def process_checklists_parallel(checklist_paths: List[Path],
+                                output_dir: Path,
+                                taxonomy: Taxonomy,
+                                local_translation_context: LocalTranslationContext,
+                                parameters: Parameters,
+                                circle_prefix: str,
+                                max_workers: int = None) -> Dict[Path, Dict[str, Any]]:
+    """
+    Run process_checklist for each file in a process pool. Workers are set up once with the
+    taxonomy (shared, see Taxonomy.export_shared), translations and parameters, and progress
+    is printed as each file finishes.
+    :return: {checklist path: {'result': process_checklist result or None,
+                               'error': error text or None, 'seconds': elapsed}}
+    """
+    # Make sure the pipeline artifact exists before the workers all try to load it
+    _ = TaxonomyTokenIdentify(taxonomy, cache_path)
+    shared_taxonomy_path = taxonomy.export_shared()
+
+    initargs = (shared_taxonomy_path, taxonomy.version,
+                parameters.local_parameters_path, parameters.system_parameters_path,
+                local_translation_context.translations_base_path,
+                local_translation_context.system_translations_path,
+                parameters.name_prefix)
+
+    results = {}
+    num_paths = len(checklist_paths)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_parse_worker,
+                             initargs=initargs) as executor:
+        futures = {executor.submit(process_checklist_in_worker, fpath, output_dir,
+                                   circle_prefix): fpath for fpath in checklist_paths}
+        for future in as_completed(futures):
+            fpath = futures[future]
+            try:
+                results[fpath] = future.result()
+            except Exception as ee:
+                # e.g. the worker died
+                results[fpath] = {'result': None, 'error': str(ee), 'seconds': 0.0}
+
+            status = 'failed' if results[fpath]['error'] else 'done'
+            print(f'[{len(results)}/{num_paths}] {fpath.stem}: {status} '
+                  f'({results[fpath]["seconds"]:.1f}s)')
+
+    # As in the serial version, the first checklist that parsed seeds the annotations file
+    for fpath in checklist_paths:
+        if results[fpath]['error'] is None:
+            write_input_templates(results[fpath]['result'][2], parameters, circle_prefix)
+            break
+
+    errors = {fpath: result['error'] for fpath, result in results.items() if result['error']}
+    for fpath, error in errors.items():
+        print(f'Error processing {fpath.name}: {error}')
+    print(f'Processed {num_paths - len(errors)} of {num_paths} checklists')
+
+    return results
+
+
 # ------------------------------------------------------------------------------------------
 
 def ground_truths():
@@ -505,17 +630,33 @@ def build_docx(lines: List[str], tti: TaxonomyTokenIdentify):
 
 def double_translate(line, local_translation_context: LocalTranslationContext,
                      quiet: bool = True) -> str:
-    txline, _ = local_translation_context.apply_translations(line.lower(), quiet)
-    txline2, _ = local_translation_context.apply_translations(txline.lower(), quiet)
-    return txline2
+    # Name kept from when this was always two passes
+    if not quiet:
+        for rule, before, after in local_translation_context.explain_translation(line.lower()):
+            print(f'{before} => {after} WITH {rule}')
+    txline, _ = local_translation_context.translate_to_fixpoint(line.lower())
+    return txline
 
 
 def categorize_lines(circle_code: str, text_list: List[str],
                      local_translation_context: LocalTranslationContext,
-                     tti: TaxonomyTokenIdentify):
-    tl2 = sorted(list(set(text_list)))
-    tl3 = [double_translate(line, local_translation_context) for line in tl2]
-    docx4 = build_docx(tl3, tti)
+                     tti: TaxonomyTokenIdentify,
+                     translated_lines: List[Tuple[str, bool]] = None):
+    # translated_lines: translate_many output for text_list, if text_list is already
+    # sorted and unique and the caller has translated it
+    if translated_lines is None:
+        tl2 = sorted(list(set(text_list)))
+        translated_lines = local_translation_context.translate_many(
+            [line.lower() for line in tl2], to_fixpoint=True)
+    else:
+        tl2 = text_list
+    tl3 = [txline for txline, _ in translated_lines]
+
+    # Entity text => label, from the docs tti already has for these lines
+    ent_labels = {}
+    for line_entities in tti.line_entities(tl3):
+        for text, label in line_entities:
+            ent_labels[text] = label
 
     df = pd.DataFrame(pd.Series([x.lower() for x in tl2]), columns=['Line'])
 
@@ -524,11 +665,8 @@ def categorize_lines(circle_code: str, text_list: List[str],
 
     df['Translation'] = translations
     df['Translated'] = translated
-    df['Category'] = ''
-
-    for ent in docx4.ents:
-        mask = (df.Line == ent.text) | (df.Translation == ent.text)
-        df.loc[mask, 'Category'] = ent.label_
+    df['Category'] = [ent_labels.get(translation, ent_labels.get(line, ''))
+                      for line, translation in zip(df.Line, df.Translation)]
 
     df.to_csv(debug_path / f'{circle_code}-categorized_lines.csv', index=False)
 
@@ -539,8 +677,8 @@ def show_lines_not_found_in_taxonomy(double_translated, taxonomy: Taxonomy):
     # ['Group', 'CommonName', 'Rare', 'Total', 'TaxonOrder']
 
     for local_name, _ in double_translated:
-        row = taxonomy.find_local_name_row(local_name)
-        if row is None:
+        record = taxonomy.find_local_name_record(local_name)
+        if record is None:
             print(f'Not found in taxonomy: {local_name}')
 
 
@@ -62,7 +62,7 @@ def csv_dataframe_to_checklist(checklist: pd.DataFrame,
         print(ee)
         raise
 
-    checklist['speciesCode'] = [taxonomy.find_species6_ebird(cn) for cn in checklist.CommonName]
+    checklist['speciesCode'] = taxonomy.find_species6_ebirds(checklist.CommonName)
 
     # Was L5551212
     randid = random.randrange(95550000, 95559999)
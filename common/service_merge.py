@@ -225,7 +225,7 @@ def merge_checklists(summary_base: Any,
     # Look up Group and TaxonOrder for anything missing these (may have been added species)
 
     for idx, row in summary.iterrows():
-        record = taxonomy.find_local_name_row(row['CommonName'])
+        record = taxonomy.find_local_name_record(row['CommonName'])
         if record is not None:
             summary.at[idx, 'TaxonOrder'] = record.TAXON_ORDER
             summary.at[idx, 'Group'] = record.SPECIES_GROUP
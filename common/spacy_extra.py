@@ -6,7 +6,7 @@ from utilities_cbc import circle_abbrev_from_path
 
 from spacy.matcher import PhraseMatcher
 from spacy.lang.en import English
-from spacy.tokens import Span
+from spacy.tokens import Doc, Span
 from spacy.util import filter_spans
 
 
@@ -51,15 +51,17 @@ def build_phrase_matcher(nlp, taxonomy):
     return matcher, nlp
 
 
-def filter_to_possibles(tti, lines):
-    filter_tokens, _, _ = tti.nlp_context.taxonomy_tokens()
-    docSW = set(w.orth for w in tti.nlp(' '.join(tti.stop_words)))
-    docTax = set(w.orth for w in filter_tokens) - docSW
+def filter_to_possibles(tti, lines, return_candidates: bool = False):
+    # With return_candidates, also return {line: taxonomy rows (positions) with a name
+    # sharing a token with the line}, a shortlist for matching the line
+    # Orths of the taxonomy tokens that aren't stop words, computed once by tti
+    docTax = tti.taxonomy_token_ids
 
     possibles = set()
-    for line in lines:
+    candidates = {}
+    lines = list(lines)
+    for line, line_doc in zip(lines, tti.process_lines(lines)):
         #     print(line)
-        line_doc = set(tti.nlp(line))
         docA = set(w.orth for w in line_doc)
         if len(docA) == 0:
             continue
@@ -71,11 +73,17 @@ def filter_to_possibles(tti, lines):
         if pctage > 0.14:
             #             print(f'{pctage} {[tti.nlp.vocab.strings[ii] for ii in intersections]}')
             possibles.add(line)
+            if return_candidates:
+                candidates[line] = tti.nlp_context.candidate_rows(intersections)
+
+    if return_candidates:
+        return possibles, candidates
 
     return possibles
 
 
 def create_visualization2(docx, show_in_jupyter=True):
+    # docx: a doc, or a list of docs (e.g. one per line)
     # Create visualization
     # https://developer.mozilla.org/en-US/docs/Web/CSS/linear-gradient
     # https://cssgradient.io
@@ -129,33 +137,25 @@ def create_visualization2(docx, show_in_jupyter=True):
                "colors": colors}
 
     # displacy.serve(doc, style="ent", options=options)
-    html = displacy.render([docx], style="ent", page=True,
+    docs = docx if isinstance(docx, list) else [docx]
+    html = displacy.render(docs, style="ent", page=True,
                            jupyter=show_in_jupyter, options=options)
 
     return html
 
 
 def write_visualization(names: list, fpath: Path, out_path: Path, taxonomy, tti):
-    # Now look for named entities
-    nlp = English()
-    docx = nlp('\n'.join(names))
-
-    matcher, nlp = build_phrase_matcher(nlp, taxonomy)
-    matches = matcher(docx)
-    match_spans = []
-    for match_id, start, end in matches:
-        rule_id = nlp.vocab.strings[match_id]  # get the unicode ID, i.e. 'COLOR'
-        span = docx[start: end]  # get the matched slice of the doc
-        #     print(rule_id, span.text)
-
-        # create a new Span for each match and use the match_id (ANIMAL) as the label
-        span = Span(docx, start, end, label=match_id)
-        match_spans.append(span)
-
-    docx.ents = list(docx.ents) + filter_spans(match_spans)
-    #     doc11.ents = list(doc11.ents) + [span]  # add span to doc.ents
-
-    html = create_visualization2(docx, False)
+    # Now look for named entities, reusing the docs tti already has for these lines.
+    # Entities are set on copies, the cached docs are left alone
+    docs = []
+    for line_doc in tti.process_lines(names):
+        docx = Doc(line_doc.vocab, words=[tok.text for tok in line_doc],
+                   spaces=[bool(tok.whitespace_) for tok in line_doc])
+        docx.ents = [Span(docx, span.start, span.end, label=span.label)
+                     for span in tti.line_entity_spans(line_doc)]
+        docs.append(docx)
+
+    html = create_visualization2(docs, False)
     # print(len(html))
     # fname = f'{datetime.now().strftime("%m%d%y_%H%M%S")}.html'
 
@@ -1,8 +1,11 @@
 # TaxonomyTokenIdentify
 # from taxonomy_token_identify import TaxonomyTokenIdentify
 
+import json
+import pickle
+import shutil
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Optional, Any
 from typing import List, Set, Dict, Tuple, Union
 import sys, traceback
 
@@ -12,8 +15,10 @@ from spacy import displacy
 from spacy.language import Language
 from spacy.pipeline import EntityRuler
 from spacy.matcher import PhraseMatcher
+from spacy.tokens import Doc, Span
+from spacy.util import filter_spans
 
-from fuzzy_phrase_matcher import PhuzzyMatcher, fuzzy_matcher
+from fuzzy_phrase_matcher import PhuzzyMatcher, fuzzy_matcher, FuzzyPhraseIndex
 
 # Local Imports
 from taxonomy import Taxonomy
@@ -21,6 +26,14 @@ from nlp_context import NLPContext
 
 FUZZY_THRESHOLD = 85
 
+# Defaults for process_lines
+LINE_BATCH_SIZE = 1000
+LINE_N_PROCESS = 1
+
+# Bump this when anything written by save_pipeline_artifact changes
+PIPELINE_ARTIFACT_VERSION = 2
+PIPELINE_ARTIFACT_NAME_BASE = 'taxonomy_pipeline'
+
 
 @singleton
 class TaxonomyTokenIdentify(object):
@@ -34,8 +47,10 @@ class TaxonomyTokenIdentify(object):
         self.cached_data_path = cached_data_path
         self.ctaxonomy = ctaxonomy
         self.taxonomy = self.ctaxonomy.taxonomy
-        self.nlp_context = NLPContext(ctaxonomy)
-        self.entity_ruler_path = cached_data_path / 'taxon_entity_ruler.jsonl'
+        # Everything derived from the taxonomy is cached here, see save_pipeline_artifact
+        self.pipeline_path = cached_data_path / \
+            f'{PIPELINE_ARTIFACT_NAME_BASE}-v{PIPELINE_ARTIFACT_VERSION}-{ctaxonomy.fingerprint()}'
+        self.entity_ruler_path = self.pipeline_path / 'entity_ruler.jsonl'
         self.nlp = Language()
 
         self.stop_words = self.nlp.Defaults.stop_words
@@ -44,12 +59,37 @@ class TaxonomyTokenIdentify(object):
             for sw in stop_words:
                 self.stop_words.add(sw)
 
-        self._entity_patterns, self._matcher_patterns = self.create_taxonomy_patterns()
+        artifact = self.load_pipeline_artifact()
+        if artifact is None:
+            self._entity_patterns, self._matcher_patterns = self.create_taxonomy_patterns()
+            self._fuzzy_indexes = {
+                'common_name': FuzzyPhraseIndex(self.ctaxonomy.name_set('comNameLower')),
+                'scientific_name': FuzzyPhraseIndex(self.ctaxonomy.name_set('sciNameLower')),
+            }
+            self.nlp_context = NLPContext(ctaxonomy)
+        else:
+            # The entity ruler itself is loaded by get_entity_ruler_cached
+            self._entity_patterns = []
+            self._matcher_patterns = artifact['matcher_patterns']
+            self._fuzzy_indexes = artifact['fuzzy_indexes']
+            self.nlp_context = NLPContext(ctaxonomy, token_sets=artifact['nlp_tokens'])
+
+        # Orths of the stop words, and of the taxonomy tokens that aren't stop words
+        self._stop_word_ids = frozenset(
+            tok.orth for tok in self.nlp.tokenizer(' '.join(sorted(self.stop_words))))
+        self.taxonomy_token_ids = self.nlp_context.token_ids() - self._stop_word_ids
+
+        # Docs from process_lines, by (line, use_fuzzy); see clear_line_cache
+        self._line_docs: Dict[Tuple[str, bool], Doc] = {}
+
         self._cached_ruler = None
         self._cached_ruler = self.get_entity_ruler_cached()
         self._phrase_matcher = self.create_phrase_matcher()
         self.build_pipeline()
 
+        if artifact is None:
+            self.save_pipeline_artifact()
+
     # ------------------------------------------------------------------------
 
     def build_pipeline(self):
@@ -58,12 +98,12 @@ class TaxonomyTokenIdentify(object):
         matcher = self.get_phrase_matcher()
 
         # Now add the fuzzy matchers
-        common_name_set = set(self.taxonomy.comNameLower)  # .discard('')
+        common_name_set = self._fuzzy_indexes['common_name']  # .discard('')
         common_name_tagger = PhuzzyMatcher(self.nlp, common_name_set, fuzzy_matcher, FUZZY_THRESHOLD,
                                            'ZCOMMONNAME', 'fuzzy_common_name', self.stop_words)
         self.nlp.add_pipe(common_name_tagger)
 
-        scientific_name_set = set(self.taxonomy.sciNameLower)  # .discard('')
+        scientific_name_set = self._fuzzy_indexes['scientific_name']  # .discard('')
         scientific_name_set_tagger = PhuzzyMatcher(self.nlp, scientific_name_set, fuzzy_matcher,
                                                    FUZZY_THRESHOLD,
                                                    'ZSCIENTIFICNAME', 'fuzzy_scientific_name',
@@ -183,6 +223,7 @@ class TaxonomyTokenIdentify(object):
         try:
             if not self.entity_ruler_path.is_file():
                 ruler.add_patterns(self._entity_patterns)
+                self.entity_ruler_path.parent.mkdir(parents=True, exist_ok=True)
                 ruler.to_disk(self.entity_ruler_path)
                 return ruler
 
@@ -198,6 +239,73 @@ class TaxonomyTokenIdentify(object):
         self._cached_ruler = ruler
         return ruler
 
+    # -------------------------------- Pipeline Artifact -----------------------------------------
+
+    def load_pipeline_artifact(self) -> Optional[Dict[str, Any]]:
+        """
+        Everything build_pipeline needs, from the directory written by save_pipeline_artifact.
+        The directory name has the artifact version and the taxonomy fingerprint, so a
+        changed taxonomy just means a new artifact. None if there isn't a complete one.
+        """
+        manifest_path = self.pipeline_path / 'manifest.json'
+        if not (manifest_path.is_file() and self.entity_ruler_path.is_file()):
+            return None
+
+        try:
+            with open(manifest_path, 'r', encoding="utf-8") as fp:
+                manifest = json.load(fp)
+            with open(self.pipeline_path / 'matcher_patterns.json', 'r', encoding="utf-8") as fp:
+                pattern_words = json.load(fp)
+            with open(self.pipeline_path / 'fuzzy_indexes.pkl', 'rb') as fp:
+                fuzzy_indexes = pickle.load(fp)
+            with open(self.pipeline_path / 'nlp_tokens.json', 'r', encoding="utf-8") as fp:
+                nlp_tokens = json.load(fp)
+        except Exception as ee:
+            print(f'Unable to load taxonomy pipeline from {self.pipeline_path.name}: {ee}')
+            return None
+
+        # Avoid "[E084] Error assigning label ID ... to span: not in StringStore."
+        for pn in manifest['pattern_names']:
+            _ = self.nlp.vocab.strings.add(pn)
+        vocab = self.nlp.vocab
+        matcher_patterns = {key: [Doc(vocab, words=words) for words in patterns]
+                            for key, patterns in pattern_words.items()}
+
+        print('Loaded taxonomy pipeline from cache...')
+        return {'matcher_patterns': matcher_patterns, 'fuzzy_indexes': fuzzy_indexes,
+                'nlp_tokens': nlp_tokens}
+
+    def save_pipeline_artifact(self):
+        # The entity ruler was already written by get_entity_ruler_cached. The manifest goes
+        # last, since load_pipeline_artifact takes it to mean the artifact is complete
+        try:
+            self.pipeline_path.mkdir(parents=True, exist_ok=True)
+            pattern_words = {key: [[tok.text for tok in doc] for doc in patterns]
+                             for key, patterns in self._matcher_patterns.items()}
+            with open(self.pipeline_path / 'matcher_patterns.json', 'w', encoding="utf-8") as fp:
+                json.dump(pattern_words, fp)
+            with open(self.pipeline_path / 'fuzzy_indexes.pkl', 'wb') as fp:
+                pickle.dump(self._fuzzy_indexes, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(self.pipeline_path / 'nlp_tokens.json', 'w', encoding="utf-8") as fp:
+                json.dump(self.nlp_context.token_sets(), fp)
+
+            manifest = {
+                'version': PIPELINE_ARTIFACT_VERSION,
+                'taxonomy_fingerprint': self.ctaxonomy.fingerprint(),
+                'pattern_names': sorted(self._matcher_patterns.keys()),
+            }
+            with open(self.pipeline_path / 'manifest.json', 'w', encoding="utf-8") as fp:
+                json.dump(manifest, fp, indent=2)
+        except Exception as ee:
+            print(ee)
+            traceback.print_exc(file=sys.stdout)
+            return
+
+        # Artifacts for other taxonomies or versions are no longer needed
+        for stale_path in self.pipeline_path.parent.glob(f'{PIPELINE_ARTIFACT_NAME_BASE}-v*'):
+            if stale_path.is_dir() and stale_path != self.pipeline_path:
+                shutil.rmtree(stale_path, ignore_errors=True)
+
     def get_taxonomy_patterns(self) -> Dict[str, list]:
         return self._taxonomy_patterns
 
@@ -205,6 +313,44 @@ class TaxonomyTokenIdentify(object):
         return self._phrase_matcher
 
 
+    # Line oriented processing
+    def process_lines(self, lines: Iterable[str], batch_size: int = LINE_BATCH_SIZE,
+                      n_process: int = LINE_N_PROCESS, use_fuzzy: bool = False) -> List[Doc]:
+        """
+        Run lines through the pipeline in batches with nlp.pipe, one doc per line. Docs are
+        kept until clear_line_cache, so a line is only processed once per run however many
+        steps (filtering, categorizing, visualization) look at it.
+        :return: docs, in the same order as lines
+        """
+        lines = list(lines)
+        line_docs = self._line_docs
+        todo = [line for line in dict.fromkeys(lines) if (line, use_fuzzy) not in line_docs]
+        if todo:
+            fuzzy_pipes = [] if use_fuzzy else ["fuzzy_common_name", "fuzzy_scientific_name"]
+            with self.nlp.disable_pipes(*fuzzy_pipes):
+                docs = self.nlp.pipe(todo, batch_size=batch_size, n_process=n_process)
+                for line, doc in zip(todo, docs):
+                    line_docs[(line, use_fuzzy)] = doc
+
+        return [line_docs[(line, use_fuzzy)] for line in lines]
+
+    def clear_line_cache(self):
+        self._line_docs = {}
+
+    def line_entity_spans(self, doc) -> List[Span]:
+        # Pipeline entities plus phrase matcher matches, longest first where they overlap
+        spans = list(doc.ents)
+        for match_id, start, end in self._phrase_matcher(doc):
+            spans.append(Span(doc, start, end, label=match_id))
+
+        return filter_spans(spans)
+
+    def line_entities(self, lines: Iterable[str], use_fuzzy: bool = False) -> \
+            List[List[Tuple[str, str]]]:
+        # (text, label) of the entities in each line
+        return [[(span.text, span.label_) for span in self.line_entity_spans(doc)]
+                for doc in self.process_lines(lines, use_fuzzy=use_fuzzy)]
+
     # Read and process text
     def spacify_text(self, text, use_fuzzy=False):
         # https://spacy.io/usage/processing-pipelines
@@ -279,13 +425,12 @@ class TaxonomyTokenIdentify(object):
         return [word for word in doc if not word.is_stop]
 
     def filter_no_intersection(self, unidentified: Set[str]) -> Set[str]:
-        filter_tokens, _, _ = self.nlp_context.taxonomy_tokens()
+        token_ids = self.taxonomy_token_ids
 
         candidates = set()
         for line in unidentified:
-            line_tokens = set(self.nlp.tokenizer(line)) - self.stop_words
-            intersections = set(filter_tokens) & set(line_tokens)
-            if len(intersections) > 0:
+            line_token_ids = set(tok.orth for tok in self.nlp.tokenizer(line))
+            if not token_ids.isdisjoint(line_token_ids):
                 candidates.add(line)
 
         return candidates
@@ -2,10 +2,11 @@
 
 import re
 import string
+import time
 import unicodedata
 import ftfy
 
-from typing import List, Tuple, Optional, Any
+from typing import List, Tuple, Optional, Any, Iterable, Union
 import pandas as pd
 
 from taxonomy import Taxonomy
@@ -13,6 +14,32 @@ from local_translation_context import LocalTranslationContext
 from taxonomy_token_identify import TaxonomyTokenIdentify
 
 
+# Compiled once for pre_process_line and secondary_species_processing, which run on every
+# tally sheet line. See debug_compare_normalizers for the original, step by step versions.
+
+# Underlines dropped, '=' and tabs to spaces, soft hyphens to hyphens
+PRE_PROCESS_TRANSLATION = str.maketrans({'_': None, '=': ' ', '\u00ad': '-', '\t': ' '})
+DIGIT_PATTERN = re.compile(r'[0-9]')
+DATE_PATTERN = re.compile(r'[0-9]+\/[0-9]+\/[0-9]+')
+ALL_NUMBERS_PATTERN = re.compile(r'^[0-9\s\._]+$')
+LEADING_NUMBER_PATTERN = re.compile(r'^\s*[0-9]+\s*')
+NUMBERS_PATTERN = re.compile(r'[0-9]+')
+LEADING_PERIODS_PATTERN = re.compile(r'^[\.\s]+')
+# ASCII text that ftfy would still change: HTML entities, control characters, \r, escapes
+FTFY_ASCII_PATTERN = re.compile(r'[&\x00-\x09\x0b-\x1f\x7f]')
+
+PARENTHESIZED_LINE_PATTERN = re.compile(r'^\(([^\)]+)\)\s*$')
+LEADING_JUNK_PATTERN = re.compile(r'^[\(*#_\.+\s=-]+')
+# We want to keep parens, slash and dash and single quote and period
+ALLOWABLE_PUNCTUATION = '()/-\'‘’ .,'
+PUNCTUATION_TO_DROP_TRANSLATION = str.maketrans(
+    '', '', ''.join(sorted(set(string.punctuation) - set(ALLOWABLE_PUNCTUATION))))
+TRAILING_JUNK_PATTERN = re.compile(r'[\/*#_\s+-]+$')
+TRAILING_PERIODS_PATTERN = re.compile(r'([\.\s-]+)$')
+TRAILING_SHORT_PARENS_SEARCH_PATTERN = re.compile(r'[^\(]+(\([^\)]{0,2}\))$')
+TRAILING_SHORT_PARENS_PATTERN = re.compile(r'(\([^\)]{0,2}\))$')
+
+
 def pre_process_line(line) -> str:
     # This should only do text preprocessing, but should not transform
     # the text in any way (e.g. re-arranging to match a species in the taxonomy)
@@ -20,48 +47,37 @@ def pre_process_line(line) -> str:
     if not line:
         return ''
 
+    is_ascii = line.isascii()
     # https://docs.python.org/3/library/unicodedata.html
-    line = unicodedata.normalize('NFKD', line)
-
-    # Drop underlines
-    line = line.replace('_', '')
-
-    # Get rid of '='
-    line = line.replace('=', ' ')
-
-    # Fix soft hypens
-    line = line.replace('\u00ad', '-')
-
-    # Detab
-    line = line.replace('\t', ' ')
-
-    # Get rid of dates (sloppy regex below)
-    line = re.sub(r'[0-9]+\/[0-9]+\/[0-9]+', '', line)
-
-    # If line is all numbers, drop
-    line = re.sub(r'^[0-9\s\._]+$', '', line)
-
-    # This in not really a conversion artifact, but we have to do this before saving original_line
-    # Get rid of any leading numbers (e.g. from a filled tally sheet)
-    #    e.g. 8588 Bufflehead
-    line = re.sub(r'^\s*[0-9]+\s*', '', line)
-
-    # Actually, we can delete all numbers
-    # There are 2 overall species that have common names with numbers in them:
-    # 'Evening Grosbeak (type 1)' etc and 'Red Crossbill (Appalachian or type 1)' etc
-    # In examples we have seen, there is such a small difference in Levenshtein distance
-    # they are matched properly
-    line = re.sub(r'[0-9]+', '', line)
+    if not is_ascii:
+        line = unicodedata.normalize('NFKD', line)
+
+    line = line.translate(PRE_PROCESS_TRANSLATION)
+
+    if DIGIT_PATTERN.search(line):
+        # Get rid of dates (sloppy regex below)
+        line = DATE_PATTERN.sub('', line)
+        # If line is all numbers, drop
+        line = ALL_NUMBERS_PATTERN.sub('', line)
+        # Get rid of any leading numbers (e.g. from a filled tally sheet)
+        #    e.g. 8588 Bufflehead
+        line = LEADING_NUMBER_PATTERN.sub('', line)
+        # Actually, we can delete all numbers (see debug_pre_process_line_X)
+        line = NUMBERS_PATTERN.sub('', line)
+    # Without digits, the only lines ALL_NUMBERS_PATTERN drops are also removed entirely here
 
     # Get rid of leading spaces and periods
-    line = re.sub(r'^[\.\s]+', '', line)
+    line = LEADING_PERIODS_PATTERN.sub('', line)
 
-    # Fix ligatures, so 'Buﬄehead' => 'Bufflehead'
-    line = ftfy.fix_text(line, fix_latin_ligatures=True, uncurl_quotes=True)
+    # Fix ligatures, so 'Buﬄehead' => 'Bufflehead'. Plain ASCII is left alone by ftfy
+    # unless it has entities or control characters
+    if not is_ascii or FTFY_ASCII_PATTERN.search(line):
+        line = ftfy.fix_text(line, fix_latin_ligatures=True, uncurl_quotes=True)
 
     # Drop the "box" character at the front of e.g. '\uf06f Winter Wren' (see NYRC)
     # This is somewhat heavy handed, so should come last (e.g. will strip curly quotes)
-    line = line.encode("ascii", 'ignore').decode("ascii")
+    if not line.isascii():
+        line = line.encode("ascii", 'ignore').decode("ascii")
 
     return line.strip()
 
@@ -83,49 +99,63 @@ def secondary_species_processing(line):
     # line is a potential species
 
     # If text looks like (accipiter sp.), drop parens
-    mm = re.search(r'^\(([^\)]+)\)\s*$', line)
+    mm = PARENTHESIZED_LINE_PATTERN.search(line)
     if mm:
         line = mm.group(1)
 
     # drop leading -(, whitespace
     # Excel particularly hates a leading '=', since then it thinks the line is a formula
-    line = re.sub(r'^[\(*#_\.+\s=-]+', '', line)
+    line = LEADING_JUNK_PATTERN.sub('', line)
 
-    # We want to keep parens, slash and dash and single quote and period
-    allowable_punctuation = '()/-\'‘’ .,'
-    punctuation_to_drop = ''.join(list(set(string.punctuation) - set(allowable_punctuation)))
     # https://stackoverflow.com/questions/265960/best-way-to-strip-punctuation-from-a-string
-    punctuation_to_drop_txlt = str.maketrans('', '', punctuation_to_drop)
-    line = line.translate(punctuation_to_drop_txlt).strip()
+    line = line.translate(PUNCTUATION_TO_DROP_TRANSLATION).strip()
 
     # Be careful with removing trailing characters
-    # '[\(*#_\s+-]+$'
-    line = re.sub(r'[\/*#_\s+-]+$', '', line)
+    line = TRAILING_JUNK_PATTERN.sub('', line)
 
     # CACR has lines like scaup, sp
-    line = re.sub(r', sp', ' sp.', line)
+    line = line.replace(', sp', ' sp.')
 
     # set(taxonomy.taxonomy[mask].comNameLower.apply(period_group))
     # {'(mt.', '(st.', 'i.', 'is.', 'mrs.', 'mts.', 'sp.', 'st.'}
     #     line = 'galapagos finch sp.'
     #     line = 'rough-legged hawk ........'
     if not line.endswith('sp.'):
-        line = re.sub(r'([\.\s-]+)$', '', line)
+        line = TRAILING_PERIODS_PATTERN.sub('', line)
 
     # This is a cheap way to get rid of a lone trailing paren
     # See e.g. CAHF "(Brown Pelican)"
     if not '(' in line:
-        line = re.sub(r'\)', '', line)
+        line = line.replace(')', '')
 
     # Remove trailing (xxx)
     # Minimum length for (...) in species list is 3, e.g. ('oku', 3), ('lau', 3), ('kai', 3), ('aru', 3), ('red', 3)
-    mm = re.search(r'[^\(]+(\([^\)]{0,2}\))$', line)
-    if mm:
-        line = re.sub(r'(\([^\)]{0,2}\))$', '', line)
+    if TRAILING_SHORT_PARENS_SEARCH_PATTERN.search(line):
+        line = TRAILING_SHORT_PARENS_PATTERN.sub('', line)
 
     return line.strip()
 
 
+def normalize_line(line) -> str:
+    return secondary_species_processing(pre_process_line(line))
+
+
+def normalize_many(lines: Union[pd.Series, Iterable[str]]) -> Union[pd.Series, List[str]]:
+    # normalize_line for each line; each distinct line is only normalized once
+    if isinstance(lines, pd.Series):
+        normalized = {line: normalize_line(line) for line in pd.unique(lines)}
+        return lines.map(normalized)
+
+    normalized = {}
+    result = []
+    for line in lines:
+        if line not in normalized:
+            normalized[line] = normalize_line(line)
+        result.append(normalized[line])
+
+    return result
+
+
 def process_line_annotations(line):
     # Look for annotations like "Bald Eagle (adult)"
     #### handle for now in localTranslations, but move here eventually so we don't lose information
@@ -164,7 +194,7 @@ def clean_common_names(common_names: List[str],
                        taxonomy: Taxonomy,
                        local_translation_context: LocalTranslationContext) -> List[str]:
     # skip tertiary_transformation() for now
-    common_names = [secondary_species_processing(pre_process_line(line)) for line in common_names]
+    common_names = normalize_many(common_names)
 
     #  text_list = [tertiary_transformation(secondary_species_processing(pre_process_line(line))) \
     #                for line in text_list]
@@ -177,32 +207,158 @@ def clean_common_names(common_names: List[str],
     # possibles = filter_to_possibles(tti, text_list_lower)
     # print(f'Possible species lines: {len(possibles)} (based on word intersections)')
 
-    # Double translate
-    # print('Doing double translation')  # Can take a while
-    translated = []
-    for line in common_names:  # was: possibles
-        txline = local_translation_context.apply_translations(line.lower(), True)
-        translated.append(txline)
-
-    double_translated = []
-    for line, _ in translated:
-        txline2 = local_translation_context.apply_translations(line.lower(), True)
-        double_translated.append(txline2)
+    # Translate until stable (this used to be exactly two passes, hence the name)
+    double_translated = local_translation_context.translate_many(
+        [line.lower() for line in common_names], to_fixpoint=True)  # was: possibles
 
     double_translated = [x for (x, y) in double_translated]
     # print(double_translated)
 
     # they may be all lower case, return proper capitalization
     result = []
-    for common_name in double_translated:
+    records = taxonomy.find_local_name_records(double_translated)
+    for common_name, record in zip(double_translated, records):
         xcn = ''
         if common_name != '': # avoid most common exception
-            try:
-                row = taxonomy.find_local_name_row(common_name)
-                xcn = row.comName
-            except AttributeError as ae:
-                print(ae)
+            if record is not None:
+                xcn = record.comName
+            else:
                 print(f'no taxonomy entry for "{common_name}"')
         result.append(xcn)
 
     return result
+
+
+# ------------------------------------------------------------------------------------------
+
+def debug_pre_process_line_X(line) -> str:
+    # The original, step by step pre_process_line, kept as a reference
+    # This should only do text preprocessing, but should not transform
+    # the text in any way (e.g. re-arranging to match a species in the taxonomy)
+
+    if not line:
+        return ''
+
+    # https://docs.python.org/3/library/unicodedata.html
+    line = unicodedata.normalize('NFKD', line)
+
+    # Drop underlines
+    line = line.replace('_', '')
+
+    # Get rid of '='
+    line = line.replace('=', ' ')
+
+    # Fix soft hypens
+    line = line.replace('\u00ad', '-')
+
+    # Detab
+    line = line.replace('\t', ' ')
+
+    # Get rid of dates (sloppy regex below)
+    line = re.sub(r'[0-9]+\/[0-9]+\/[0-9]+', '', line)
+
+    # If line is all numbers, drop
+    line = re.sub(r'^[0-9\s\._]+$', '', line)
+
+    # This in not really a conversion artifact, but we have to do this before saving original_line
+    # Get rid of any leading numbers (e.g. from a filled tally sheet)
+    #    e.g. 8588 Bufflehead
+    line = re.sub(r'^\s*[0-9]+\s*', '', line)
+
+    # Actually, we can delete all numbers
+    # There are 2 overall species that have common names with numbers in them:
+    # 'Evening Grosbeak (type 1)' etc and 'Red Crossbill (Appalachian or type 1)' etc
+    # In examples we have seen, there is such a small difference in Levenshtein distance
+    # they are matched properly
+    line = re.sub(r'[0-9]+', '', line)
+
+    # Get rid of leading spaces and periods
+    line = re.sub(r'^[\.\s]+', '', line)
+
+    # Fix ligatures, so 'Buﬄehead' => 'Bufflehead'
+    line = ftfy.fix_text(line, fix_latin_ligatures=True, uncurl_quotes=True)
+
+    # Drop the "box" character at the front of e.g. '\uf06f Winter Wren' (see NYRC)
+    # This is somewhat heavy handed, so should come last (e.g. will strip curly quotes)
+    line = line.encode("ascii", 'ignore').decode("ascii")
+
+    return line.strip()
+
+
+def debug_secondary_species_processing_X(line):
+    # The original, step by step secondary_species_processing, kept as a reference
+    # line is a potential species
+
+    # If text looks like (accipiter sp.), drop parens
+    mm = re.search(r'^\(([^\)]+)\)\s*$', line)
+    if mm:
+        line = mm.group(1)
+
+    # drop leading -(, whitespace
+    # Excel particularly hates a leading '=', since then it thinks the line is a formula
+    line = re.sub(r'^[\(*#_\.+\s=-]+', '', line)
+
+    # We want to keep parens, slash and dash and single quote and period
+    allowable_punctuation = '()/-\'‘’ .,'
+    punctuation_to_drop = ''.join(list(set(string.punctuation) - set(allowable_punctuation)))
+    # https://stackoverflow.com/questions/265960/best-way-to-strip-punctuation-from-a-string
+    punctuation_to_drop_txlt = str.maketrans('', '', punctuation_to_drop)
+    line = line.translate(punctuation_to_drop_txlt).strip()
+
+    # Be careful with removing trailing characters
+    # '[\(*#_\s+-]+$'
+    line = re.sub(r'[\/*#_\s+-]+$', '', line)
+
+    # CACR has lines like scaup, sp
+    line = re.sub(r', sp', ' sp.', line)
+
+    # set(taxonomy.taxonomy[mask].comNameLower.apply(period_group))
+    # {'(mt.', '(st.', 'i.', 'is.', 'mrs.', 'mts.', 'sp.', 'st.'}
+    #     line = 'galapagos finch sp.'
+    #     line = 'rough-legged hawk ........'
+    if not line.endswith('sp.'):
+        line = re.sub(r'([\.\s-]+)$', '', line)
+
+    # This is a cheap way to get rid of a lone trailing paren
+    # See e.g. CAHF "(Brown Pelican)"
+    if not '(' in line:
+        line = re.sub(r'\)', '', line)
+
+    # Remove trailing (xxx)
+    # Minimum length for (...) in species list is 3, e.g. ('oku', 3), ('lau', 3), ('kai', 3), ('aru', 3), ('red', 3)
+    mm = re.search(r'[^\(]+(\([^\)]{0,2}\))$', line)
+    if mm:
+        line = re.sub(r'(\([^\)]{0,2}\))$', '', line)
+
+    return line.strip()
+
+
+def debug_compare_normalizers(lines: List[str]) -> List[Tuple[str, str, str]]:
+    # Lines where normalize_line differs from the reference versions
+    differences = []
+    for line in lines:
+        expected = debug_secondary_species_processing_X(debug_pre_process_line_X(line))
+        actual = normalize_line(line)
+        if actual != expected:
+            differences.append((line, expected, actual))
+
+    return differences
+
+
+def debug_benchmark_normalizers(lines: List[str], repeat: int = 5):
+    # Best of repeat runs over lines, for normalize_line and the reference versions
+    def best_time(fn) -> float:
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for line in lines:
+                fn(line)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    reference = best_time(lambda line: debug_secondary_species_processing_X(
+        debug_pre_process_line_X(line)))
+    compiled = best_time(normalize_line)
+    print(f'{len(lines)} lines: reference {reference:.3f}s, compiled {compiled:.3f}s '
+          f'({reference / max(compiled, 1e-9):.1f}x)')
@@ -1,11 +1,11 @@
 # taxonomy
 # from taxonomy import Taxonomy
 
+import hashlib
 import sys
 import traceback
 from pathlib import Path
-from typing import Tuple, Optional, Any, List
-from IPython.display import display
+from typing import Tuple, Optional, Any, List, Iterable, FrozenSet
 
 # https://pandas.pydata.org/pandas-docs/stable/user_guide/categorical.html
 from pandas.api.types import CategoricalDtype
@@ -13,13 +13,13 @@ from pandas.api.types import CategoricalDtype
 import numpy as np
 import pandas as pd
 from singleton_decorator import singleton
-import numbers
 
 from ebird_extras import EBirdExtra
-from taxonomy_clements import TaxonomyClements
-from taxonomy_ioc import TaxonomyIOC
-from taxonomy_nacc import TaxonomyNACC
-from taxonomy_aba import TaxonomyABA
+from taxonomy_ioc import IOC_COLUMNS_TO_KEEP
+from taxonomy_nacc import NACC_COLUMNS_TO_KEEP
+from taxonomy_registry import TaxonomyRegistry, DEFAULT_TAXONOMY_VERSION
+from taxonomy_cache import reference_files_checksum, binary_cache_path, read_binary_cache, \
+    write_binary_cache, write_shared_table, read_shared_table
 
 # Base Path
 
@@ -123,6 +123,31 @@ Alan Peterson, M.D.
 
 MISSING_TAXON_ORDER = 0  # or 99999, depends where we want those to sort
 
+# species should be first, spuh last, the others don't matter
+ORDERED_CATEGORIES = ['species', 'issf', 'slash', 'hybrid', 'form',
+                      'intergrade', 'domestic', 'spuh']
+CATEGORY_DTYPE = CategoricalDtype(categories=ORDERED_CATEGORIES, ordered=True)
+
+# Kept in compact mode (everything the lookups and the NLP pipeline use). The remaining
+# reference columns (ioc_*, nacc_*, aba_*, the Clements duplicates, the code lists) are
+# dropped and can be fetched with Taxonomy.reference_columns
+COMPACT_TAXONOMY_COLUMNS = [
+    'comName', 'comNameLower', 'sciName', 'sciNameLower', 'speciesCode', 'Category', 'reportAs',
+    'taxonOrder', 'TAXON_ORDER', 'order', 'familyComName', 'familySciName', 'SPECIES_GROUP',
+    'NACC_SORT_ORDER', 'ABA_SORT_ORDER'
+]
+
+# Never made categorical in compact mode, since they are (nearly) unique per row
+TAXONOMY_KEY_COLUMNS = ['comName', 'comNameLower', 'sciName', 'sciNameLower', 'speciesCode']
+
+# Columns carried by the compact records in the lookup indexes. These cover every column
+# the services read from a looked-up row; use find_local_name_row for a full pd.Series
+TAXONOMY_RECORD_COLUMNS = [
+    'comName', 'comNameLower', 'sciName', 'sciNameLower', 'speciesCode', 'Category',
+    'reportAs', 'taxonOrder', 'TAXON_ORDER', 'SPECIES_GROUP', 'NACC_SORT_ORDER',
+    'ABA_SORT_ORDER'
+]
+
 
 @singleton
 class Taxonomy(object):
@@ -131,9 +156,21 @@ class Taxonomy(object):
     Attributes:
      """
 
-    def __init__(self, cache_path: Path = None, ebird_extra: EBirdExtra = None):
+    def __init__(self, cache_path: Path = None, ebird_extra: EBirdExtra = None,
+                 compact: bool = False, shared_path: Path = None, version: str = None,
+                 registry: TaxonomyRegistry = None):
+        # shared_path: attach to a file written by export_shared (e.g. in a worker process)
+        # instead of loading and building the taxonomy
+        # version: taxonomy year to build against (see TaxonomyRegistry.version_for_date);
+        # the merged taxonomy and its caches are kept per version. As this is a singleton,
+        # the first Taxonomy made in a process sets the version for that process
+        # registry: where version is registered; by default one with just the default version
         self._cache_path = cache_path
+        self._compact = compact
+        self.shared_path = shared_path
         self._ebird_extra = ebird_extra
+        self.version = version or DEFAULT_TAXONOMY_VERSION
+        self._registry = registry
         taxonomy_base_path = Path(__file__).parent.absolute()
         self.taxonomy_reference_path = taxonomy_base_path / 'reference'
 
@@ -146,7 +183,21 @@ class Taxonomy(object):
         self._taxonomy_ebird = None
         self.INVALID_NACC_SORT_ORDER = 999999.1  # set again from NACC
 
-        self.taxonomy = self.get_taxonomy_cached()
+        # Lookup indexes, see build_lookup_indexes
+        self._records = []
+        self._common_name_index = {}
+        self._scientific_name_index = {}
+        self._species_code_index = {}
+        self._name_sets = {}
+        self._fingerprint = None
+
+        if shared_path:
+            self.taxonomy = read_shared_table(shared_path)
+        else:
+            self.taxonomy = self.get_taxonomy_cached()
+            if self._compact:
+                self.compact_taxonomy()
+        self.build_lookup_indexes()
 
     def fix_up_merged_taxonomy(self):
         self.taxonomy['taxonOrder'] = self.taxonomy['taxonOrder'].fillna(MISSING_TAXON_ORDER)
@@ -160,12 +211,8 @@ class Taxonomy(object):
         except AttributeError:
             pass
 
-        # species should be first, spuh last, the others don't matter
-        ordered_categories = ['species', 'issf', 'slash', 'hybrid', 'form',
-                              'intergrade', 'domestic', 'spuh']
-        cat_type = CategoricalDtype(categories=ordered_categories, ordered=True)
         # Writing to CSV will strip categorical information, so need to add after reading cache
-        self.taxonomy.Category = self.taxonomy.Category.astype(cat_type)
+        self.taxonomy.Category = self.taxonomy.Category.astype(CATEGORY_DTYPE)
 
         # self.taxonomy.NACC_SORT_ORDER.fillna(0, inplace=True)
         xdtypes = {
@@ -212,43 +259,85 @@ class Taxonomy(object):
     #     newtype = xdtypes.get(col, str)
     #     self.taxonomy[col] = self.taxonomy[col].astype(newtype)
 
+    @property
+    def registry(self) -> TaxonomyRegistry:
+        if self._registry is None:
+            self._registry = TaxonomyRegistry(self._cache_path)
+
+        return self._registry
+
+    def _versioned_name(self, name_base: str) -> str:
+        # Cache files for the default version keep the names they had before versions
+        if self.version == DEFAULT_TAXONOMY_VERSION:
+            return name_base
+
+        return f'{name_base}-{self.version}'
+
+    def api_cache_path(self) -> Path:
+        return self._cache_path / f'{self._versioned_name("taxonomy_ebird_api")}.csv'
+
+    def full_cache_path(self) -> Path:
+        return self._cache_path / f'{self._versioned_name("taxonomy_full")}.csv'
+
+    def get_binary_cache_path(self) -> Path:
+        # The checksum covers everything the merged taxonomy is built from, so the binary
+        # cache is invalidated automatically when a reference file or the eBird cache changes
+        source_paths = [self.registry.reference_path(self.version, source)
+                        for source in self.registry.sources(self.version)]
+        source_paths.append(self.api_cache_path())
+        checksum = reference_files_checksum(source_paths)
+
+        return binary_cache_path(self._cache_path, self._versioned_name('taxonomy_full'),
+                                 checksum)
+
     def get_taxonomy_cached(self) -> pd.DataFrame:
-        cached_taxonomy_path = self._cache_path / 'taxonomy_full.csv'
+        # taxonomy_full.csv is written alongside the binary cache for reference, but never
+        # read back here: a binary cache miss means a reference file changed, so the CSV
+        # could be stale and the taxonomy is rebuilt instead
+        cached_taxonomy_path = self.full_cache_path()
         try:
-            if cached_taxonomy_path.is_file():
-                self.taxonomy = pd.read_csv(cached_taxonomy_path,
-                                            index_col=False, low_memory=False)
-                self.fix_up_merged_taxonomy()
-            else:
-                print(f'Creating full taxonomy cache...')
-                # EBird API taxonomy is the base
-                self._taxonomy_ebird = self.get_taxonomy_api_cached()
-                self.taxonomy = self._taxonomy_ebird.copy()
-                # print(f'ebird: {self.taxonomy.shape}')
-
-                self._taxonomy_clements = TaxonomyClements().get_taxonomy()
-                self._taxonomy_ioc = TaxonomyIOC().get_taxonomy()
-                self._taxonomy_nacc = TaxonomyNACC().get_taxonomy()
-                self._taxonomy_aba = TaxonomyABA().get_taxonomy()
-                # Now merge in Clements, IOC and NACC checklists
-                self.taxonomy = self.merge_clements_into_taxonomy()
-                # print(f'clements: {self.taxonomy.shape}')
-                self.taxonomy = self.merge_ioc_into_taxonomy()
-                # print(f'ioc: {self.taxonomy.shape}')
-                self.taxonomy = self.merge_nacc_into_taxonomy()
-                # print(f'nacc: {self.taxonomy.shape}')
-                self.taxonomy = self.merge_aba_into_taxonomy()
-
-                self.fix_up_merged_taxonomy()
-                # print(f'fixu: {self.taxonomy.shape}')
-
-                print('Adding synthesized NACC sort orders')
-                self.add_synthesized_sort_orders('NACC_SORT_ORDER')
-                print('Adding synthesized ABA sort orders')
-                self.add_synthesized_sort_orders('ABA_SORT_ORDER')
-
-                self.taxonomy.to_csv(cached_taxonomy_path, index=False)
-                print(f'Written to cache: {self.taxonomy.shape[0]} records')
+            # Fast path: the binary cache is already typed, so no fix_up_merged_taxonomy
+            self.taxonomy = read_binary_cache(self.get_binary_cache_path())
+            if self.taxonomy is not None:
+                # Cheap no-op unless the ordered categorical did not round trip
+                self.taxonomy['Category'] = self.taxonomy.Category.astype(CATEGORY_DTYPE)
+                return self.taxonomy
+
+            print(f'Creating full taxonomy cache ({self.version})...')
+            # EBird API taxonomy is the base
+            self._taxonomy_ebird = self.get_taxonomy_api_cached()
+            self.taxonomy = self._taxonomy_ebird.copy()
+            # print(f'ebird: {self.taxonomy.shape}')
+
+            # Reference workbooks are parsed in parallel, and cached individually
+            print('Loading reference taxonomies...')
+            references = self.registry.load_references(self.version)
+            self._taxonomy_clements = references['clements']
+            self._taxonomy_ioc = references['ioc'][IOC_COLUMNS_TO_KEEP]
+            self._taxonomy_nacc = references['nacc'][NACC_COLUMNS_TO_KEEP]
+            self._taxonomy_aba = references['aba']
+            # Now merge in Clements, IOC and NACC checklists
+            self.taxonomy = self.merge_clements_into_taxonomy()
+            # print(f'clements: {self.taxonomy.shape}')
+            self.taxonomy = self.merge_ioc_into_taxonomy()
+            # print(f'ioc: {self.taxonomy.shape}')
+            self.taxonomy = self.merge_nacc_into_taxonomy()
+            # print(f'nacc: {self.taxonomy.shape}')
+            self.taxonomy = self.merge_aba_into_taxonomy()
+
+            self.fix_up_merged_taxonomy()
+            # print(f'fixu: {self.taxonomy.shape}')
+
+            print('Adding synthesized NACC sort orders')
+            self.add_synthesized_sort_orders('NACC_SORT_ORDER')
+            print('Adding synthesized ABA sort orders')
+            self.add_synthesized_sort_orders('ABA_SORT_ORDER')
+
+            self.taxonomy.to_csv(cached_taxonomy_path, index=False)
+            print(f'Written to cache: {self.taxonomy.shape[0]} records')
+
+            # Path again, a cold build may have just created taxonomy_ebird_api.csv
+            write_binary_cache(self.taxonomy, self.get_binary_cache_path())
         except Exception as ee:
             print(ee)
             traceback.print_exc(file=sys.stdout)
@@ -275,13 +364,15 @@ class Taxonomy(object):
 
     def get_taxonomy_api_cached(self) -> pd.DataFrame:
         taxonomy_df = pd.DataFrame()
-        cached_taxonomy_path = self._cache_path / 'taxonomy_ebird_api.csv'
+        cached_taxonomy_path = self.api_cache_path()
         try:
             if cached_taxonomy_path.is_file():
                 taxonomy_df = pd.read_csv(cached_taxonomy_path, index_col=False)
             else:
                 print(f'Creating eBird taxonomy cache...')
-                taxonomy_df = self._ebird_extra.get_taxonomy_from_ebird()
+                # The default version is whatever eBird has now, as before versions
+                api_version = None if self.version == DEFAULT_TAXONOMY_VERSION else self.version
+                taxonomy_df = self._ebird_extra.get_taxonomy_from_ebird(api_version)
                 taxonomy_df['comNameLower'] = taxonomy_df.comName.apply(lambda x: x.lower())
                 taxonomy_df['sciNameLower'] = taxonomy_df.sciName.apply(lambda x: x.lower())
                 taxonomy_df.to_csv(cached_taxonomy_path, index=False)
@@ -291,62 +382,216 @@ class Taxonomy(object):
 
         return taxonomy_df
 
+    # -------------------------------- Compact Mode ----------------------------------------------
+
+    def compact_taxonomy(self):
+        """
+        Memory-lean version of self.taxonomy: only COMPACT_TAXONOMY_COLUMNS are kept,
+        low-cardinality string columns become categoricals and integer columns are downcast.
+        Row order is unchanged, so reference_columns lines up with it.
+        """
+        if self.taxonomy is None:
+            return
+
+        cols = [col for col in COMPACT_TAXONOMY_COLUMNS if col in self.taxonomy.columns]
+        compacted = self.taxonomy[cols].copy()
+        num_rows = max(len(compacted), 1)
+        for col in compacted.select_dtypes(include='object').columns:
+            if col not in TAXONOMY_KEY_COLUMNS and compacted[col].nunique() < num_rows / 2:
+                compacted[col] = compacted[col].astype('category')
+        for col in compacted.select_dtypes(include='integer').columns:
+            compacted[col] = pd.to_numeric(compacted[col], downcast='integer')
+
+        self.taxonomy = compacted
+        self._name_sets = {}
+
+    def reference_columns(self, cols: List[str]) -> pd.DataFrame:
+        # Columns of the full taxonomy, aligned with self.taxonomy. In compact mode the ones
+        # that were dropped are read from the cache on demand (not kept)
+        missing = [col for col in cols if col not in self.taxonomy.columns]
+        if not missing:
+            return self.taxonomy[cols]
+
+        if self._cache_path is None:
+            # e.g. attached with Taxonomy(shared_path=...) only; the shared table is all there is
+            raise KeyError(f'Columns not in taxonomy {self.shared_path or ""} and no cache_path '
+                           f'to read them from: {missing}')
+
+        loaded = read_binary_cache(self.get_binary_cache_path(), columns=missing)
+        if loaded is None:
+            loaded = pd.read_csv(self.full_cache_path(), usecols=missing,
+                                 index_col=False, low_memory=False)
+        loaded.index = self.taxonomy.index
+        present = [col for col in cols if col in self.taxonomy.columns]
+
+        return pd.concat([self.taxonomy[present], loaded], axis=1)[cols]
+
+    def memory_report(self) -> pd.DataFrame:
+        # Bytes per column (deep, i.e. including the strings), largest first, plus a total
+        usage = self.taxonomy.memory_usage(index=True, deep=True)
+        report = pd.DataFrame({'column': usage.index,
+                               'dtype': [str(self.taxonomy[col].dtype)
+                                         if col in self.taxonomy.columns else ''
+                                         for col in usage.index],
+                               'bytes': usage.values})
+        report = report.sort_values(by='bytes', ascending=False).reset_index(drop=True)
+        total = pd.DataFrame([{'column': 'TOTAL', 'dtype': '', 'bytes': report.bytes.sum()}])
+
+        return pd.concat([report, total], ignore_index=True)
+
+    def name_set(self, col: str) -> FrozenSet[str]:
+        """
+        Lowercase values of a name column, e.g. comNameLower or familySciName. Built once and
+        shared, so TaxonomyTokenIdentify, NLPContext etc. don't each hold their own copy.
+        """
+        if col not in self._name_sets:
+            self._name_sets[col] = frozenset(xs.lower() for xs in self.taxonomy[col].unique()
+                                             if isinstance(xs, str))
+
+        return self._name_sets[col]
+
+    # -------------------------------- Shared Mode -----------------------------------------------
+
+    def export_shared(self, shared_path: Path = None) -> Path:
+        """
+        Write the taxonomy (as currently held, compact or not) to an uncompressed Arrow IPC
+        file that worker processes can attach to read-only with Taxonomy(shared_path=...).
+        Workers memory map the file and only rebuild the lookup indexes, which is fast. Only
+        the numeric columns and category codes are shared; see read_shared_table.
+        """
+        shared_path = shared_path or \
+            self._cache_path / f'{self._versioned_name("taxonomy_shared")}.arrow'
+        write_shared_table(self.taxonomy, shared_path)
+        self.shared_path = shared_path
+
+        return shared_path
+
+    def fingerprint(self, length: int = 12) -> str:
+        """
+        Hash of the taxonomy contents (the columns kept in compact mode, so it is the same
+        whether or not compact or shared mode is used), for keying caches derived from it
+        """
+        if self._fingerprint is None:
+            cols = [col for col in COMPACT_TAXONOMY_COLUMNS if col in self.taxonomy.columns]
+            row_hashes = pd.util.hash_pandas_object(self.taxonomy[cols], index=False)
+            hasher = hashlib.sha1(row_hashes.values.tobytes())
+            hasher.update(','.join(cols).encode('utf-8'))
+            self._fingerprint = hasher.hexdigest()[:length]
+
+        return self._fingerprint
+
+    # -------------------------------- Versions --------------------------------------------------
+
+    def map_names_from_version(self, common_names: Iterable[str],
+                               from_version: str) -> List[Optional[str]]:
+        """
+        Common names from another taxonomy version (e.g. a tally sheet made for an older
+        taxonomy) as named in this one; None where there is no equivalent
+        """
+        return self.registry.map_common_names(common_names, from_version, self.version)
+
+    # -------------------------------- Lookup Indexes --------------------------------------------
+
+    def build_lookup_indexes(self):
+        """
+        Build dictionaries from lowercase common name, lowercase scientific name and
+        speciesCode to compact row records (namedtuples whose Index field is the row position
+        in self.taxonomy). The first row wins for duplicate keys, as with the boolean-mask
+        lookups these replace. Call again if self.taxonomy is replaced.
+        """
+        if self.taxonomy is None:
+            return
+
+        cols = [col for col in TAXONOMY_RECORD_COLUMNS if col in self.taxonomy.columns]
+        self._records = list(self.taxonomy.reset_index(drop=True)[cols].itertuples(
+            index=True, name='TaxonomyRecord'))
+
+        self._common_name_index = {}
+        self._scientific_name_index = {}
+        self._species_code_index = {}
+        for record in self._records:
+            self._common_name_index.setdefault(record.comNameLower, record)
+            self._scientific_name_index.setdefault(record.sciNameLower, record)
+            self._species_code_index.setdefault(record.speciesCode, record)
+
+    @staticmethod
+    def _lookup_key(name) -> Optional[str]:
+        return name.lower() if isinstance(name, str) and name else None
+
     def find_local_name(self, local_name) -> \
             Tuple[Optional[Any], Optional[Any], Optional[Any], Optional[Any]]:
-        record = self.find_local_name_row(local_name)
-        if not record:
+        record = self.find_local_name_record(local_name)
+        if record is None:
             return None, None, None, None
 
         return record.comName, record.TAXON_ORDER, record.SPECIES_GROUP, record.NACC_SORT_ORDER
 
-    def find_local_name_row(self, common_name) -> Optional[pd.Series]:
-        # Look for exact matches
-        if not common_name:
-            return None
+    def find_local_name_record(self, common_name):
+        # Exact (case insensitive) match, as a compact record
+        return self._common_name_index.get(self._lookup_key(common_name))
 
-        record = None
-        try:
-            common_name_lower = common_name.lower()
-            mask = self.taxonomy.comNameLower == common_name_lower
-            records = self.taxonomy[mask]
-            record = records.iloc[0]
+    def find_local_name_records(self, common_names: Iterable[str]) -> list:
+        # Batch version of find_local_name_record for a list or Series
+        index = self._common_name_index
+        lookup_key = self._lookup_key
+        return [index.get(lookup_key(cn)) for cn in common_names]
 
-        except IndexError:
-            pass
+    def find_scientific_name_record(self, scientific_name):
+        return self._scientific_name_index.get(self._lookup_key(scientific_name))
 
-        return record
+    def find_scientific_name_records(self, scientific_names: Iterable[str]) -> list:
+        index = self._scientific_name_index
+        lookup_key = self._lookup_key
+        return [index.get(lookup_key(sn)) for sn in scientific_names]
 
-    def find_scientific_name_row(self, scientific_name) -> Optional[pd.Series]:
-        # Look for exact matches
-        if not scientific_name:
-            return None
+    def find_species6_record(self, species6):
+        return self._species_code_index.get(self._lookup_key(species6))
 
-        record = None
-        try:
-            scientific_name_lower = scientific_name.lower()
-            mask = self.taxonomy.sciNameLower == scientific_name_lower
-            records = self.taxonomy[mask]
-            record = records.iloc[0]
+    def records_at(self, positions: Iterable[int]) -> list:
+        # Records by row position in self.taxonomy, e.g. from NLPContext.candidate_rows
+        return [self._records[position] for position in positions]
 
-        except IndexError:
-            pass
+    def find_local_name_row(self, common_name) -> Optional[pd.Series]:
+        # Look for exact matches
+        record = self.find_local_name_record(common_name)
+        return None if record is None else self.taxonomy.iloc[record.Index]
 
-        return record
+    def find_scientific_name_row(self, scientific_name) -> Optional[pd.Series]:
+        # Look for exact matches
+        record = self.find_scientific_name_record(scientific_name)
+        return None if record is None else self.taxonomy.iloc[record.Index]
 
     # @property
     # def local_to_ebird_translations(self):
     #     return self._local_to_ebird_translations
 
     def species6_to_common_name(self, species6):
-        commonname = species6
-        try:
-            commonname = self.taxonomy[self.taxonomy.speciesCode == species6.lower()].iloc[
-                0].comName
-        except Exception as ee:
-            print(f'{species6} not found: {ee}')
-            traceback.print_exc(file=sys.stdout)
+        record = self.find_species6_record(species6)
+        if record is None:
+            print(f'{species6} not found')
+            return species6
+
+        return record.comName
+
+    def species6_to_common_names(self, species6s: Iterable[str]) -> List[str]:
+        # Batch version of species6_to_common_name, e.g. for the speciesCode column of
+        # checklist details. Unknown codes are passed through and reported once each.
+        index = self._species_code_index
+        lookup_key = self._lookup_key
+        common_names = []
+        not_found = set()
+        for species6 in species6s:
+            record = index.get(lookup_key(species6))
+            if record is None:
+                not_found.add(species6)
+                common_names.append(species6)
+            else:
+                common_names.append(record.comName)
+
+        for species6 in not_found:
+            print(f'{species6} not found')
 
-        return commonname
+        return common_names
 
     # def species6_to_common_name_aou(self, species6):
     #     commonname = species6
@@ -359,17 +604,15 @@ class Taxonomy(object):
     #     return commonname
 
     def find_species6_ebird(self, common_name):
-        try:
-            #         common_name_u = common_name.upper()
-            #         commonname = ebird_taxonomy[ebird_taxonomy.SPECIES_CODE ==
-            #               species6.lower()].iloc[0].COMMON_NAME
-            # ebird-api uses speciesCode
-            species6 = self.taxonomy[self.taxonomy.comName == common_name].iloc[0].speciesCode
-        except Exception as ee:
-            #         print(f'{common_name} not found: {ee} [find_species6_ebird]')
-            species6 = None
+        # ebird-api uses speciesCode. This is a case sensitive match on comName
+        record = self.find_local_name_record(common_name)
+        if record is None or record.comName != common_name:
+            return None
 
-        return species6
+        return record.speciesCode
+
+    def find_species6_ebirds(self, common_names: Iterable[str]) -> List[Optional[str]]:
+        return [self.find_species6_ebird(cn) for cn in common_names]
 
     def merge_clements_into_taxonomy(self) -> pd.DataFrame:
         self.taxonomy = self.taxonomy.merge(self._taxonomy_clements,
@@ -402,87 +645,66 @@ class Taxonomy(object):
 
     # -------------------------------- NACC Ordering --------------------------------------------
 
-    @staticmethod
-    def identify_family_sort_orders(family: pd.DataFrame, sort_col: str) -> list:
-        # family e.g. 'Grebes'
-        need_order = family[family.Category != 'species']
-        family_species = family[family.Category == 'species']  # .reset_index(drop=True)
-        sort_orders = []
-        base_sort_order = 0
-
-        for ix, row in need_order.iterrows():
-            try:
-                base_sort_order = 0
-                if row.Category == 'spuh':
-                    base_sort_order = max(family[sort_col])
-                else:
-                    bc_mask = [len(row.comname_codes & bc) > 0 for bc in
-                               family_species.banding_codes]
-                    if any(bc_mask):
-                        mask = bc_mask
-                    else:
-                        cn_mask = [len(row.comname_codes & bc) > 0 for bc in
-                                   family_species.comname_codes]
-                        mask = cn_mask or bc_mask
-                    parents = family_species[mask]
-                    if not parents.empty:
-                        base_sort_order = max(parents[sort_col])
-
-                # "diurnal raptor sp." is weird
-                if not isinstance(base_sort_order, numbers.Number):
-                    base_sort_order = 0
-
-                if base_sort_order > 0:
-                    sort_orders.append({'comNameLower': row.comNameLower,
-                                        sort_col: base_sort_order,
-                                        'Category': row.Category})
-
-            except Exception as ee:
-                print(ee)
-                display(row)
-                display(family)
-                print(f'base_sort_order: {base_sort_order}, type: {type(base_sort_order)}')
-                raise
-
-        return sort_orders
+    def explode_codes(self, codes_col: str) -> pd.DataFrame:
+        """
+        One row per (taxonomy row, code) for bandingCodes or comNameCodes. These columns hold
+        the repr of a list, e.g. "['BUFF']", so pull out the quoted codes instead of eval'ing
+        :param codes_col: 'bandingCodes' or 'comNameCodes'
+        :return: dataframe with columns 'row' (position in taxonomy) and 'code'
+        """
+        codes = self.taxonomy[codes_col].astype(str).str.findall(r"'([^']+)'")
+        exploded = pd.DataFrame({'row': np.arange(len(codes)), 'code': codes.values})
+
+        return exploded.explode('code').dropna(subset=['code'])
 
     def add_synthesized_sort_orders(self, sort_col: str):
         # Only species have NACC sort orders, so make up some for issf, slash, etc.
-        # this takes 16s to run, so try to cache results. Same for ABA
-
-        # SECURITY WARNING: using eval. Trust your taxonomy file.
-        # These columns contain Python objects, so not appropriate for CSV file
-        self.taxonomy['banding_codes'] = [set(eval(cnc)) for cnc in self.taxonomy.bandingCodes]
-        self.taxonomy['comname_codes'] = [set(eval(cnc)) for cnc in self.taxonomy.comNameCodes]
-
-        sort_orders = []
-
-        for ix, group in enumerate(self.taxonomy.groupby(['order', 'familyComName'])):
-            fam_order, grp = group
-            # order, family = fam_order
-            familydf = grp  # .reset_index(drop=True)
-            grp_sort_orders = self.identify_family_sort_orders(familydf, sort_col)
-            sort_orders.extend(grp_sort_orders)
-
-        # print(f'len(sort_orders): {len(sort_orders)}')
-        sort_orders_df = pd.DataFrame(sort_orders)
-
-        # print(f'sort_orders_df: {sort_orders_df.columns}')
-        addl_sort_orders = sort_orders_df.groupby(sort_col)[sort_col].transform(
-            self.smear_orders)
-        sort_orders_df = sort_orders_df.assign(sort_col=addl_sort_orders)
-
-        # Now set those rows in taxonomy
-        # mask = [(cn in list(sort_orders_df.comNameLower)) for cn in self.taxonomy.comNameLower]
-        # self.taxonomy.loc[mask, 'NACC_SORT_ORDER'] = list(sort_orders_df.NACC_SORT_ORDER)
-
-        # Crappy way, the proper way is eluding me
-        for ix, row in sort_orders_df.iterrows():
-            self.taxonomy.loc[self.taxonomy.comNameLower == row.comNameLower,
-                              sort_col] = row[sort_col]
-
-        # Cleanup
-        self.taxonomy.drop(labels=['banding_codes', 'comname_codes'], axis=1, inplace=True)
+        # Within each (order, familyComName) family:
+        # - a spuh gets the highest sort order in the family
+        # - anything else gets the highest sort order of the species whose banding codes
+        #   share one of its comNameCodes, or failing that, the species whose comNameCodes do
+        # Same for ABA
+        family_keys = ['order', 'familyComName']
+        families = self.taxonomy[family_keys].reset_index(drop=True)
+        families['row'] = np.arange(len(families))
+        families[sort_col] = pd.to_numeric(self.taxonomy[sort_col], errors='coerce').fillna(0).values
+
+        is_species = (self.taxonomy.Category == 'species').values
+        is_spuh = (self.taxonomy.Category == 'spuh').values
+
+        comname_codes = self.explode_codes('comNameCodes')
+        banding_codes = self.explode_codes('bandingCodes')
+
+        need_order = comname_codes[~(is_species | is_spuh)[comname_codes.row.values]]
+        need_order = need_order.merge(families[['row'] + family_keys], on='row')
+
+        def parent_sort_orders(species_codes: pd.DataFrame) -> pd.Series:
+            species = species_codes[is_species[species_codes.row.values]].merge(families, on='row')
+            matches = need_order.merge(species[family_keys + ['code', sort_col]],
+                                       on=family_keys + ['code'])
+            return matches.groupby('row')[sort_col].max()
+
+        base_orders = parent_sort_orders(banding_codes).combine_first(
+            parent_sort_orders(comname_codes))
+
+        family_max = families.groupby(family_keys)[sort_col].transform('max')
+        spuh_orders = family_max[is_spuh]
+
+        synthesized = pd.concat([base_orders, spuh_orders]).rename(sort_col).to_frame()
+        synthesized = synthesized[synthesized[sort_col] > 0]
+        synthesized = synthesized.join(families[family_keys]).rename_axis('row').reset_index()
+
+        # Apply in family order so that, as before, the last family wins when a name is
+        # shared. The orders written are the base orders; the previous implementation also
+        # computed smear_orders but never applied them (see smear_orders).
+        synthesized = synthesized.sort_values(by=family_keys + ['row'], kind='mergesort')
+        synthesized['comNameLower'] = self.taxonomy.comNameLower.values[synthesized.row.values]
+        synthesized = synthesized.drop_duplicates(subset=['comNameLower'], keep='last')
+        new_orders = pd.Series(synthesized[sort_col].values, index=synthesized.comNameLower)
+
+        # Single keyed update
+        mask = self.taxonomy.comNameLower.isin(new_orders.index)
+        self.taxonomy.loc[mask, sort_col] = self.taxonomy.loc[mask, 'comNameLower'].map(new_orders)
 
     # https://stackoverflow.com/questions/59951415/how-do-you-replace-duplicate-values-with-multiple-unique-strings-in-pandas
     @staticmethod
@@ -491,6 +713,8 @@ class Taxonomy(object):
         On input, all elements of orders have the same value, e.g. 777
         This routine smears them across a range so that we would have something like
         [777.01, 777.02, 777.03, ...]
+        Not currently applied by add_synthesized_sort_orders, which keeps the cached sort
+        orders unchanged
         :param orders:
         :return:
         """
@@ -507,27 +731,17 @@ class Taxonomy(object):
     # of subspecies, e.g., Tundra Swan (Bewick’s) or Tundra Swan (Whistling)
 
     def filter_issf(self, common_names: List[str]) -> List[str]:
-        issfs = []
-        for cn in common_names:
-            row = self.find_local_name_row(cn)
-            if row is not None and row.Category == 'issf':
-                issfs.append(cn)
-
-        return issfs
+        return [cn for cn, record in zip(common_names, self.find_local_name_records(common_names))
+                if record is not None and record.Category == 'issf']
 
     def report_as(self, common_name: str) -> Optional[str]:
-        row = self.find_local_name_row(common_name)
-        base_species = self.taxonomy[self.taxonomy.speciesCode == row.reportAs]
-        if base_species.empty:
+        record = self.find_local_name_record(common_name)
+        base_species = None if record is None else self._species_code_index.get(record.reportAs)
+        if base_species is None:
             return None
         else:
-            return base_species.comNameLower.values[0]
+            return base_species.comNameLower
 
     def filter_species(self, common_names: List[str]) -> List[str]:
-        species = []
-        for cn in common_names:
-            row = self.find_local_name_row(cn)
-            if row is not None and row.Category == 'species':
-                species.append(cn)
-
-        return species
+        return [cn for cn, record in zip(common_names, self.find_local_name_records(common_names))
+                if record is not None and record.Category == 'species']
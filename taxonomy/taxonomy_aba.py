@@ -21,6 +21,30 @@ ABA  8.0.7 https://www.aba.org/aba-checklist/ January 2021
 --------------------------------------------------------------------------------
 """
 
+DEFAULT_ABA_FILE = 'ABA_Checklist-8.0.7.csv'
+
+
+def read_aba_taxonomy(aba_taxonomy_path: Path) -> pd.DataFrame:
+    xheader = None
+    aba_taxonomy = pd.read_csv(aba_taxonomy_path, dtype=str, header=xheader,
+                               low_memory=False, skiprows=3).fillna('')
+    aba_taxonomy.columns = ['aba_'+xs for xs in ['Group', 'common_name', 'nom_commun',
+                                                 'scientific_name', 'code4', 'v5']]
+    # Get rid of all the "Group" rows
+    aba_taxonomy[aba_taxonomy.aba_common_name != ''].reset_index(drop=True)
+    aba_taxonomy.drop(columns=['aba_Group', 'aba_v5'], inplace=True)
+
+    # Add ordering column
+    # AOS/AOU ordering seems to be the literal order in the checklist, not the id
+    aba_taxonomy['ABA_SORT_ORDER'] = list(aba_taxonomy.index.astype(int))
+
+    # add lower case column for faster lookups
+    aba_taxonomy['aba_common_name_lower'] = \
+        aba_taxonomy.aba_common_name.apply(lambda xs: xs.lower())
+
+    return aba_taxonomy
+
+
 @singleton
 class TaxonomyABA(object):
     """ Taxonomy from ABA
@@ -28,30 +52,15 @@ class TaxonomyABA(object):
     Attributes:
      """
 
-    def __init__(self):
+    def __init__(self, aba_taxonomy_path: Path = None):
         taxonomy_base_path = Path(__file__).parent.absolute()
         self.taxonomy_reference_path = taxonomy_base_path / 'reference'
 
         self.INVALID_ABA_SORT_ORDER = 999999.1
 
-        self._aba_taxonomy_path = self.taxonomy_reference_path / 'ABA_Checklist-8.0.7.csv'
-        xheader = None
-        self.aba_taxonomy = pd.read_csv(self._aba_taxonomy_path, dtype=str, header=xheader,
-                                   low_memory=False, skiprows=3).fillna('')
-        self.aba_taxonomy.columns = ['aba_'+xs for xs in ['Group', 'common_name', 'nom_commun',
-                                           'scientific_name', 'code4', 'v5']]
-        # Get rid of all the "Group" rows
-        self.aba_taxonomy[self.aba_taxonomy.aba_common_name != ''].reset_index(drop=True)
-        self.aba_taxonomy.drop(columns=['aba_Group', 'aba_v5'], inplace=True)
-
-        # Add ordering column
-        # AOS/AOU ordering seems to be the literal order in the checklist, not the id
-        self.aba_taxonomy['ABA_SORT_ORDER'] = list(self.aba_taxonomy.index.astype(int))
-
-        # add lower case column for faster lookups
-        self.aba_taxonomy['aba_common_name_lower'] = \
-            self.aba_taxonomy.aba_common_name.apply(lambda xs: xs.lower())
-
+        self._aba_taxonomy_path = aba_taxonomy_path or \
+            self.taxonomy_reference_path / DEFAULT_ABA_FILE
+        self.aba_taxonomy = read_aba_taxonomy(self._aba_taxonomy_path)
 
     def get_taxonomy(self) -> pd.DataFrame:
         return self.aba_taxonomy
@@ -0,0 +1,125 @@
+# taxonomy_cache
+# from taxonomy_cache import reference_files_checksum, read_binary_cache, write_binary_cache, \
+#     reference_cache_path, read_reference_cached, write_shared_table, read_shared_table
+
+import hashlib
+import sys
+import traceback
+from pathlib import Path
+from typing import Iterable, Optional, Callable, List
+
+import pandas as pd
+import pyarrow.feather as feather
+
+"""
+Binary (Feather, i.e. Arrow IPC) caches for taxonomy frames. Unlike CSV, these keep dtypes,
+including categoricals, so a frame can be used as soon as it is read.
+
+Cache file names carry a format version and a checksum of the files they were built from,
+e.g. taxonomy_full-v1-3f2a9c0d1e4b.feather, so a changed reference file or a change to the
+format just results in a new cache file.
+"""
+
+# Bump this when the layout or dtypes of a cached frame change
+BINARY_CACHE_VERSION = 1
+BINARY_CACHE_SUFFIX = '.feather'
+
+
+def file_checksum(fpath: Path, hasher=None):
+    hasher = hasher or hashlib.sha1()
+    with open(fpath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            hasher.update(chunk)
+
+    return hasher
+
+
+def reference_files_checksum(fpaths: Iterable[Path], length: int = 12) -> str:
+    # Checksum over names and contents, in a stable order
+    hasher = hashlib.sha1()
+    for fpath in sorted(fpaths):
+        if not fpath.is_file():
+            continue
+        hasher.update(fpath.name.encode('utf-8'))
+        file_checksum(fpath, hasher)
+
+    return hasher.hexdigest()[:length]
+
+
+def binary_cache_path(cache_dir: Path, name_base: str, checksum: str) -> Path:
+    return cache_dir / f'{name_base}-v{BINARY_CACHE_VERSION}-{checksum}{BINARY_CACHE_SUFFIX}'
+
+
+def read_binary_cache(fpath: Path, columns: List[str] = None) -> Optional[pd.DataFrame]:
+    if not fpath.is_file():
+        return None
+
+    try:
+        return pd.read_feather(fpath, columns=columns)
+    except Exception as ee:
+        print(f'Unable to read binary cache {fpath.name}: {ee}')
+
+    return None
+
+
+def write_binary_cache(df: pd.DataFrame, fpath: Path) -> bool:
+    """
+    Write df to fpath and remove caches with the same name base but an older version or
+    checksum. Failure is not fatal, the caller just keeps using the slower path.
+    """
+    # See binary_cache_path for the naming
+    name_base = fpath.stem.rsplit('-', 2)[0]
+    try:
+        df.reset_index(drop=True).to_feather(fpath)
+    except Exception as ee:
+        print(f'Unable to write binary cache {fpath.name}: {ee}')
+        traceback.print_exc(file=sys.stdout)
+        return False
+
+    for stale_path in fpath.parent.glob(f'{name_base}-v*{BINARY_CACHE_SUFFIX}'):
+        if stale_path != fpath and stale_path.stem.rsplit('-', 2)[0] == name_base:
+            stale_path.unlink()
+
+    return True
+
+
+def reference_cache_path(source_path: Path, cache_dir: Path) -> Path:
+    return binary_cache_path(cache_dir, source_path.stem, reference_files_checksum([source_path]))
+
+
+def read_reference_cached(reader: Callable[[Path], pd.DataFrame], source_path: Path,
+                          cache_dir: Path) -> pd.DataFrame:
+    """
+    Parse a reference file with reader, going through a binary cache keyed by the file's
+    checksum so the (slow) xlsx/csv parse only happens once per file.
+    """
+    cache_path = reference_cache_path(source_path, cache_dir)
+    df = read_binary_cache(cache_path)
+    if df is None:
+        df = reader(source_path)
+        write_binary_cache(df, cache_path)
+
+    return df
+
+
+def write_shared_table(df: pd.DataFrame, fpath: Path):
+    # Uncompressed, so readers can memory map it rather than decompress into their own heap
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = fpath.with_suffix('.tmp')
+    df.reset_index(drop=True).to_feather(tmp_path, compression='uncompressed')
+    # Atomic, so a worker never attaches to a half-written file
+    tmp_path.replace(fpath)
+
+
+def read_shared_table(fpath: Path) -> pd.DataFrame:
+    """
+    Attach to a file written by write_shared_table. The table is memory mapped, so the OS
+    shares its pages between processes; split_blocks lets numeric columns and the codes of
+    categorical columns reference the mapped buffers instead of being consolidated into new
+    ones. String columns (and the categories themselves) are still converted to Python
+    objects in each process, so the unique name columns are not shared; attaching saves the
+    load and build of the taxonomy rather than all of its memory.
+    """
+    table = feather.read_table(fpath, memory_map=True)
+
+    return table.to_pandas(split_blocks=True)
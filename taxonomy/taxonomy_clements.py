@@ -38,24 +38,34 @@ eBird/Clements Checklist v2019:
 """
 
 
+DEFAULT_CLEMENTS_FILE = 'eBird_Taxonomy_v2019.xlsx'
+
+
+def read_clements_taxonomy(taxonomy_path: Path) -> pd.DataFrame:
+    taxonomy = pd.read_excel(taxonomy_path, engine="openpyxl")
+
+    # ['TAXON_ORDER', 'CATEGORY', 'SPECIES_CODE', 'PRIMARY_COM_NAME',
+    #  'SCI_NAME', 'ORDER1', 'FAMILY', 'SPECIES_GROUP', 'REPORT_AS']
+
+    # The taxonomy only shows SPECIES_GROUP for first species in group so do a "Fill Down"
+    taxonomy['SPECIES_GROUP'] = taxonomy.SPECIES_GROUP.fillna(method='ffill')
+
+    return taxonomy
+
+
 @singleton
 class TaxonomyClements(object):
-    """ Taxonomy from NACC
+    """ Taxonomy from Clements (eBird taxonomy)
 
     Attributes:
      """
 
-    def __init__(self):
+    def __init__(self, taxonomy_path: Path = None):
         taxonomy_base_path = Path(__file__).parent.absolute()
         self.taxonomy_reference_path = taxonomy_base_path / 'reference'
-        self._taxonomy_path = self.taxonomy_reference_path / 'eBird_Taxonomy_v2019.xlsx'
-        self._taxonomy = pd.read_excel(self._taxonomy_path, engine="openpyxl")
-
-        # ['TAXON_ORDER', 'CATEGORY', 'SPECIES_CODE', 'PRIMARY_COM_NAME',
-        #  'SCI_NAME', 'ORDER1', 'FAMILY', 'SPECIES_GROUP', 'REPORT_AS']
-
-        # The taxonomy only shows SPECIES_GROUP for first species in group so do a "Fill Down"
-        self._taxonomy['SPECIES_GROUP'] = self._taxonomy.SPECIES_GROUP.fillna(method='ffill')
+        self._taxonomy_path = taxonomy_path or \
+            self.taxonomy_reference_path / DEFAULT_CLEMENTS_FILE
+        self._taxonomy = read_clements_taxonomy(self._taxonomy_path)
 
         # For use in main Taxonomy class; some columns not helpful in main taxonomy
         # Columns may also be re-ordered for convenience
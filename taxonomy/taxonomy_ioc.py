@@ -50,6 +50,44 @@ Atlantic, Pacific, Indian, Tropical, Temperate, Northern & Southern Oceans
 """
 
 
+DEFAULT_IOC_FILE = 'IOC_v10-2_v_Clements_2019.xlsx'
+
+# For use in main Taxonomy class; some columns not helpful in main taxonomy
+# Columns are also re-ordered for convenience
+IOC_COLUMNS_TO_KEEP = [
+    'ioc_seq', 'ioc_scientific_name', 'ioc_common_name',
+    'ioc_clements_seq', 'ioc_clements_scientific_name', 'ioc_clements_common_name',
+    'ioc_range'
+]
+
+
+def read_ioc_taxonomy(ioc_taxonomy_path: Path) -> pd.DataFrame:
+    # https://stackoverflow.com/questions/60288732/pandas-read-excel-returns-pendingdeprecationwarning
+    ioc_taxonomy = pd.read_excel(ioc_taxonomy_path, engine="openpyxl")
+
+    # Rename columns with some sanity
+    newcols = [
+        'ioc_seq', 'ioc_scientific_name', 'ioc_common_name',
+        'ioc_range', 'ioc_s',
+        'ioc_c', 'ioc_degree_of_match', 'ioc_clements_seq',
+        'ioc_clements_scientific_name',
+        'ioc_clements_common_name', 'ioc_authority'
+    ]
+
+    # ioc_degree_of_match is sum of 'ioc_s' + 'ioc_c'
+    ioc_taxonomy.columns = newcols
+
+    colnames_numerics_only = ioc_taxonomy.select_dtypes(include=np.number).columns.tolist()
+    fill_values = {col: 0 if col in colnames_numerics_only else ''
+                   for col in ioc_taxonomy.columns}
+    ioc_taxonomy.fillna(fill_values, inplace=True)
+
+    for col in colnames_numerics_only:
+        ioc_taxonomy[col] = ioc_taxonomy[col].astype(int)
+
+    return ioc_taxonomy
+
+
 @singleton
 class TaxonomyIOC(object):
     """ Taxonomy from IOC
@@ -57,44 +95,18 @@ class TaxonomyIOC(object):
     Attributes:
      """
 
-    def __init__(self):
+    def __init__(self, ioc_taxonomy_path: Path = None):
         taxonomy_base_path = Path(__file__).parent.absolute()
         self.taxonomy_reference_path = taxonomy_base_path / 'reference'
         # North America, Middle America, Pacific Ocean, Atlantic Ocean
         self._ranges_to_keep = {'NA', 'MA', 'PO', 'AO'}
         self.range_pattern = re.compile('^([^:]+)')
 
-        self._ioc_taxonomy_path = self.taxonomy_reference_path / 'IOC_v10-2_v_Clements_2019.xlsx'
-        # https://stackoverflow.com/questions/60288732/pandas-read-excel-returns-pendingdeprecationwarning
-        self.ioc_taxonomy = pd.read_excel(self._ioc_taxonomy_path, engine="openpyxl")
-
-        # Rename columns with some sanity
-        newcols = [
-            'ioc_seq', 'ioc_scientific_name', 'ioc_common_name',
-            'ioc_range', 'ioc_s',
-            'ioc_c', 'ioc_degree_of_match', 'ioc_clements_seq',
-            'ioc_clements_scientific_name',
-            'ioc_clements_common_name', 'ioc_authority'
-        ]
-
-        # ioc_degree_of_match is sum of 'ioc_s' + 'ioc_c'
-        self.ioc_taxonomy.columns = newcols
-
-        # For use in main Taxonomy class; some columns not helpful in main taxonomy
-        # Columns are also re-ordered for convenience
-        self.columns_to_keep = [
-            'ioc_seq', 'ioc_scientific_name', 'ioc_common_name',
-            'ioc_clements_seq', 'ioc_clements_scientific_name', 'ioc_clements_common_name',
-            'ioc_range'
-        ]
-
-        colnames_numerics_only = self.ioc_taxonomy.select_dtypes(include=np.number).columns.tolist()
-        fill_values = {col: 0 if col in colnames_numerics_only else ''
-                       for col in self.ioc_taxonomy.columns}
-        self.ioc_taxonomy.fillna(fill_values, inplace=True)
-
-        for col in colnames_numerics_only:
-            self.ioc_taxonomy[col] = self.ioc_taxonomy[col].astype(int)
+        self._ioc_taxonomy_path = ioc_taxonomy_path or \
+            self.taxonomy_reference_path / DEFAULT_IOC_FILE
+        self.ioc_taxonomy = read_ioc_taxonomy(self._ioc_taxonomy_path)
+
+        self.columns_to_keep = IOC_COLUMNS_TO_KEEP
 
         # self.range_pattern = re.compile('^([^:]+)')
         # self.taxonomy_with_ioc = self.merge_ioc_into_taxonomy(self.taxonomy)
@@ -23,6 +23,49 @@ the name of the avibase_id column to "avibase_id" and save as an "Excel Workbook
 """
 
 
+DEFAULT_NACC_FILE = 'NACC_list_species-u.xlsx'
+
+# For use in main Taxonomy class; some columns not helpful in main taxonomy
+# Columns are also re-ordered for convenience
+NACC_COLUMNS_TO_KEEP = [
+    'NACC_SORT_ORDER',
+    'nacc_id', 'nacc_avibase_id', 'nacc_rank', 'nacc_common_name',
+    'nacc_order', 'nacc_family', 'nacc_subfamily', 'nacc_genus', 'nacc_species',
+    'nacc_common_name_lower'
+]
+
+
+def read_nacc_taxonomy(nacc_taxonomy_path: Path) -> pd.DataFrame:
+    # https://stackoverflow.com/questions/60288732/pandas-read-excel-returns-pendingdeprecationwarning
+    nacc_taxonomy = pd.read_excel(nacc_taxonomy_path, engine="openpyxl")
+
+    # Rename columns with nacc_ prefix
+    newcols = {}
+    for col in nacc_taxonomy.columns:
+        newcols[col] = f'nacc_{col}'
+
+    nacc_taxonomy.rename(columns=newcols, inplace=True)
+
+    # Add ordering column
+    # AOS/AOU ordering seems to be the literal order in the checklist, not the id
+    nacc_taxonomy['NACC_SORT_ORDER'] = list(nacc_taxonomy.index.astype(int))
+
+    # add lower case column for faster lookups
+    nacc_taxonomy['nacc_common_name_lower'] = \
+        nacc_taxonomy.nacc_common_name.apply(lambda xs: xs.lower())
+
+    colnames_numerics_only = \
+        nacc_taxonomy.select_dtypes(include=np.number).columns.tolist()
+    fill_values = {col: 0 if col in colnames_numerics_only else ''
+                   for col in nacc_taxonomy.columns}
+    nacc_taxonomy.fillna(fill_values, inplace=True)
+
+    for col in colnames_numerics_only:
+        nacc_taxonomy[col] = nacc_taxonomy[col].astype(int)
+
+    return nacc_taxonomy
+
+
 @singleton
 class TaxonomyNACC(object):
     """ Taxonomy from NACC
@@ -30,7 +73,7 @@ class TaxonomyNACC(object):
     Attributes:
      """
 
-    def __init__(self):
+    def __init__(self, nacc_taxonomy_path: Path = None):
         taxonomy_base_path = Path(__file__).parent.absolute()
         self.taxonomy_reference_path = taxonomy_base_path / 'reference'
         # North America, Middle America, Pacific Ocean, Atlantic Ocean
@@ -38,45 +81,11 @@ class TaxonomyNACC(object):
         self.range_pattern = re.compile('^([^:]+)')
         self.INVALID_NACC_SORT_ORDER = 999999.1
 
-        self._nacc_taxonomy_path = self.taxonomy_reference_path / 'NACC_list_species-u.xlsx'
-
-        # https://stackoverflow.com/questions/60288732/pandas-read-excel-returns-pendingdeprecationwarning
-        self.nacc_taxonomy = pd.read_excel(self._nacc_taxonomy_path, engine="openpyxl")
-
-        # Rename columns with nacc_ prefix
-        newcols = {}
-        for col in self.nacc_taxonomy.columns:
-            newcols[col] = f'nacc_{col}'
-
-        self.nacc_taxonomy.rename(columns=newcols, inplace=True)
-
-        # Add ordering column
-        # AOS/AOU ordering seems to be the literal order in the checklist, not the id
-        self.nacc_taxonomy['NACC_SORT_ORDER'] = list(self.nacc_taxonomy.index.astype(int))
-
-        # add lower case column for faster lookups
-        self.nacc_taxonomy['nacc_common_name_lower'] = \
-            self.nacc_taxonomy.nacc_common_name.apply(lambda xs: xs.lower())
-
-        self.columns_to_keep = [
-            'NACC_SORT_ORDER',
-            'nacc_id', 'nacc_avibase_id', 'nacc_rank', 'nacc_common_name',
-            'nacc_order', 'nacc_family', 'nacc_subfamily', 'nacc_genus', 'nacc_species',
-            'nacc_common_name_lower'
-        ]
-
-        # For use in main Taxonomy class; some columns not helpful in main taxonomy
-        # Columns are also re-ordered for convenience
-        # self.nacc_taxonomy = self.nacc_taxonomy[columns_to_keep]
-
-        colnames_numerics_only = \
-            self.nacc_taxonomy.select_dtypes(include=np.number).columns.tolist()
-        fill_values = {col: 0 if col in colnames_numerics_only else ''
-                       for col in self.nacc_taxonomy.columns}
-        self.nacc_taxonomy.fillna(fill_values, inplace=True)
+        self._nacc_taxonomy_path = nacc_taxonomy_path or \
+            self.taxonomy_reference_path / DEFAULT_NACC_FILE
+        self.nacc_taxonomy = read_nacc_taxonomy(self._nacc_taxonomy_path)
 
-        for col in colnames_numerics_only:
-            self.nacc_taxonomy[col] = self.nacc_taxonomy[col].astype(int)
+        self.columns_to_keep = NACC_COLUMNS_TO_KEEP
 
     def get_taxonomy(self) -> pd.DataFrame:
         return self.nacc_taxonomy[self.columns_to_keep]
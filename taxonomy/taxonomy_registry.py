@@ -0,0 +1,203 @@
+# taxonomy_registry
+# from taxonomy_registry import TaxonomyRegistry
+
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Iterable, Tuple, Union
+
+import pandas as pd
+
+from taxonomy_clements import read_clements_taxonomy, DEFAULT_CLEMENTS_FILE
+from taxonomy_ioc import read_ioc_taxonomy, DEFAULT_IOC_FILE
+from taxonomy_nacc import read_nacc_taxonomy, DEFAULT_NACC_FILE
+from taxonomy_aba import read_aba_taxonomy, DEFAULT_ABA_FILE
+from taxonomy_cache import read_reference_cached, reference_cache_path, read_binary_cache
+
+"""
+Registry of taxonomy versions, so that e.g. a 2019 count can be processed against the 2019
+eBird taxonomy while a current count uses the current one.
+
+A version is keyed by the eBird/Clements year and names the reference files that go with it
+(relative to taxonomy/reference, or absolute). Versions are only loaded when first asked for,
+and each reference file is parsed once into a binary cache (see taxonomy_cache), so later
+runs skip the xlsx parsing. The caches are on disk, so making another registry (e.g. for a
+different cache_path) is cheap.
+
+    registry = TaxonomyRegistry(cache_path)
+    registry.register_version('2021', clements='eBird_Taxonomy_v2021.xlsx')
+    version = registry.version_for_date(parameters.parameters['CountDate'])
+    taxonomy = Taxonomy(cache_path, ebird_extra, version=version, registry=registry)
+    registry.map_common_names(['Gray Jay'], '2019', '2021')
+"""
+
+DEFAULT_TAXONOMY_VERSION = '2019'
+# eBird publishes each year's taxonomy update before the CBC season starts in December
+TAXONOMY_UPDATE_MONTH = 8
+
+REFERENCE_READERS = {
+    'clements': read_clements_taxonomy,
+    'ioc': read_ioc_taxonomy,
+    'nacc': read_nacc_taxonomy,
+    'aba': read_aba_taxonomy,
+}
+
+
+def read_reference_timed(source: str, source_path: Path,
+                         cache_dir: Path) -> Tuple[str, pd.DataFrame, float]:
+    # Module level so it can run in a worker process
+    t0 = time.perf_counter()
+    df = read_reference_cached(REFERENCE_READERS[source], source_path, cache_dir)
+
+    return source, df, time.perf_counter() - t0
+
+
+class TaxonomyRegistry(object):
+    """ Taxonomy versions, loaded lazily
+
+    Attributes:
+     """
+
+    def __init__(self, cache_path: Path = None):
+        taxonomy_base_path = Path(__file__).parent.absolute()
+        self.taxonomy_reference_path = taxonomy_base_path / 'reference'
+        self._cache_path = (cache_path or taxonomy_base_path / 'cache') / 'taxonomy_reference'
+        self._cache_path.mkdir(parents=True, exist_ok=True)
+
+        self._versions = {}  # version -> {source: Path}
+        self._references = {}  # (version, source) -> DataFrame
+
+        self.register_version(DEFAULT_TAXONOMY_VERSION,
+                              clements=DEFAULT_CLEMENTS_FILE, ioc=DEFAULT_IOC_FILE,
+                              nacc=DEFAULT_NACC_FILE, aba=DEFAULT_ABA_FILE)
+
+    def register_version(self, version: str, **source_files):
+        # source_files: clements=..., ioc=..., nacc=..., aba=...; clements is required
+        unknown_sources = set(source_files) - set(REFERENCE_READERS)
+        if unknown_sources:
+            raise ValueError(f'Unknown reference source(s): {sorted(unknown_sources)}')
+        if 'clements' not in source_files:
+            raise ValueError(f'Version {version} needs at least a clements reference file')
+
+        self._versions[version] = {source: self.taxonomy_reference_path / fname
+                                   for source, fname in source_files.items()}
+        # Re-registering a version replaces anything already loaded for it
+        for source in REFERENCE_READERS:
+            self._references.pop((version, source), None)
+
+    def versions(self) -> List[str]:
+        return sorted(self._versions)
+
+    def version_for_date(self, xdate: Union[str, datetime]) -> str:
+        """
+        The taxonomy in effect on xdate (e.g. a CountDate, '2019-12-15'): the latest
+        registered version no later than its season, or the earliest version if all are later.
+        Counts in early January belong to the previous year's season.
+        """
+        if isinstance(xdate, str):
+            xdate = datetime.strptime(xdate, '%Y-%m-%d')
+        season = str(xdate.year if xdate.month >= TAXONOMY_UPDATE_MONTH else xdate.year - 1)
+        versions = self.versions()
+        in_effect = [version for version in versions if version <= season]
+
+        return in_effect[-1] if in_effect else versions[0]
+
+    def sources(self, version: str) -> List[str]:
+        return [source for source in REFERENCE_READERS if source in self._versions[version]]
+
+    def reference_path(self, version: str, source: str) -> Optional[Path]:
+        if version not in self._versions:
+            raise KeyError(f'Taxonomy version {version} is not registered')
+
+        return self._versions[version].get(source, None)
+
+    def get_reference(self, version: str, source: str) -> Optional[pd.DataFrame]:
+        key = (version, source)
+        if key not in self._references:
+            source_path = self.reference_path(version, source)
+            if source_path is None:
+                return None
+            self._references[key] = read_reference_cached(REFERENCE_READERS[source],
+                                                          source_path, self._cache_path)
+
+        return self._references[key]
+
+    def load_references(self, version: str = DEFAULT_TAXONOMY_VERSION,
+                        max_workers: int = None) -> Dict[str, pd.DataFrame]:
+        """
+        Load all the reference frames for a version at once. Sources with a binary cache
+        are just read here; the rest are parsed concurrently in worker processes (and
+        cached for next time). Prints how long each source took.
+        """
+        to_parse = []
+        for source in self.sources(version):
+            if (version, source) in self._references:
+                continue
+            source_path = self.reference_path(version, source)
+            t0 = time.perf_counter()
+            df = read_binary_cache(reference_cache_path(source_path, self._cache_path))
+            if df is None:
+                to_parse.append((source, source_path))
+                continue
+            self._references[(version, source)] = df
+            print(f'  {source:<9} {time.perf_counter() - t0:6.2f}s (cached)')
+
+        if to_parse:
+            max_workers = max_workers or len(to_parse)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(read_reference_timed, source, source_path,
+                                           self._cache_path)
+                           for source, source_path in to_parse]
+                for future in as_completed(futures):
+                    source, df, seconds = future.result()
+                    self._references[(version, source)] = df
+                    print(f'  {source:<9} {seconds:6.2f}s (parsed)')
+
+        return {source: self._references[(version, source)]
+                for source in self.sources(version)}
+
+    def get_clements(self, version: str = DEFAULT_TAXONOMY_VERSION) -> pd.DataFrame:
+        return self.get_reference(version, 'clements')
+
+    def unload(self, version: str):
+        for source in REFERENCE_READERS:
+            self._references.pop((version, source), None)
+
+    def version_mapping(self, from_version: str, to_version: str) -> pd.DataFrame:
+        """
+        One row per from_version taxon, with the to_version name for the same species code.
+        Codes dropped in to_version (e.g. lumps) are matched by scientific name instead;
+        anything left over has an empty to_name.
+        """
+        cols = ['SPECIES_CODE', 'PRIMARY_COM_NAME', 'SCI_NAME']
+        from_taxonomy = self.get_clements(from_version)[cols]
+        to_taxonomy = self.get_clements(to_version)[cols]
+
+        mapping = from_taxonomy.merge(to_taxonomy, how='left', on='SPECIES_CODE',
+                                      suffixes=('_from', '_to'))
+        mapping.rename(columns={'PRIMARY_COM_NAME_from': 'from_name', 'SCI_NAME_from': 'sciName',
+                                'PRIMARY_COM_NAME_to': 'to_name'}, inplace=True)
+
+        by_sci_name = to_taxonomy.drop_duplicates('SCI_NAME').set_index(
+            'SCI_NAME').PRIMARY_COM_NAME
+        missing = mapping.to_name.isna()
+        mapping.loc[missing, 'to_name'] = mapping.loc[missing, 'sciName'].map(by_sci_name)
+        mapping['to_name'] = mapping.to_name.fillna('')
+
+        return mapping[['SPECIES_CODE', 'sciName', 'from_name', 'to_name']]
+
+    def map_common_names(self, common_names: Iterable[str], from_version: str,
+                         to_version: str) -> List[Optional[str]]:
+        # Case-insensitive on the way in; None for names not in from_version, or with no
+        # equivalent in to_version
+        mapping = self.version_mapping(from_version, to_version)
+        mapping = mapping.drop_duplicates('from_name')
+        lookup: Dict[str, str] = dict(zip(mapping.from_name.str.lower(), mapping.to_name))
+
+        to_names = []
+        for name in common_names:
+            to_name = lookup.get(name.lower(), '') if isinstance(name, str) else ''
+            to_names.append(to_name or None)
+
+        return to_names
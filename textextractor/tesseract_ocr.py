@@ -0,0 +1,128 @@
+# tesseract_ocr.py
+# from tesseract_ocr import ocr_file, ocr_image, ocr_bytes, preprocess_image, OCRError, \
+#     TESSERACT_IMAGE_FORMATS
+
+import io
+import subprocess
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Images go to tesseract on stdin and the text comes back on stdout, so nothing is written
+# to disk. Tesseract has no server mode, so it is still one process per image; callers that
+# OCR many images run them from a thread pool (see text_extraction_from_pdf).
+
+TESSERACT_COMMAND = 'tesseract'
+
+# Encoded images (Pillow format names) that tesseract reads as they are
+TESSERACT_IMAGE_FORMATS = {'JPEG', 'PNG', 'GIF', 'BMP', 'TIFF'}
+# Image modes that can be saved as PNG; others (e.g. CMYK) are converted to RGB first
+PNG_MODES = {'1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I', 'I;16'}
+
+# Deskewing tries angles in this range (degrees), on a copy no bigger than this
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_ANGLE_STEP = 0.5
+DESKEW_MAX_SIZE = (800, 800)
+
+
+class OCRError(Exception):
+    pass
+
+
+def ocr_bytes(image_data: bytes) -> str:
+    # image_data is an encoded image (PNG, JPEG, TIFF, ...)
+    # Raises OCRError if tesseract fails, e.g. on an image format it can't read
+    completed = subprocess.run([TESSERACT_COMMAND, 'stdin', 'stdout'], input=image_data,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if completed.returncode != 0:
+        stderr = completed.stderr.decode('utf-8', errors='replace').strip()
+        raise OCRError(f'{TESSERACT_COMMAND} exited with status {completed.returncode}: '
+                       f'{stderr}')
+
+    return completed.stdout.decode('utf-8', errors='replace')
+
+
+def ocr_image(image: Image.Image, preprocess: bool = False) -> str:
+    if preprocess:
+        image = preprocess_image(image)
+    if image.mode not in PNG_MODES:
+        image = image.convert('RGB')
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+
+    return ocr_bytes(buffer.getvalue())
+
+
+def ocr_file(path: Union[Path, str], preprocess: bool = False) -> str:
+    if preprocess:
+        with Image.open(path) as image:
+            return ocr_image(image, preprocess=True)
+
+    with open(path, 'rb') as fp:
+        return ocr_bytes(fp.read())
+
+
+def preprocess_image(image: Image.Image) -> Image.Image:
+    """
+    Grayscale, binarize (Otsu threshold) and deskew, which helps with scanned and
+    photographed tally sheets
+    """
+    image = ImageOps.autocontrast(image.convert('L'))
+    threshold = otsu_threshold(image.histogram())
+    image = image.point([0 if value <= threshold else 255 for value in range(256)])
+
+    angle = estimate_skew(image)
+    if angle:
+        image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    return image
+
+
+def otsu_threshold(histogram: List[int]) -> int:
+    # Gray level that best separates the histogram into dark (ink) and light (paper)
+    total = sum(histogram)
+    sum_all = sum(value * count for value, count in enumerate(histogram))
+    weight_below = 0
+    sum_below = 0
+    best_threshold = 0
+    best_variance = 0.0
+    for value, count in enumerate(histogram):
+        weight_below += count
+        if weight_below == 0:
+            continue
+        weight_above = total - weight_below
+        if weight_above == 0:
+            break
+        sum_below += value * count
+        mean_below = sum_below / weight_below
+        mean_above = (sum_all - sum_below) / weight_above
+        variance = weight_below * weight_above * (mean_below - mean_above) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = value
+
+    return best_threshold
+
+
+def estimate_skew(image: Image.Image) -> float:
+    """
+    Rotation (degrees) that straightens the text lines of a binarized image. Lines of text
+    give the sharpest changes between row sums when they are level.
+    """
+    ink = ImageOps.invert(image)
+    ink.thumbnail(DESKEW_MAX_SIZE)
+
+    best_angle = 0.0
+    best_score = -1.0
+    for angle in np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + DESKEW_ANGLE_STEP / 2,
+                           DESKEW_ANGLE_STEP):
+        rows = np.asarray(ink.rotate(angle, resample=Image.BILINEAR), dtype=float).sum(axis=1)
+        score = float(np.sum(np.diff(rows) ** 2))
+        if score > best_score:
+            best_score = score
+            best_angle = float(angle)
+
+    return 0.0 if abs(best_angle) < DESKEW_ANGLE_STEP / 2 else best_angle
@@ -2,14 +2,11 @@
 # import text_extraction_from_pdf
 
 import io
-import os
-import subprocess
-import tempfile
-from binascii import b2a_hex
 from io import StringIO
 from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from typing import BinaryIO
-from typing import Tuple
+from typing import Tuple, List, Any, Optional
 
 from PIL import Image
 from pdfminer.high_level import extract_pages
@@ -17,6 +14,9 @@ from pdfminer.high_level import extract_text_to_fp
 from pdfminer.layout import LAParams
 from pdfminer.layout import LTFigure, LTImage
 from pdfminer.layout import LTTextContainer
+from pdfminer.pdfpage import PDFPage
+
+from tesseract_ocr import ocr_image, ocr_bytes, TESSERACT_IMAGE_FORMATS
 
 
 # References
@@ -26,61 +26,99 @@ from pdfminer.layout import LTTextContainer
 # https://romanvm.pythonanywhere.com/post/extracting-text-pdf-using-python-34/
 # https://stackoverflow.com/questions/38317327/python-pdfminer-extract-image-produces-multiple-images-per-page-should-be-singl
 
-def extract_all_text_from_pdf(fpath: Path) -> Tuple[str, bool]:
-    all_text = ''
-    processed_image = False
-    for page_layout in extract_pages(fpath.as_posix()):
-        for element in page_layout:
-            #         print(element)
-            if isinstance(element, LTTextContainer):
-                all_text += element.get_text()
-            elif isinstance(element, LTFigure):
-                # print('found image')
-                for elem in element:
-                    # print(elem, isinstance(element, LTImage))
-                    if True:  # isinstance(element, LTImage) and elem.stream:
-                        image_suffix = None
-                        try:
-                            buffer = io.BytesIO(elem.stream.get_data())
-                            image_suffix = determine_image_type(buffer.getvalue()[0:3])
-                            if not image_suffix:
-                                image_suffix = '.png'
-
-                            # print(f'Image type: {determine_image_type(buffer.getvalue()[0:3])}')
-                            pillow_object = Image.open(buffer)
-                            image_temp_file = tempfile.NamedTemporaryFile(suffix=image_suffix, delete=False)
-                            # print(image_temp_file.name)
-                            pillow_object.save(image_temp_file.name)
-                            xstr = ocr(image_temp_file.name)
-                            # print(xstr)
-                            text = '\n'.join(list(filter(lambda xs: len(xs.strip()) > 0, xstr.split('\n'))))
-                            all_text += text
-                            processed_image = True
-                        except Exception as ee:
-                            # print(f'elem.stream: {ee}') #, buf: {buffer.getvalue()[0:6]}')
-                            pass
-                            # with open("debug_buffer.imgx", 'wb') as fp:
-                            #     fp.write(buffer.read())
-
-    # if hasattr(a, 'property'):
-    #     a.property
-
-    return all_text, processed_image
+def extract_all_text_from_pdf(fpath: Path, max_workers: int = None) -> Tuple[str, bool]:
+    pages, processed_image = extract_text_by_page(fpath, max_workers)
 
+    return ''.join(pages), processed_image
 
-def ocr(path):
-    temp = tempfile.NamedTemporaryFile(delete=False)
 
-    process = subprocess.Popen(['tesseract', path, temp.name], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    process.communicate()
+def count_pdf_pages(fpath: Path) -> int:
+    with open(fpath, 'rb') as fp:
+        return sum(1 for _ in PDFPage.get_pages(fp))
 
-    with open(temp.name + '.txt', 'r') as handle:
-        contents = handle.read()
 
-    os.remove(temp.name + '.txt')
-    os.remove(temp.name)
-
-    return contents
+def extract_page_elements(fpath: Path, page_number: int) -> List[Tuple[str, Any]]:
+    """
+    Text and image data for one page (0 based), in layout order. Runs in a worker process,
+    so it returns plain data: ('text', str) or ('image', bytes)
+    """
+    elements = []
+    for page_layout in extract_pages(fpath.as_posix(), page_numbers=[page_number]):
+        for element in page_layout:
+            if isinstance(element, LTTextContainer):
+                elements.append(('text', element.get_text()))
+            elif isinstance(element, LTFigure):
+                for elem in element:
+                    try:
+                        elements.append(('image', elem.stream.get_data()))
+                    except Exception as ee:
+                        # Not an image, or no data
+                        pass
+
+    return elements
+
+
+def ocr_image_data(image_data: bytes, preprocess: bool = False) -> Optional[str]:
+    # OCR text of an image embedded in a PDF, or None if it couldn't be read
+    try:
+        with Image.open(io.BytesIO(image_data)) as pillow_object:
+            # Opening only reads the header; unless preprocessing, formats tesseract reads
+            # go to it as they are, without decoding and re-encoding
+            if not preprocess and pillow_object.format in TESSERACT_IMAGE_FORMATS:
+                xstr = ocr_bytes(image_data)
+            else:
+                xstr = ocr_image(pillow_object, preprocess=preprocess)
+    except Exception as ee:
+        # e.g. OCRError, with tesseract's message
+        print(f'Unable to OCR image: {ee}')
+        return None
+
+    return '\n'.join(list(filter(lambda xs: len(xs.strip()) > 0, xstr.split('\n'))))
+
+
+def extract_text_by_page(fpath: Path, max_workers: int = None,
+                         preprocess: bool = False) -> Tuple[List[str], bool]:
+    """
+    Text of each page, in page order. Pages are laid out in a process pool, and the images
+    they contain are OCR'd in a thread pool (tesseract runs as a separate process) as soon as
+    each page is done, so OCR of early pages overlaps layout of later ones.
+    :param max_workers: for both pools; 1 does everything in this process, in order
+    :param preprocess: grayscale, binarize and deskew images before OCR
+    :return: page texts, and whether any image was OCR'd
+    """
+    num_pages = count_pdf_pages(fpath)
+    page_parts = [[] for _ in range(num_pages)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ocr_executor:
+        def submit_ocr(elements) -> list:
+            return [data if kind == 'text' else
+                    ocr_executor.submit(ocr_image_data, data, preprocess)
+                    for kind, data in elements]
+
+        if num_pages > 1 and max_workers != 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(extract_page_elements, fpath, page_number): page_number
+                           for page_number in range(num_pages)}
+                for future in as_completed(futures):
+                    page_parts[futures[future]] = submit_ocr(future.result())
+        else:
+            for page_number in range(num_pages):
+                page_parts[page_number] = submit_ocr(extract_page_elements(fpath, page_number))
+
+        processed_image = False
+        pages = []
+        for parts in page_parts:
+            texts = []
+            for part in parts:
+                if isinstance(part, Future):
+                    part = part.result()
+                    if part is None:
+                        continue
+                    processed_image = True
+                texts.append(part)
+            pages.append(''.join(texts))
+
+    return pages, processed_image
 
 
 def extract_text_from_pdf_bio(pdf_fo: BinaryIO) -> str:
@@ -102,18 +140,3 @@ def extract_text_from_pdf(fpath: Path) -> str:
         text_result = extract_text_from_pdf_bio(fp)
 
     return text_result
-
-
-def determine_image_type(stream_first_4_bytes):
-    """Find out the image file type based on the magic number comparison of the first 4 (or 2) bytes"""
-    file_type = None
-    bytes_as_hex = b2a_hex(stream_first_4_bytes).decode()
-    if bytes_as_hex.startswith('ffd8'):
-        file_type = '.jpeg'
-    elif bytes_as_hex == '89504e47':
-        file_type = '.png'
-    elif bytes_as_hex == '47494638':
-        file_type = '.gif'
-    elif bytes_as_hex.startswith('424d'):
-        file_type = '.bmp'
-    return file_type
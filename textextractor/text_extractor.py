@@ -1,9 +1,14 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import List, Optional
+
 from more_itertools import unique_everseen
 
 # Local Imports
 from utilities_cbc import read_excel_or_csv_path, circle_abbrev_from_path
 from docx2python import docx2python
-from text_extraction_from_pdf import extract_all_text_from_pdf
+from text_extraction_from_pdf import extract_text_by_page
 
 from text_extractor_image import extract_text_from_image
 
@@ -12,6 +17,19 @@ from singleton_decorator import singleton
 
 # https://realpython.com/factory-method-python/
 
+# Extracted text is cached by file content, so unchanged checklists skip pdfminer and OCR on
+# later runs. Bump an extractor's version when its output changes to ignore old entries.
+EXTRACTED_TEXT_CACHE_DIR = 'extracted_text'
+
+
+def content_checksum(fpath: Path) -> str:
+    hasher = hashlib.sha1()
+    with open(fpath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
 # ------------------------------------------------------------------------
 # Extractions
 # ------------------------------------------------------------------------
@@ -35,15 +53,17 @@ class TextExtractorFactory(object):
         self._formats.add(format)
         self._extractors[format] = extractor
 
-    def get_extractor(self, fpath):
+    def get_extractor(self, fpath, cache_path: Path = None, max_workers: int = None):
         suffix = fpath.suffix
         extractor = self._extractors.get(suffix)
         if not extractor:
             raise ValueError(format)
-        return extractor(fpath)
+        return extractor(fpath, cache_path, max_workers)
 
-    def create(self, fpath):
-        extractor_class = self.get_extractor(fpath)
+    def create(self, fpath, cache_path: Path = None, max_workers: int = None):
+        # With a cache_path, extracted text is cached under cache_path / 'extracted_text'
+        # max_workers is for extractors that run pools (PDF); 1 runs in this process
+        extractor_class = self.get_extractor(fpath, cache_path, max_workers)
         # print(extractor_class, extractor_class.fpath)
         return extractor_class
 
@@ -52,24 +72,75 @@ class TextExtractorFactory(object):
 
 
 class TextExtractor(object):
-    def __init__(self, fpath):
+    version = 1
+
+    def __init__(self, fpath, cache_path: Path = None, max_workers: int = None):
         self.fpath = fpath
         self.suffix = fpath.suffix
         self.circle = circle_abbrev_from_path(fpath)
+        self.cache_path = cache_path
+        self.max_workers = max_workers
         self.lines = []
+        self.pages = []
         self.text = ''
 
     def extract(self, unique: bool = True) -> str:
-        self.text = self._extract()
+        self.pages = self.extract_pages()
+        self.text = ''.join(self.pages)
         self.lines = self.text.split('\n')
         if unique:
             self.lines = list(unique_everseen(self.lines))
         return self.text
 
+    def extract_pages(self) -> List[str]:
+        cache_file = self._cache_file()
+        pages = self._read_cached_pages(cache_file) if cache_file else None
+        if pages is None:
+            pages = self._extract_pages()
+            if cache_file:
+                self._write_cached_pages(cache_file, pages)
+
+        return pages
+
+    def _extract_pages(self) -> List[str]:
+        # Override for formats with pages (e.g. PDF); the text is the pages joined together
+        return [self._extract()]
+
     def _extract(self) -> str:
         # Override
         return 'BASE - OVERRIDE'
 
+    def _cache_file(self) -> Optional[Path]:
+        if self.cache_path is None:
+            return None
+
+        checksum = content_checksum(self.fpath)
+        return self.cache_path / EXTRACTED_TEXT_CACHE_DIR / \
+            f'{checksum}-{type(self).__name__}-v{self.version}.json'
+
+    def _read_cached_pages(self, cache_file: Path) -> Optional[List[str]]:
+        if not cache_file.is_file():
+            return None
+
+        try:
+            with open(cache_file, 'r', encoding="utf-8") as fp:
+                return json.load(fp)['pages']
+        except Exception as ee:
+            print(f'Unable to read extracted text cache {cache_file.name}: {ee}')
+
+        return None
+
+    def _write_cached_pages(self, cache_file: Path, pages: List[str]):
+        # Not fatal; the text just gets extracted again next time
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix('.tmp')
+            with open(tmp_file, 'w', encoding="utf-8") as fp:
+                json.dump({'source': self.fpath.name, 'pages': pages}, fp)
+            tmp_file.replace(cache_file)
+        except Exception as ee:
+            print(f'Unable to write extracted text cache {cache_file.name}: {ee}')
+
 
 class ExcelTextExtractor(TextExtractor):
     def _extract(self) -> str:
@@ -100,10 +171,14 @@ class PlainTextExtractor(TextExtractor):
 
 
 class PDFTextExtractor(TextExtractor):
-    def _extract(self) -> str:
-        text, _ = extract_all_text_from_pdf(self.fpath)
+    def _extract_pages(self) -> List[str]:
+        # One entry per page, including the OCR text of its images
+        pages, _ = extract_text_by_page(self.fpath, self.max_workers)
 
-        return text
+        return pages
+
+    def _extract(self) -> str:
+        return ''.join(self._extract_pages())
 
 
 class MSWordExtractor(TextExtractor):
@@ -1,33 +1,12 @@
 # text_extractor_image.py
 # from text_extractor_image import extract_text_from_image
 
-import tempfile
-import subprocess
-import os
-# from PIL import Image
-# import io
+from tesseract_ocr import ocr_file
 
 
-def ocr(path) -> str:
-    # path is an on-disk file
-    temp = tempfile.NamedTemporaryFile(delete=False)
-
-    process = subprocess.Popen(['tesseract', path, temp.name], stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT)
-    process.communicate()
-
-    with open(temp.name + '.txt', 'r') as handle:
-        contents = handle.read()
-
-    os.remove(temp.name + '.txt')
-    os.remove(temp.name)
-
-    return contents
-
-
-def extract_text_from_image(image_path) -> str:
+def extract_text_from_image(image_path, preprocess: bool = False) -> str:
     print(f'Extracting text from image: {image_path}')
-    xstr = ocr(image_path)
+    xstr = ocr_file(image_path, preprocess=preprocess)
     return xstr
 
 # use code below to handle case where image is bytes in memory (e.g. image embedded in PDF)